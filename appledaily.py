@@ -7,13 +7,14 @@ import logging
 import sqlite3
 import sys
 import datetime
-from random import randint
-from time import sleep
-from urllib.request import urljoin, urlopen
+from urllib.request import urljoin
 
 from bs4 import BeautifulSoup
 
-from utils import PARSER, date_iso, iri_to_uri
+from fetcher import FetchEngine, SiteLimit
+from hzsketch import open_sketch
+from utils import PARSER, date_iso, iri_to_uri, pop_flag
+from webcache import ResponseCache
 
 SQL_CREATE_TABLE_ARTICLES = '''
 CREATE TABLE IF NOT EXISTS articles (
@@ -48,16 +49,86 @@ INSERT OR IGNORE INTO dailies (id, sections, articles, article_count) VALUES (?,
 
 URL_APPLEDAILY = 'http://www.appledaily.com.tw/'
 URL_ARCHIVE = 'http://www.appledaily.com.tw/appledaily/archive/{0}'
+SITE_LIMIT = SiteLimit(rate=0.8, burst=3, min_rate=0.02, max_rate=4.0,
+                       concurrency=4, slow=2.0)
+
+
+def parse_article(html):
+    """(title, subtitle, article) of an article page, None if it has no
+    content
+    """
+    soup = BeautifulSoup(html, PARSER)
+    h1_tag = soup.find('h1', {'id': 'h1'})
+    h2_tag = soup.find('h2', {'id': 'h2'})
+    title = h1_tag.text if h1_tag is not None else ''
+    subtitle = h2_tag.text if h2_tag is not None else ''
+    cont = ''
+    cont_tag = soup.find('div', {'class': 'articulum'})
+    if cont_tag is None:
+        soup.decompose()
+        return None
+    for ctag in cont_tag.find_all(True, recursive=False):
+        if ctag.name in ('p', 'h2'):
+            cont += ctag.text
+    soup.decompose()
+    return title, subtitle, cont
+
+
+def parse_daily_article_tag(article_tag):
+    """(name, [(href, title)]) of an article tag of a daily
+    """
+    name = article_tag.h2.text
+    li_tags = article_tag.find_all('li')
+    news_list = []
+    for li_tag in li_tags:
+        a_tag = li_tag.a
+        if a_tag is None:
+            continue
+        title = a_tag.text if 'title' not in a_tag else a_tag['title']
+        news_list.append((a_tag['href'], title))
+    return (name, news_list)
+
+
+def parse_daily(html):
+    """(sections, articles, article tag count) of a daily archive page,
+    None if it has no "abdominis" <div>
+    """
+    soup = BeautifulSoup(html, PARSER)
+    div = soup.find('div', {'class': 'abdominis'})
+    if div is None:
+        soup.decompose()
+        return None
+    sections = {}
+    articles = {}
+    curr_sec = ''
+    art_tag_cnt = 0
+    for child in div.find_all(True, recursive=False):
+        if child.name == 'section':
+            curr_sec = child.get('id')
+            sections[curr_sec] = child.header.h1.text.strip()
+            articles[curr_sec] = {}
+            for article in child.find_all('article'):
+                art_name, art_news = parse_daily_article_tag(article)
+                art_tag_cnt += 1
+                articles[curr_sec][art_name] = art_news
+        if child.name == 'article':
+            art_name, art_news = parse_daily_article_tag(child)
+            art_tag_cnt += 1
+            articles[curr_sec][art_name] = art_news
+    soup.decompose()
+    return sections, articles, art_tag_cnt
 
 
 class AppleDailyCrawler():
     """Crawler of apple daily
     """
 
-    def __init__(self):
-        self.urlopen_count = 0
+    def __init__(self, from_cache=False):
+        self.sketch = open_sketch('appledaily')
         self.init_db()
         self.init_logger()
+        self.engine = FetchEngine(SITE_LIMIT, logger=self.logger, cache=ResponseCache(
+            'cache-appledaily.db', offline=from_cache))
         self.logger.info(
             '---- [AppleDailyCrawler] ---------------------------')
 
@@ -94,32 +165,6 @@ class AppleDailyCrawler():
         self.logger.addHandler(wfh)
         self.logger.addHandler(dsh)
 
-    def sleep(self, sec=None):
-        """sleep
-        """
-        self.urlopen_count += 1
-        if sec is not None and self.urlopen_count % 10 != 0:
-            sleep(sec)
-            return
-        if self.urlopen_count % 100 == 0:
-            seconds = randint(30, 90)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(0, seconds, 2):
-                print(':', end='', flush=True)
-                sleep(2)
-            print(']')
-        elif self.urlopen_count % 10 == 0:
-            seconds = randint(5, 9)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(seconds):
-                print('.', end='', flush=True)
-                sleep(1)
-            print(']')
-        else:
-            sleep(randint(1, 3))
-
     def contain_article(self, art_id):
         """contain_article
         """
@@ -147,15 +192,17 @@ class AppleDailyCrawler():
         cur.close()
 
     def insert_article(self, article_values):
-        """insert article
+        """insert article, new articles are fed to the frequency sketch
         """
         cur = self.conn.cursor()
         cur.execute(SQL_INSERT_ARTICLE, article_values)
         self.conn.commit()
+        if cur.rowcount == 1:
+            self.sketch.add_text(*article_values[4:])
         cur.close()
 
-    def fetch_article(self, href, section_name):
-        """fetch_article
+    def article_job(self, href, section_name):
+        """(uri, context) job of an article, None if contained
         """
         href = href.replace('\r', ' ')
         url = urljoin(URL_APPLEDAILY, href)
@@ -168,115 +215,94 @@ class AppleDailyCrawler():
         self.logger.info('fetching article[%s] %s...', art_id, href)
         if self.contain_article(art_id):
             self.logger.info('      -> article[%s] contained and skip', art_id)
-            return
+            return None
+        return iri_to_uri(url), (art_id, date_iso(date_str), cate, section_name, href)
 
-        self.sleep(sec=0)
-        #  (art_id, pub_date, category, section, title, subtitle, article)
-        uri = iri_to_uri(url)
-        soup = BeautifulSoup(urlopen(uri), PARSER)
-        h1_tag = soup.find('h1', {'id': 'h1'})
-        h2_tag = soup.find('h2', {'id': 'h2'})
-        title = h1_tag.text if h1_tag is not None else ''
-        subtitle = h2_tag.text if h2_tag is not None else ''
-        cont = ''
-        cont_tag = soup.find('div', {'class': 'articulum'})
-        if cont_tag is None:
+    def save_fetched_article(self, context, parsed):
+        """insert a parsed article page
+        """
+        art_id, href = context[0], context[4]
+        if parsed is None:
             self.logger.error('      -> article[%s] %s has no content',
                               art_id, href)
             return
-        for ctag in cont_tag.find_all(True, recursive=False):
-            if ctag.name in ('p', 'h2'):
-                cont += ctag.text
-        soup.decompose()
-        pub_date = date_iso(date_str)
-        article_values = [art_id, pub_date, cate,
-                          section_name, title, subtitle, cont]
+        #  (art_id, pub_date, category, section, title, subtitle, article)
+        article_values = [*context[:4], *parsed]
         self.insert_article(article_values)
-        self.logger.info('      -> article[%s] %s saved', art_id, title)
+        self.logger.info('      -> article[%s] %s saved', art_id, article_values[4])
+
+    def fetch_article(self, href, section_name):
+        """fetch_article
+        """
+        job = self.article_job(href, section_name)
+        if job is None:
+            return
+        self.save_fetched_article(job[1], parse_article(self.engine.fetch(job[0])))
 
-    def fetch_daily_article_tag(self, article_tag):
-        """fetch_daily_article_tag
+    def fetch_articles(self, links):
+        """fetch (href, section_name) links concurrently
         """
-        name = article_tag.h2.text
-        li_tags = article_tag.find_all('li')
-        news_list = []
-        for li_tag in li_tags:
-            a_tag = li_tag.a
-            if a_tag is None:
-                continue
-            title = a_tag.text if 'title' not in a_tag else a_tag['title']
-            news_list.append((a_tag['href'], title))
-        return (name, news_list)
+        jobs = (self.article_job(*link) for link in links)
+        self.engine.run((job for job in jobs if job is not None),
+                        self.save_fetched_article, parse=parse_article)
 
-    def fetch_day(self, the_day):
-        """fetch_day of DB TABLE `dailies`
+    def day_job(self, the_day):
+        """(url, context) job of a daily, None if contained
         """
         self.logger.info('fetching daily[%s]', the_day)
         str_day = the_day.strftime('%Y%m%d')
         if self.contain_daily(str_day):
             self.logger.info('      -> daily[%s] contained and skip', the_day)
-            return
-        self.sleep(sec=0)
-        url = URL_ARCHIVE.format(str_day)
-        soup = BeautifulSoup(urlopen(url), PARSER)
-        div = soup.find('div', {'class': 'abdominis'})
-        if div is None:
+            return None
+        return URL_ARCHIVE.format(str_day), the_day
+
+    def save_fetched_day(self, the_day, daily):
+        """insert a parsed daily archive page
+        """
+        if daily is None:
             self.logger.error(
                 '      -> daily[%s] Cannot find <div> with class "abdominis"', the_day)
-            soup.decompose()
             return
-        sections = {}
-        articles = {}
-        curr_sec = ''
+        sections, articles, art_tag_cnt = daily
         post_cnt = 0
-        art_tag_cnt = 0
-        for child in div.find_all(True, recursive=False):
-            if child.name == 'section':
-                curr_sec = child.get('id')
-                sec_name = child.header.h1.text.strip()
-                self.logger.debug('SECTION [%s](%s)', sec_name, curr_sec)
-                sections[curr_sec] = sec_name
-                articles[curr_sec] = {}
-                for article in child.find_all('article'):
-                    art_name, art_news = self.fetch_daily_article_tag(article)
-                    art_tag_cnt += 1
-                    post_cnt += len(art_news)
-                    self.logger.debug(
-                        '    ARTICLE [%s] has %d post', art_name, len(art_news))
-                    articles[curr_sec][art_name] = art_news
-            if child.name == 'article':
-                art_name, art_news = self.fetch_daily_article_tag(child)
-                art_tag_cnt += 1
+        for sec in articles:
+            self.logger.debug('SECTION [%s](%s)', sections.get(sec), sec)
+            for art_name, art_news in articles[sec].items():
                 post_cnt += len(art_news)
                 self.logger.debug(
                     '    ARTICLE [%s] has %d post', art_name, len(art_news))
-                articles[curr_sec][art_name] = art_news
-        soup.decompose()
         sections_str = json.dumps(sections, ensure_ascii=False).encode('utf-8')
         articles_str = json.dumps(articles, ensure_ascii=False).encode('utf-8')
-        daily_values = [str_day, sections_str, articles_str, post_cnt]
+        daily_values = [the_day.strftime('%Y%m%d'), sections_str, articles_str, post_cnt]
         self.insert_daily(daily_values)
         self.logger.info(
             '      -> daily[%s] has %d posts in %d/%d sections',
             the_day, post_cnt, len(sections), art_tag_cnt)
 
+    def fetch_day(self, the_day):
+        """fetch_day of DB TABLE `dailies`
+        """
+        job = self.day_job(the_day)
+        if job is None:
+            return
+        self.save_fetched_day(job[1], parse_daily(self.engine.fetch(job[0])))
+
     def fetch_dailies(self, step=1, year=2003, month=5, day=2):
         """fetch_all
         """
         start = datetime.date(year, month, day)
         end = datetime.datetime.now().date()
-        the_day = start
-        while True:
-            if the_day > end:
-                break
-            self.fetch_day(the_day)
-            the_day += datetime.timedelta(days=step)
-
-    def fetch_daily_news(self, limit=7):
-        """fetch_daily_news
+        days = (start + datetime.timedelta(days=i)
+                for i in range(0, (end - start).days + 1, step))
+        jobs = (self.day_job(the_day) for the_day in days)
+        self.engine.run((job for job in jobs if job is not None),
+                        self.save_fetched_day, parse=parse_daily)
+
+    def daily_links(self, rows, limit):
+        """(href, section_name) of the first post of every article tag
+        with at least limit posts in rows of dailies
         """
-        cur = self.conn.cursor()
-        for row in cur.execute(SQL_SELECT_DAILY_SECTIONS):
+        for row in rows:
             # following two lines work on python 3.6, but not python 3.5
             # secs = json.loads(row[1], encoding='utf-8')
             # arts = json.loads(row[2], encoding='utf-8')
@@ -291,7 +317,15 @@ class AppleDailyCrawler():
                         sec_name = '{0}/{1}'.format(secs[sec], art)
                         href = arts[sec][art][0][0]
                         # self.logger.info('%s -> %s', sec_name, href)
-                        self.fetch_article(href, sec_name)
+                        yield href, sec_name
+
+    def fetch_daily_news(self, limit=7):
+        """fetch_daily_news
+        """
+        cur = self.conn.cursor()
+        rows = cur.execute(SQL_SELECT_DAILY_SECTIONS)
+        self.fetch_articles(self.daily_links(rows, limit))
+        cur.close()
 
     def fetch_year_articles(self, year, limit=7):
         """fetch year articles
@@ -299,19 +333,9 @@ class AppleDailyCrawler():
         cur = self.conn.cursor()
         year_cond = '{0}%'.format(year)
         print(year_cond)
-        for row in cur.execute(SQL_SELECT_DAILY_SECTIONS_BY_YEAR, [year_cond]):
-            str_secs = row[1].decode('utf-8')
-            str_arts = row[2].decode('utf-8')
-            secs = json.loads(str_secs)
-            arts = json.loads(str_arts)
-            for sec in arts:
-                for art in arts[sec]:
-                    post_size = len(arts[sec][art])
-                    if post_size >= limit:
-                        sec_name = '{0}/{1}'.format(secs[sec], art)
-                        href = arts[sec][art][0][0]
-                        # self.logger.info('%s -> %s', sec_name, href)
-                        self.fetch_article(href, sec_name)
+        rows = cur.execute(SQL_SELECT_DAILY_SECTIONS_BY_YEAR, [year_cond])
+        self.fetch_articles(self.daily_links(rows, limit))
+        cur.close()
 
     def find_all_sections(self):
         """find_all_sections
@@ -363,25 +387,28 @@ def print_usage():
     print('    year [year]    fetch news-post of the year (must in DB)')
     print('    all-dailies    fetch all dailies news-post list (from 2003-05-02)')
     print('    all-news       fetch all news-post in DB')
+    print('')
+    print('    --from-cache   parse cached responses only, no network')
 
 
 if __name__ == '__main__':
+    FROM_CACHE = pop_flag(sys.argv, '--from-cache')
     if len(sys.argv) < 2:
         print_usage()
         sys.exit(0)
     elif sys.argv[1] == 'all-dailies':
-        CRAWLER = AppleDailyCrawler()
+        CRAWLER = AppleDailyCrawler(FROM_CACHE)
         CRAWLER.fetch_dailies()
     elif sys.argv[1] == 'all-news':
-        CRAWLER = AppleDailyCrawler()
+        CRAWLER = AppleDailyCrawler(FROM_CACHE)
         CRAWLER.fetch_daily_news()
     elif sys.argv[1] == 'year':
-        CRAWLER = AppleDailyCrawler()
+        CRAWLER = AppleDailyCrawler(FROM_CACHE)
         YEARS = sys.argv[2].split(',')
         for year in YEARS:
             CRAWLER.fetch_year_articles(year, limit=5)
     elif sys.argv[1] == 'test':
-        CRAWLER = AppleDailyCrawler()
+        CRAWLER = AppleDailyCrawler(FROM_CACHE)
         # CRAWLER.crawl_article()
         # CRAWLER.crawl_month(2016, 5, 3, 20)
 
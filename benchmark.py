@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Benchmarks of hanzi counting
+"""
+
+import csv
+import importlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import timeit
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from hzcalc import SOURCES, HanziCalculator, count_article, forum_source, save_report
+from hzstats import FreqAccumulator, hanzi_freq, pack_stats, unpack_stats
+from utils import hanzi_count, hanzi_only, is_unihan, pop_option
+
+REPORT_ALL = 'linode-db/report-all.csv'
+NON_HANZI = '，。、「」：；！？（）　 \n0123456789abcdefghijklmnopqrstuvwxyz'
+
+# forum articles of the corpus are all written under this forum_id
+CORPUS_FORUM_ID = '1'
+# synthetic articles per source: (crawler module, insert sql, text size,
+# row builder(i, pub_date, title, text))
+CORPUS_SOURCES = {
+    'apple': ('appledaily', 'SQL_INSERT_ARTICLE', 750,
+              lambda i, d, t, x: [str(i), d, 'cate', 'section', t, t, x]),
+    'books': ('books', 'SQL_INSERT_ARTICLE', 4000,
+              lambda i, d, t, x: [str(i), 'isbn', 'author', 'publisher',
+                                  d, t, x]),
+    'cnyes': ('magcnyes', 'SQL_INSERT_ARTICLE', 1650,
+              lambda i, d, t, x: [str(i), 1, 'col', 'mag', d, t, t, x]),
+    'yahoo': ('newsyahoo', 'SQL_INSERT_ARTICLE', 700,
+              lambda i, d, t, x: [str(i), 'author', 'provider', d,
+                                  'url{0}'.format(i), t, x]),
+    'wiki': ('wikipedia', 'SQL_INSERT_ARTICLE', 6000,
+             lambda i, d, t, x: [t + str(i), d, 'good', 'cate', 'href', x]),
+    'forum': ('forum', 'SQL_INSERT_ARTICLE', 900,
+              lambda i, d, t, x: [str(i), CORPUS_FORUM_ID, 'forum', 'author',
+                                  d, t, t, x]),
+}
+
+
+def corpus_source(key):
+    """hzcalc source of a CORPUS_SOURCES key, forum articles are one forum
+    """
+    return forum_source(CORPUS_FORUM_ID) if key == 'forum' else SOURCES[key]
+
+
+def load_distribution(report_file=REPORT_ALL):
+    """load (chars, counts) of a report csv
+    """
+    chars = []
+    counts = []
+    with open(report_file, encoding='utf8', newline='') as fin:
+        reader = csv.reader(fin)
+        next(reader)
+        for row in reader:
+            chars.append(row[1])
+            counts.append(int(row[3]))
+    return chars, counts
+
+
+def sample_text(size, hanzi_ratio=0.85, seed=0, dist=None):
+    """random text of `size` chars, hanzi drawn from the report distribution
+    """
+    rnd = random.Random(seed)
+    chars, counts = dist or load_distribution()
+    n_hanzi = int(size * hanzi_ratio)
+    text = rnd.choices(chars, weights=counts, k=n_hanzi)
+    text += rnd.choices(NON_HANZI, k=size - n_hanzi)
+    rnd.shuffle(text)
+    return ''.join(text)
+
+
+def per_char_count(text):
+    """the former calc_articles loop: dict count then is_unihan per key
+    """
+    chr_freq = {}
+    for char in text:
+        if char in chr_freq:
+            chr_freq[char] += 1
+        else:
+            chr_freq[char] = 1
+    return {k: v for k, v in chr_freq.items() if is_unihan(k)}
+
+
+def bench_unihan(size=1000000, repeat=5):
+    """compare per-char is_unihan with the bulk hanzi filters
+    """
+    text = sample_text(size)
+    cases = [
+        ('per-char is_unihan filter',
+         lambda: ''.join(c for c in text if is_unihan(c))),
+        ('utils.hanzi_only (regex)', lambda: hanzi_only(text)),
+        ('per-char dict count', lambda: per_char_count(text)),
+        ('utils.hanzi_count (regex)', lambda: hanzi_count(text)),
+        ('hzstats.hanzi_freq (numpy)', lambda: hanzi_freq(text)),
+    ]
+    expected = per_char_count(text)
+    assert dict(hanzi_count(text)) == expected == hanzi_freq(text)
+    print('text size: {0:,} chars, best of {1}'.format(size, repeat))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print('  {0:<28} {1:>8.1f} ms {2:>10,.0f} Kchar/s'.format(
+            name, best * 1000, size / best / 1000))
+
+
+def make_corpus(out_dir, articles=1000, seed=0):
+    """write synthetic source-*.db files of every registered source,
+    return {key: rows written}
+
+    tables are created with the crawlers' own schemas and filled with
+    text drawn from the report-all.csv distribution
+    """
+    rnd = random.Random(seed)
+    dist = load_distribution()
+    written = {}
+    for key, (module, insert_sql, size, build) in CORPUS_SOURCES.items():
+        crawler = importlib.import_module(module)
+        conn = sqlite3.connect(os.path.join(out_dir, corpus_source(key).db_file))
+        conn.execute(crawler.SQL_CREATE_TABLE_ARTICLES)
+        rows = []
+        for i in range(articles):
+            pub_date = '{0:04}-{1:02}-{2:02}'.format(
+                rnd.randint(2003, 2017), rnd.randint(1, 12), rnd.randint(1, 28))
+            title = sample_text(20, seed=rnd.random(), dist=dist)
+            text = sample_text(int(size * rnd.uniform(0.5, 1.5)),
+                               seed=rnd.random(), dist=dist)
+            rows.append(build(i, pub_date, title, text))
+        conn.executemany(getattr(crawler, insert_sql), rows)
+        conn.commit()
+        written[key] = conn.total_changes
+        conn.close()
+    return written
+
+
+def timed(stages, name, rows, func, *args):
+    """run func(*args) and record seconds and rows/s as stage `name`
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    stages[name] = {'seconds': round(seconds, 6),
+                    'rows_per_s': round(rows / seconds, 1) if seconds else None}
+    return result
+
+
+def bench_pipeline(articles=1000, seed=0):
+    """time each hzcalc stage over a synthetic corpus, return result dict
+    """
+    stages = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        written = make_corpus(work_dir, articles, seed)
+        source_rows = {}
+
+        def read_sources():
+            for key in written:
+                source = corpus_source(key)
+                conn = sqlite3.connect(os.path.join(work_dir, source.db_file))
+                conn.row_factory = sqlite3.Row
+                source_rows[key] = conn.execute(source.sql_query).fetchall()
+                conn.close()
+        n_rows = sum(written.values())
+        timed(stages, 'source_read', n_rows, read_sources)
+
+        def count_all():
+            return [count_article(corpus_source(key).src, row)
+                    for key, rows in source_rows.items() for row in rows]
+        counted = timed(stages, 'counting', n_rows, count_all)
+        recs = [rec for rec, _, _ in counted]
+        hanzi_sum = sum(rec[6] for rec in recs)
+
+        timed(stages, 'stats_pack', n_rows,
+              lambda: [pack_stats(cps, counts) for _, cps, counts in counted])
+        timed(stages, 'stats_unpack', n_rows,
+              lambda: [unpack_stats(rec[4]) for rec in recs])
+
+        db_name = os.path.join(work_dir, 'hzfreq.db')
+        calc = HanziCalculator(db_name=db_name, bulk=True)
+
+        def insert_all():
+            calc.begin_load()
+            calc.insert_articles(recs)
+            calc.end_load()
+        timed(stages, 'hzfreq_insert', n_rows, insert_all)
+
+        acc = FreqAccumulator()
+        for _, cps, counts in counted:
+            acc.add(cps, counts)
+        all_hz_freq = acc.to_freq()
+        report_file = os.path.join(work_dir, 'report-all.csv')
+        timed(stages, 'save_report', len(all_hz_freq),
+              save_report, all_hz_freq, report_file)
+        timed(stages, 'calc_all', n_rows, calc.calc_all, db_name, report_file)
+        calc.conn.close()
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'articles': n_rows,
+        'hanzi_sum': hanzi_sum,
+        'stages': stages,
+    }
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} command'.format(sys.argv[0]))
+    print('')
+    print('    unihan [size]                per-char vs bulk hanzi classification')
+    print('    corpus <dir> [n]             write synthetic source-*.db with n articles each')
+    print('    pipeline [n] [--output f]    time hzcalc stages, print (or save) json')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(0)
+    elif sys.argv[1] == 'unihan':
+        bench_unihan(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif sys.argv[1] == 'corpus':
+        make_corpus(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1000)
+    elif sys.argv[1] == 'pipeline':
+        OUTPUT = pop_option(sys.argv, '--output')
+        with redirect_stdout(sys.stderr):
+            RESULT = bench_pipeline(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+        if OUTPUT is None:
+            print(json.dumps(RESULT, indent=2))
+        else:
+            with open(OUTPUT, 'w', encoding='utf8') as fout:
+                json.dump(RESULT, fout, indent=2)
@@ -4,19 +4,15 @@
 import logging
 import sqlite3
 import sys
-from random import randint
-from time import sleep
 from urllib.error import HTTPError
-from urllib.request import urlopen
 
 from bs4 import BeautifulSoup
 
-from utils import PARSER, is_unihan
+from fetcher import FETCH_ERRORS, FETCH_RETRIES, FetchEngine, SiteLimit, is_overload
+from hzsketch import open_sketch
+from utils import PARSER, pop_flag
+from webcache import ResponseCache
 
-import time
-from functools import wraps
-import requests
-from requests.exceptions import ConnectionError, Timeout
 
 SQL_CREATE_TABLE_ARTICLES = '''
 CREATE TABLE IF NOT EXISTS articles (
@@ -76,6 +72,8 @@ URL_PRODUCT = 'http://www.books.com.tw/products/{0}'
 URL_SERIALTEXT = 'http://www.books.com.tw/web/sys_serialtext/?item={0}'
 URL_SERIALTEXT_PAGE = URL_SERIALTEXT + '&page={1}'
 URL_SUBLISTB = 'https://www.books.com.tw/web/sys_sublistb/books/?loc=subject_011'
+SITE_LIMIT = SiteLimit(rate=0.15, burst=1, min_rate=0.01, max_rate=1.0,
+                       concurrency=2, slow=3.0)
 
 
 def print_cate_tree(cate, tier):
@@ -87,56 +85,31 @@ def print_cate_tree(cate, tier):
         for subcate in cate[2]:
             print_cate_tree(subcate, tier+1)
 
-def retry(exceptions, tries=4, delay=3, backoff=2, logger=None):
-    """
-    Retry calling the decorated function using an exponential backoff.
-
-    Args:
-        exceptions: The exception to check. may be a tuple of
-            exceptions to check.
-        tries: Number of times to try (not retry) before giving up.
-        delay: Initial delay between retries in seconds.
-        backoff: Backoff multiplier (e.g. value of 2 will double the delay
-            each retry).
-        logger: Logger to use. If None, print.
-    """
-    def deco_retry(f):
-
-        @wraps(f)
-        def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
-                try:
-                    return f(*args, **kwargs)
-                except exceptions as e:
-                    msg = '{}, Retrying in {} seconds...'.format(e, mdelay)
-                    if logger:
-                        logger.warning(msg)
-                    else:
-                        print(msg)
-                    time.sleep(mdelay)
-                    mtries -= 1
-                    mdelay *= backoff
-            return f(*args, **kwargs)
-
-        return f_retry  # true decorator
 
-    return deco_retry
+BOOKS_HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.87 Safari/537.36'}
 
 
-@retry(requests.exceptions.Timeout, delay=60)
-def call_books(url):
-    return requests.get(url, headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.87 Safari/537.36'})
+def parse_serial_page(html):
+    """text of a serial text page, None if it has no content
+    """
+    soup = BeautifulSoup(html, PARSER)
+    conts = soup.find_all('div', {'class': 'cont'})
+    # text = soup.find_all('div', {'class': 'cont'})[-1].text
+    text = conts[-1].text if len(conts) != 0 else None
+    soup.decompose()
+    return text
 
 
 class BooksCrawler():
     """Crawler of Books.com
     """
 
-    def __init__(self):
-        self.urlopen_count = 0
+    def __init__(self, from_cache=False):
+        self.sketch = open_sketch('books')
         self.init_db()
         self.init_logger()
+        self.engine = FetchEngine(SITE_LIMIT, headers=BOOKS_HEADERS, logger=self.logger,
+                                  cache=ResponseCache('cache-books.db', offline=from_cache))
         self.logger.info('---- [BooksCrawler] ------------------------------')
 
     def init_db(self):
@@ -174,29 +147,6 @@ class BooksCrawler():
         self.logger.addHandler(wfh)
         self.logger.addHandler(dsh)
 
-    def sleep(self):
-        """sleep
-        """
-        self.urlopen_count += 1
-        if self.urlopen_count % 100 == 0:
-            seconds = randint(24, 96)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(0, seconds, 2):
-                print(':', end='', flush=True)
-                sleep(2)
-            print(']')
-        elif self.urlopen_count % 10 == 0:
-            seconds = randint(12, 20)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(seconds):
-                print('.', end='', flush=True)
-                sleep(1)
-            print(']')
-        else:
-            sleep(randint(3, 7))
-
     def contain_book(self, book_no):
         """check if contains book
         """
@@ -215,14 +165,32 @@ class BooksCrawler():
         cur.close()
         return result
 
+    def fetch_page(self, url):
+        """body of url; a network error, 429 or 5xx backs the host off and
+        is retried up to FETCH_RETRIES times, other errors raise at once
+        """
+        tries = 0
+        while True:
+            try:
+                return self.engine.fetch(url)
+            except FETCH_ERRORS as err:
+                tries += 1
+                if (self.engine.offline or tries > FETCH_RETRIES or
+                        isinstance(err, HTTPError) and not is_overload(err)):
+                    raise
+                self.logger.warning('      -> %s fetch fail: %s, retry %d...',
+                                    url, err, tries)
+                if not is_overload(err):
+                    # the fetch backed off overloads itself
+                    self.engine.backoff(url, err)
+
     def get_page_count(self, book_no):
-        """get page count
+        """get page count, 0 if the book has no preview and None if the
+        page could not be fetched
         """
-        self.sleep()
         url = URL_SERIALTEXT.format(book_no)
         try:
-            req = call_books(url)
-            soup = BeautifulSoup(req.text, PARSER)
+            soup = BeautifulSoup(self.fetch_page(url), PARSER)
             span = soup.find_all('div', {'class': 'page'})[-1].span
             page_cnt = int(span.text)
             soup.decompose()
@@ -234,17 +202,16 @@ class BooksCrawler():
             # print(req.text)
             # quit()
             return 0
-        except HTTPError:
-            return 0
+        except FETCH_ERRORS as err:
+            self.logger.error('      -> book[%s] page count fetch fail: %s', book_no, err)
+            return None
 
     def get_book_info(self, book_no):
         """get book info
         """
-        self.sleep()
         url = URL_PRODUCT.format(book_no)
         try:
-            req = call_books(url)
-            soup = BeautifulSoup(req.text, PARSER)
+            soup = BeautifulSoup(self.fetch_page(url), PARSER)
             meta = soup.find('meta', {'itemprop': 'productID'})
             if meta is None:
                 return []
@@ -259,7 +226,7 @@ class BooksCrawler():
                     pub_date = li_text[5:].replace('/', '-')
                 list_item = list_item.find_next_sibling('li')
             return [isbn, publisher, pub_date]
-        except HTTPError:
+        except FETCH_ERRORS:
             return []
 
     def insert_book(self, book_no, page_cnt):
@@ -271,11 +238,13 @@ class BooksCrawler():
         cur.close()
 
     def insert_article(self, article_values):
-        """insert article
+        """insert article, new articles are fed to the frequency sketch
         """
         cur = self.conn.cursor()
         cur.execute(SQL_INSERT_ARTICLE, article_values)
         self.conn.commit()
+        if cur.rowcount == 1:
+            self.sketch.add_text(*article_values[5:])
         cur.close()
 
     def insert_ranking(self, ranking_values):
@@ -312,6 +281,9 @@ class BooksCrawler():
             self.logger.info('      -> book[%s] contained and skip', book_no)
             return
         page_cnt = self.get_page_count(book_no)
+        if page_cnt is None:
+            # not recorded, so the book is tried again on the next run
+            return
         if page_cnt <= 0:
             self.logger.info('      -> book[%s] has no preview', book_no)
             self.insert_book(book_no, page_cnt)
@@ -322,22 +294,24 @@ class BooksCrawler():
             book_info = ['', '', '1970-01-01']
 
         cont = ''
-        for i in range(1, page_cnt + 1):
-            self.sleep()
-            url = URL_SERIALTEXT_PAGE.format(book_no, i)
-            req = call_books(url)
-            soup = BeautifulSoup(req.text, PARSER)
-            conts = soup.find_all('div', {'class': 'cont'})
-            while len(conts) == 0:
-                self.logger.warning('      -> book[%s][%d] IndexError, retry...%s', book_no, i, url)
-                sleep(36)
-                req = call_books(url)
-                soup = BeautifulSoup(req.text, PARSER)
-                conts = soup.find_all('div', {'class': 'cont'})
-            # text = soup.find_all('div', {'class': 'cont'})[-1].text
-            text = conts[-1].text
+        urls = [URL_SERIALTEXT_PAGE.format(book_no, i)
+                for i in range(1, page_cnt + 1)]
+        for i, html in enumerate(self.engine.fetch_many(urls)):
+            text = parse_serial_page(html) if html is not None else None
+            if text is None and self.engine.offline:
+                self.logger.warning('      -> book[%s][%d] not in cache, skip', book_no, i + 1)
+                return
+            while text is None:
+                self.logger.warning('      -> book[%s][%d] IndexError, retry...%s',
+                                    book_no, i + 1, urls[i])
+                self.engine.backoff(urls[i])
+                try:
+                    text = parse_serial_page(self.fetch_page(urls[i]))
+                except FETCH_ERRORS as err:
+                    self.logger.error('      -> book[%s][%d] fetch fail: %s, skip',
+                                      book_no, i + 1, err)
+                    return
             cont += text
-            soup.decompose()
 
         article_values = [book_no, book_info[0], author,
                           book_info[1], book_info[2], title, cont]
@@ -345,7 +319,6 @@ class BooksCrawler():
         self.insert_article(article_values)
         self.logger.info(
             '      -> book[%s] %s %d pages saved', book_no, title, page_cnt)
-        sleep(24)
 
     def crawl_month(self, year, month):
         """crawl_month
@@ -353,10 +326,13 @@ class BooksCrawler():
         對排行榜上每本書做資料收集
         """
         self.logger.info('fetching TOP 100 of %4d-%02d...', year, month)
-        self.sleep()
         url = URL_MONTHTOPB.format(year, month)
-        req = call_books(url)
-        soup = BeautifulSoup(req.text, PARSER)
+        try:
+            soup = BeautifulSoup(self.fetch_page(url), PARSER)
+        except FETCH_ERRORS as err:
+            self.logger.error('      -> TOP 100 of %4d-%02d fetch fail: %s, skip',
+                              year, month, err)
+            return
         for div in soup.find_all('div', {'class': 'type02_bd-a'}):
             top_no = div.parent.find('strong', {'class': 'no'}).text
             title = div.h4.text
@@ -394,11 +370,13 @@ class BooksCrawler():
                 self.logger.info('      -> subject[%s] contained and skip', cate[0])
                 return
             self.logger.info('fetching TOP 100 of %s...', cate_name)
-            self.sleep()
             tail = cate[1].rsplit('/', 1)[-1]
             url = cate[1].replace(tail, '?v=1&o=5')
-            req = call_books(url)
-            soup = BeautifulSoup(req.text, PARSER)
+            try:
+                soup = BeautifulSoup(self.fetch_page(url), PARSER)
+            except FETCH_ERRORS as err:
+                self.logger.error('      -> subject[%s] fetch fail: %s, skip', cate[0], err)
+                return
             top_no = 0
             for h4 in soup.find_all('h4'):
                 div_text_cont = h4.find_next_sibling('div')
@@ -419,8 +397,11 @@ class BooksCrawler():
     def fetch_all_categories(self):
         """fetch_all_categories
         """
-        req = call_books(URL_SUBLISTB)
-        soup = BeautifulSoup(req.text, PARSER)
+        try:
+            soup = BeautifulSoup(self.fetch_page(URL_SUBLISTB), PARSER)
+        except FETCH_ERRORS as err:
+            self.logger.error('      -> categories fetch fail: %s', err)
+            return
         cate0 = ('中文書', URL_SUBLISTB, [])
         for h4 in soup.find_all('h4'):
             tbl = h4.find_next_sibling('table')
@@ -447,20 +428,23 @@ def print_usage():
     print('usage: {0} command'.format(sys.argv[0]))
     print('')
     print('    fetch   fetch ')
+    print('')
+    print('    --from-cache   parse cached responses only, no network')
 
 
 if __name__ == '__main__':
+    FROM_CACHE = pop_flag(sys.argv, '--from-cache')
     if len(sys.argv) < 2:
         print_usage()
         sys.exit(0)
     elif sys.argv[1] == 'all':
-        CRAWLER = BooksCrawler()
+        CRAWLER = BooksCrawler(FROM_CACHE)
         CRAWLER.fetch_all()
     elif sys.argv[1] == 'allcates':
-        CRAWLER = BooksCrawler()
+        CRAWLER = BooksCrawler(FROM_CACHE)
         CRAWLER.fetch_all_categories()
     elif sys.argv[1] == 'test':
-        CRAWLER = BooksCrawler()
+        CRAWLER = BooksCrawler(FROM_CACHE)
         # CRAWLER.crawl_book('0010743217', '房思琪的初戀樂園', '林奕含')
         # CRAWLER.crawl_month(2017, 5)
         # CRAWLER.crawl_book('0010592444', '謎情柯洛斯III', '林奕含')
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Check the fetch engine against a local stand-in server
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fetcher import FETCH_RETRIES, FetchEngine, SiteLimit
+from utils import pop_flag, pop_option
+
+# fast enough to keep the check short, the cap is what is checked
+CHECK_LIMIT = SiteLimit(rate=200.0, burst=4, min_rate=50.0, max_rate=400.0,
+                        concurrency=4, slow=2.0)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """pages of the stand-in server
+
+    /page/<i> answers after delay, /flaky/<i> answers 429 the first time,
+    /dead/<i> always answers 503
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            hits = server.hits[self.path]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            if self.path.startswith('/dead/') or (
+                    self.path.startswith('/flaky/') and hits == 1):
+                status, body = 503 if self.path.startswith('/dead/') else 429, b''
+            else:
+                status, body = 200, 'ok {0}'.format(self.path).encode('utf-8')
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn():
+    """stand-in server on a free local port, served in a daemon thread
+    """
+
+    def __init__(self, delay=0.02):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.delay = delay
+        self.server.lock = threading.Lock()
+        self.server.hits = Counter()
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def parse_body(body):
+    """path a stand-in page was served for, parsed in a worker process
+    """
+    return body.decode('utf-8').split(' ', 1)[1]
+
+
+def check_engine(jobs=200, delay=0.02, flaky_every=10, dead=2, parse=None):
+    """run jobs against a stand-in server, return [(check, passed, detail)]
+
+    every flaky_every-th job is answered 429 once, and dead more jobs
+    always fail
+    """
+    stand_in = StandIn(delay)
+    paths = ['/{0}/{1}'.format('flaky' if i % flaky_every == 0 else 'page', i)
+             for i in range(jobs)]
+    paths += ['/dead/{0}'.format(i) for i in range(dead)]
+    engine = FetchEngine(CHECK_LIMIT)
+    handled = {}
+    failed = []
+
+    def handle(context, body):
+        handled[context] = body
+
+    def on_error(context, err):
+        failed.append(context)
+    started = time.monotonic()
+    try:
+        engine.run(((stand_in.base_url + path, path) for path in paths), handle,
+                   on_error, parse)
+    finally:
+        engine.close()
+        stand_in.close()
+    elapsed = time.monotonic() - started
+    hits = stand_in.server.hits
+    flaky = [path for path in paths if path.startswith('/flaky/')]
+    dead_paths = [path for path in paths if path.startswith('/dead/')]
+    expected = {path: path if parse is not None else 'ok {0}'.format(path).encode('utf-8')
+                for path in paths if not path.startswith('/dead/')}
+    return elapsed, [
+        ('concurrency cap', stand_in.server.max_in_flight <= CHECK_LIMIT.concurrency,
+         '{0} in flight at most, cap {1}'.format(
+             stand_in.server.max_in_flight, CHECK_LIMIT.concurrency)),
+        ('all jobs complete', handled == expected,
+         '{0:,}/{1:,} handled'.format(len(handled), len(expected))),
+        ('429 retried', all(hits[path] == 2 for path in flaky),
+         '{0} flaky jobs fetched {1} times'.format(
+             len(flaky), sum(hits[path] for path in flaky))),
+        ('failures given up', sorted(failed) == dead_paths and
+         all(hits[path] == FETCH_RETRIES + 1 for path in dead_paths),
+         '{0} failed after {1} fetches each'.format(
+             len(failed), FETCH_RETRIES + 1)),
+    ]
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} command'.format(sys.argv[0]))
+    print('')
+    print('    check [jobs] [--delay s] [--parse]')
+    print('            fetch jobs (200) from a local stand-in server and check the')
+    print('            concurrency cap, completion and retries; --parse also runs')
+    print('            the bodies through the parse pool')
+
+
+if __name__ == '__main__':
+    DELAY = float(pop_option(sys.argv, '--delay', 0.02))
+    PARSE = pop_flag(sys.argv, '--parse')
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(0)
+    elif sys.argv[1] == 'check':
+        OK = True
+        for PARSE_FUNC in [None, parse_body] if PARSE else [None]:
+            ELAPSED, RESULTS = check_engine(
+                int(sys.argv[2]) if len(sys.argv) > 2 else 200, DELAY,
+                parse=PARSE_FUNC)
+            print('{0} in {1:.2f} s'.format(
+                'with parse pool' if PARSE_FUNC else 'fetch only', ELAPSED))
+            for NAME, PASSED, DETAIL in RESULTS:
+                print('  {0:<4} {1:<18} {2}'.format('ok' if PASSED else 'FAIL', NAME, DETAIL))
+                OK = OK and PASSED
+        sys.exit(0 if OK else 1)
@@ -0,0 +1,417 @@
+"""Shared fetch engine of the crawlers
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.client import HTTPException
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+from httppool import TIMEOUT, ConnectionPool
+
+# fetches in flight over all hosts
+WORKERS = 16
+# errors failing one fetch, HTTPError, URLError and timeouts are OSError
+FETCH_ERRORS = (OSError, HTTPException)
+# parse worker processes, and bodies queued per worker before fetching
+# pauses
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_BACKLOG = 2
+STAGES = ('fetch', 'parse', 'write')
+# times run requeues a job whose fetch failed on an overloaded host
+FETCH_RETRIES = 3
+
+# politeness of a site: requests/s to start at, burst size, bounds of the
+# adapted rate, concurrent requests, and the latency in seconds above
+# which the rate stops ramping up
+SiteLimit = namedtuple('SiteLimit', ['rate', 'burst', 'min_rate', 'max_rate',
+                                     'concurrency', 'slow'])
+SITE_LIMIT = SiteLimit(rate=1.0, burst=1, min_rate=0.05, max_rate=4.0,
+                       concurrency=4, slow=2.0)
+# AIMD: rate += RATE_STEP per healthy response, rate *= RATE_BACKOFF on an
+# overloaded one
+RATE_STEP = 0.05
+RATE_BACKOFF = 0.5
+
+
+def host_of(url):
+    """host[:port] of url
+    """
+    return urlsplit(url).netloc.lower()
+
+
+def is_overload(err):
+    """True if a failed fetch says the host is overloaded, a 429, a 5xx or
+    a timeout
+    """
+    if isinstance(err, HTTPError):
+        return err.code == 429 or err.code >= 500
+    if isinstance(err, URLError):
+        err = err.reason
+    return isinstance(err, TimeoutError)
+
+
+def retry_after(err):
+    """seconds of the Retry-After header of a failed fetch, 0 if none
+    """
+    headers = getattr(err, 'headers', None)
+    try:
+        return max(float(headers.get('Retry-After', 0)), 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket():
+    """token bucket of one host whose rate adapts by AIMD
+
+    tokens refill at rate per second up to burst and a request takes one,
+    waiting while none is left; healthy responses raise the rate by
+    RATE_STEP, overloaded ones cut it by RATE_BACKOFF, once for all
+    requests started before the cut
+    """
+
+    def __init__(self, limit=SITE_LIMIT):
+        self.limit = limit
+        self.rate = limit.rate
+        self.tokens = float(limit.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff_at = 0.0
+        self.requests = 0
+        self.backoffs = 0
+        self.waited = 0.0
+
+    def take(self, queued=None):
+        """take a token and return 0, or return the seconds to wait before
+        trying again; queued is the monotonic time the caller started
+        waiting for this token, the time since is added to waited once the
+        token is taken
+        """
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate,
+                          float(self.limit.burst))
+        self.updated = now
+        if now < self.paused_until:
+            wait = self.paused_until - now
+        elif self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.requests += 1
+            if queued is not None:
+                self.waited += now - queued
+            return 0.0
+        else:
+            wait = (1.0 - self.tokens) / self.rate
+        return wait
+
+    def success(self, latency):
+        """ramp up after a response in healthy time
+        """
+        if latency <= self.limit.slow:
+            self.rate = min(self.rate + RATE_STEP, self.limit.max_rate)
+
+    def backoff(self, started, pause=0.0):
+        """cut the rate after an overloaded response to a request started
+        at monotonic time started, pause is a Retry-After in seconds;
+        return False if the rate was already cut after it started
+        """
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + pause)
+        if started < self.backoff_at:
+            return False
+        self.rate = max(self.rate * RATE_BACKOFF, self.limit.min_rate)
+        self.tokens = min(self.tokens, 0.0)
+        self.backoff_at = now
+        self.backoffs += 1
+        return True
+
+
+class StageStats():
+    """queue depth of a pipeline stage, sampled every time work moves
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.done = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.samples = 0
+
+    def sample(self, depth):
+        """record the current depth
+        """
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        self.samples += 1
+
+    def mean_depth(self):
+        """mean of the sampled depths
+        """
+        return self.total_depth / max(self.samples, 1)
+
+
+class FetchEngine():
+    """fetch urls concurrently, with a cap and a rate limit per host
+
+    bodies are fetched by a blocking get, on keep-alive connections of
+    pool by default, in worker threads of an asyncio loop and handed back
+    in the calling thread, so the crawler keeps its sqlite connection and
+    parse methods single threaded
+
+    with a ResponseCache, responses are kept on disk and revalidated; an
+    offline cache serves them without the rate limit
+
+    run with a parse function is a pipeline: fetched bodies queue for a
+    pool of parse_workers processes, fetching pauses while the queue is
+    full, and the calling thread writes the results; stages holds the
+    depth of each stage of the last run
+    """
+
+    def __init__(self, site=SITE_LIMIT, hosts=None, workers=WORKERS, get=None,
+                 pool=None, cache=None, headers=None, timeout=TIMEOUT,
+                 parse_workers=PARSE_WORKERS, logger=None):
+        self.site = site
+        # {host: SiteLimit} overriding site
+        self.hosts = hosts or {}
+        self.workers = workers
+        self.pool = pool or ConnectionPool(max(
+            limit.concurrency for limit in [site] + list(self.hosts.values())))
+        self.cache = cache
+        self.get = get or self.cached_get
+        self.headers = headers
+        self.timeout = timeout
+        self.parse_workers = parse_workers
+        self.parsers = None
+        self.stages = {}
+        self.logger = logger
+        self.buckets = {}
+        self.fetch_cnt = 0
+        self.error_cnt = 0
+
+    @property
+    def offline(self):
+        """True if bodies only come from the cache
+        """
+        return self.cache is not None and self.cache.offline
+
+    def cached_get(self, url, data=None, headers=None, timeout=TIMEOUT):
+        """body of url through the cache if any, else from the pool
+        """
+        if self.cache is None:
+            return self.pool.get(url, data, headers, timeout)
+        return self.cache.get(self.pool, url, data, headers, timeout)
+
+    def bucket(self, host):
+        """token bucket of host
+        """
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.hosts.get(host, self.site))
+        return self.buckets[host]
+
+    def feedback(self, url, started, err=None):
+        """adapt the rate of the host of url to the result of a fetch
+        started at monotonic time started
+        """
+        if self.offline:
+            return
+        if err is None:
+            self.bucket(host_of(url)).success(time.monotonic() - started)
+        elif is_overload(err):
+            self.backoff(url, err, started)
+
+    def backoff(self, url, reason='empty page', started=None):
+        """cut the rate of the host of url after an overloaded response,
+        or a page the crawler sees served empty
+        """
+        host = host_of(url)
+        bucket = self.bucket(host)
+        if started is None:
+            started = time.monotonic()
+        if bucket.backoff(started, retry_after(reason)) and self.logger is not None:
+            self.logger.warning('      -> %s overloaded (%s), rate down to %.2f req/s',
+                                host, reason, bucket.rate)
+
+    def fetch(self, url, data=None, headers=None):
+        """body of url, blocking; data is posted and headers add to the
+        engine headers
+        """
+        bucket = self.bucket(host_of(url))
+        queued = time.monotonic()
+        wait = 0.0 if self.offline else bucket.take(queued)
+        while wait > 0:
+            time.sleep(wait)
+            wait = bucket.take(queued)
+        self.fetch_cnt += 1
+        headers = dict(self.headers or {}, **(headers or {}))
+        started = time.monotonic()
+        try:
+            body = self.get(url, data, headers, self.timeout)
+        except FETCH_ERRORS as err:
+            self.feedback(url, started, err)
+            raise
+        self.feedback(url, started)
+        return body
+
+    def parse_pool(self):
+        """the parse worker processes, started on first use
+        """
+        if self.parsers is None:
+            # forkserver, the crawler's threads and sqlite connection are
+            # not forked into the workers
+            self.parsers = ProcessPoolExecutor(
+                self.parse_workers, multiprocessing.get_context('forkserver'))
+        return self.parsers
+
+    def close(self):
+        """stop the parse workers and close the pooled connections
+        """
+        if self.parsers is not None:
+            self.parsers.shutdown()
+            self.parsers = None
+        self.pool.close()
+
+    def run(self, jobs, handle, on_error=None, parse=None):
+        """fetch the url of every (url, context) job concurrently
+
+        handle(context, body) is called as bodies arrive and may return
+        more jobs, e.g. the next page of an article; on_error(context,
+        err) is called on a failed fetch, which is logged by default. a
+        fetch failed on an overloaded host is requeued as (url, context,
+        tries) up to FETCH_RETRIES times before it counts as failed
+
+        with parse, a module level function, handle gets parse(body)
+        computed in a parse worker instead of body, and an exception of
+        parse fails the job like a failed fetch
+        """
+        if parse is not None:
+            self.parse_pool()
+        asyncio.run(self.run_async(iter(jobs), handle, on_error, parse))
+        self.log_stats()
+
+    def fetch_many(self, urls):
+        """bodies of urls in order, None for a failed fetch
+        """
+        bodies = [None] * len(urls)
+
+        def keep(i, body):
+            bodies[i] = body
+        self.run(((url, i) for i, url in enumerate(urls)), keep)
+        return bodies
+
+    def log_error(self, url, err):
+        """log a failed fetch when run has no on_error
+        """
+        if self.logger is not None:
+            self.logger.error('      -> %s fetch fail: %s', url, err)
+        else:
+            print('{0} fetch fail: {1}'.format(url, err))
+
+    def log_stats(self):
+        """log rate, requests, backoffs and waiting time of every host,
+        reuse of its pooled connections and use of the cache
+        """
+        if self.logger is None:
+            return
+        if self.cache is not None:
+            self.logger.info('cache: %d served offline, %d revalidated, %d stored',
+                             self.cache.hits, self.cache.revalidated, self.cache.stored)
+        for stage in self.stages.values():
+            self.logger.info('%s stage: %d done, queue depth %.1f mean, %d max',
+                             stage.name, stage.done, stage.mean_depth(), stage.max_depth)
+        for host, bucket in sorted(self.buckets.items()):
+            self.logger.info('%s: %.2f req/s now, %d requests, %d backoffs, %.1f s total wait',
+                             host, bucket.rate, bucket.requests, bucket.backoffs,
+                             bucket.waited)
+        for host, (conns, requests, reused) in sorted(self.pool.stats.items()):
+            self.logger.info('%s: %d connections for %d requests, %.1f%% reused',
+                             host, conns, requests, 100.0 * reused / max(requests, 1))
+
+    async def run_async(self, jobs, handle, on_error, parse=None):
+        """loop of run, jobs are pulled only while fetch workers are free
+        and the parse queue is not full
+        """
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(self.workers))
+        stages = self.stages = {name: StageStats(name) for name in STAGES
+                                if parse is not None or name != 'parse'}
+        backlog = self.parse_workers * PARSE_BACKLOG
+        sems = {}
+        follow_ups = deque()
+        fetching = set()
+        # {parse future: job}
+        parsing = {}
+        while True:
+            while len(fetching) < self.workers and len(parsing) < backlog:
+                job = follow_ups.popleft() if follow_ups else next(jobs, None)
+                if job is None:
+                    break
+                fetching.add(asyncio.ensure_future(self.fetch_job(job, sems)))
+            if not fetching and not parsing:
+                break
+            stages['fetch'].sample(len(fetching))
+            if parse is not None:
+                stages['parse'].sample(len(parsing))
+            done, _ = await asyncio.wait(
+                fetching | set(parsing), return_when=asyncio.FIRST_COMPLETED)
+            written = []
+            for task in done:
+                if task in fetching:
+                    fetching.discard(task)
+                    stages['fetch'].done += 1
+                    job, body, err = task.result()
+                    if err is None and parse is not None:
+                        parsing[loop.run_in_executor(self.parsers, parse, body)] = job
+                        continue
+                else:
+                    job = parsing.pop(task)
+                    stages['parse'].done += 1
+                    try:
+                        body, err = task.result(), None
+                    except Exception as exc:
+                        body, err = None, exc
+                written.append((job, body, err))
+            stages['write'].sample(len(written))
+            for job, body, err in written:
+                url, context = job[:2]
+                if err is not None:
+                    tries = job[2] if len(job) > 2 else 0
+                    if (not self.offline and tries < FETCH_RETRIES and
+                            is_overload(err)):
+                        follow_ups.append((url, context, tries + 1))
+                        continue
+                    self.error_cnt += 1
+                    if on_error is None:
+                        self.log_error(url, err)
+                    else:
+                        on_error(context, err)
+                    continue
+                stages['write'].done += 1
+                follow_ups.extend(handle(context, body) or [])
+
+    async def fetch_job(self, job, sems):
+        """(job, body, None) of a job, (job, None, err) if it fails
+        """
+        url = job[0]
+        host = host_of(url)
+        bucket = self.bucket(host)
+        if host not in sems:
+            sems[host] = asyncio.Semaphore(bucket.limit.concurrency)
+        async with sems[host]:
+            queued = time.monotonic()
+            wait = 0.0 if self.offline else bucket.take(queued)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = bucket.take(queued)
+            self.fetch_cnt += 1
+            started = time.monotonic()
+            try:
+                body = await asyncio.to_thread(
+                    self.get, url, None, self.headers, self.timeout)
+            except FETCH_ERRORS as err:
+                self.feedback(url, started, err)
+                return job, None, err
+            self.feedback(url, started)
+            return job, body, None
@@ -4,13 +4,14 @@
 import logging
 import sqlite3
 import sys
-from random import randint
-from time import sleep
-from urllib.request import urljoin, urlopen
+from urllib.request import urljoin
 
 from bs4 import BeautifulSoup
 
-from utils import PARSER, date_iso, iri_to_uri
+from fetcher import FetchEngine, SiteLimit
+from hzsketch import open_sketch
+from utils import PARSER, date_iso, iri_to_uri, pop_flag
+from webcache import ResponseCache
 
 SQL_CREATE_TABLE_ARTICLES = '''
 CREATE TABLE IF NOT EXISTS articles (
@@ -28,19 +29,48 @@ INSERT OR IGNORE INTO articles
 
 URL_APPLEDAILY = 'http://www.appledaily.com.tw/'
 URL_BLOGLIST = 'http://www.appledaily.com.tw/appledaily/bloglist/forum/{0}/{1}/'
+SITE_LIMIT = SiteLimit(rate=0.8, burst=3, min_rate=0.02, max_rate=4.0,
+                       concurrency=4, slow=2.0)
+
+
+def parse_article(html):
+    """(title, subtitle, article) of an article page, None if it has no
+    content
+    """
+    soup = BeautifulSoup(html, PARSER)
+    for br_tag in soup.find_all('br'):
+        br_tag.replace_with('\n\n')
+    h1_tag = soup.find('h1', {'id': 'h1'})
+    h2_tag = soup.find('h2', {'id': 'h2'})
+    title = h1_tag.text if h1_tag is not None else ''
+    subtitle = h2_tag.text if h2_tag is not None else ''
+    cont = ''
+    cont_tag = soup.find('div', {'class': 'articulum'})
+    if cont_tag is None:
+        soup.decompose()
+        return None
+    for ctag in cont_tag.find_all(True, recursive=False):
+        if ctag.name == 'p':
+            cont += ctag.text
+        elif ctag.name == 'h2':
+            cont += '## {0}\n\n'.format(ctag.text)
+    soup.decompose()
+    return title, subtitle, cont
 
 
 class AppleForumCrawler():
     """Apple Forum Crawler
     """
 
-    def __init__(self, forum_id):
-        self.urlopen_count = 0
+    def __init__(self, forum_id, from_cache=False):
+        self.sketch = open_sketch('forum')
         self.author = ''
         self.forum_id = ''
         self.forum_name = ''
         self.init_db()
         self.init_logger(forum_id)
+        self.engine = FetchEngine(SITE_LIMIT, logger=self.logger, cache=ResponseCache(
+            'cache-forum.db', offline=from_cache))
 
     def init_db(self):
         """init db
@@ -75,32 +105,6 @@ class AppleForumCrawler():
         self.logger.addHandler(wfh)
         self.logger.addHandler(dsh)
 
-    def sleep(self, sec=None):
-        """sleep
-        """
-        self.urlopen_count += 1
-        if sec is not None and self.urlopen_count % 10 != 0:
-            sleep(sec)
-            return
-        if self.urlopen_count % 100 == 0:
-            seconds = randint(30, 90)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(0, seconds, 2):
-                print(':', end='', flush=True)
-                sleep(2)
-            print(']')
-        elif self.urlopen_count % 10 == 0:
-            seconds = randint(5, 9)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(seconds):
-                print('.', end='', flush=True)
-                sleep(1)
-            print(']')
-        else:
-            sleep(randint(1, 3))
-
     def contain_article(self, art_id):
         """check if contains article
         """
@@ -110,44 +114,45 @@ class AppleForumCrawler():
         cur.close()
         return result
 
-    def fetch_article(self, href, title):
-        """fetch article
+    def article_values(self, href, parsed):
+        """article values of a parsed article page, [] if it has no content
         """
         tokens = href.split('/')
         art_id = tokens[5]
         pub_date = date_iso(tokens[4])
-        self.sleep(sec=0)
-        url = urljoin(URL_APPLEDAILY, href)
-        uri = iri_to_uri(url)
-        soup = BeautifulSoup(urlopen(uri), PARSER)
-        for br_tag in soup.find_all('br'):
-            br_tag.replace_with('\n\n')
-        h1_tag = soup.find('h1', {'id': 'h1'})
-        h2_tag = soup.find('h2', {'id': 'h2'})
-        title = h1_tag.text if h1_tag is not None else ''
-        subtitle = h2_tag.text if h2_tag is not None else ''
-        cont = ''
-        cont_tag = soup.find('div', {'class': 'articulum'})
-        if cont_tag is None:
+        if parsed is None:
             self.logger.error('      -> article[%s] %s has no content',
                               art_id, href)
             return []
-        for ctag in cont_tag.find_all(True, recursive=False):
-            if ctag.name == 'p':
-                cont += ctag.text
-            elif ctag.name == 'h2':
-                cont += '## {0}\n\n'.format(ctag.text)
-        soup.decompose()
         # art_id, forum_id, forum_name, author, pub_date, title, article
         return [art_id, self.forum_id, self.forum_name, self.author,
-                pub_date, title, subtitle, cont]
+                pub_date, *parsed]
+
+    def fetch_article(self, href, title):
+        """fetch article
+        """
+        url = urljoin(URL_APPLEDAILY, href)
+        uri = iri_to_uri(url)
+        return self.article_values(href, parse_article(self.engine.fetch(uri)))
+
+    def save_fetched_article(self, art_info, parsed):
+        """save a parsed article of a list page
+        """
+        art_values = self.article_values(art_info[0], parsed)
+        if len(art_values) == 0:
+            return
+        self.save_article(art_values)
+        self.logger.info(
+            '      -> article[%s] %s saved', art_values[0], art_info[1])
 
     def save_article(self, article_values):
-        """save article
+        """save article, new articles are fed to the frequency sketch
         """
         cur = self.conn.cursor()
         cur.execute(SQL_INSERT_ARTICLE, article_values)
         self.conn.commit()
+        if cur.rowcount == 1:
+            self.sketch.add_text(*article_values[5:])
         cur.close()
 
     def fetch(self, forum_id, count):
@@ -158,10 +163,9 @@ class AppleForumCrawler():
         page = 1
         exit_loop = False
         while not exit_loop:
-            self.sleep()
             self.logger.info('fetching page %d...', page)
             url = URL_BLOGLIST.format(forum_id, page)
-            soup = BeautifulSoup(urlopen(url), PARSER)
+            soup = BeautifulSoup(self.engine.fetch(url), PARSER)
             if self.author == '':
                 h2_tag = soup.find('h2', {'class': 'auw'})
                 if h2_tag is not None:
@@ -173,37 +177,26 @@ class AppleForumCrawler():
             li_tags = ul_tag.find_all('li')
             if li_tags is None or len(li_tags) == 0:
                 break
-            art_list = []
+            jobs = []
             for li_tag in li_tags:
                 a_tag = li_tag.find('a')
                 if a_tag is None:
                     continue
-                href = a_tag.get('href')
-                title = a_tag.text
-                art_list.append((href, title))
-            for art_info in art_list:
-                tokens = art_info[0].split('/')
-                art_id = tokens[5]
+                art_info = (a_tag.get('href'), a_tag.text)
+                art_id = art_info[0].split('/')[5]
                 self.logger.info(
                     'fetching article[%s] %s...', art_id, art_info[1])
                 if self.contain_article(art_id):
                     self.logger.info(
                         '      -> article[%s] contained and skip', art_id)
-                    loop -= 1
-                    if loop <= 0:
-                        exit_loop = True
-                        break
-                    continue
-                art_values = self.fetch_article(*art_info)
-                if len(art_values) == 0:
-                    continue
-                self.save_article(art_values)
-                self.logger.info(
-                    '      -> article[%s] %s saved', art_id, art_info[1])
+                else:
+                    uri = iri_to_uri(urljoin(URL_APPLEDAILY, art_info[0]))
+                    jobs.append((uri, art_info))
                 loop -= 1
                 if loop <= 0:
                     exit_loop = True
                     break
+            self.engine.run(jobs, self.save_fetched_article, parse=parse_article)
             page += 1
 
 
@@ -215,12 +208,15 @@ def print_usage():
     print('    fetch all if <count> == `-1`')
     print('')
     print('ex.    {0} 926953 100'.format(sys.argv[0]))
+    print('')
+    print('    --from-cache   parse cached responses only, no network')
 
 
 if __name__ == '__main__':
+    FROM_CACHE = pop_flag(sys.argv, '--from-cache')
     if len(sys.argv) < 3:
         print_usage()
         sys.exit(0)
     else:
-        CRAWLER = AppleForumCrawler(sys.argv[1])
+        CRAWLER = AppleForumCrawler(sys.argv[1], FROM_CACHE)
         CRAWLER.fetch(sys.argv[1], sys.argv[2])
@@ -0,0 +1,127 @@
+"""Keep-alive HTTP connection pool
+"""
+
+import gzip
+import sys
+import threading
+from http.client import BadStatusLine, HTTPConnection, HTTPSConnection
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+TIMEOUT = 30.0
+# idle connections kept per host
+MAX_IDLE = 4
+MAX_REDIRECTS = 5
+REDIRECTS = (301, 302, 303, 307, 308)
+# same default as urlopen
+USER_AGENT = 'Python-urllib/{0}.{1}'.format(*sys.version_info[:2])
+# a kept connection the server has closed meanwhile fails with one of these
+STALE_ERRORS = (ConnectionError, BadStatusLine)
+
+
+class ConnectionPool():
+    """idle keep-alive connections per scheme and host, safe to share
+    between threads; a connection is used by one request at a time
+
+    stats of a host are [connections opened, requests, requests on a
+    reused connection]
+    """
+
+    def __init__(self, max_idle=MAX_IDLE):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, scheme, host, timeout):
+        """(connection, reused) to scheme://host
+        """
+        with self.lock:
+            stats = self.stats.setdefault(host, [0, 0, 0])
+            stats[1] += 1
+            idle = self.idle.get((scheme, host))
+            if idle:
+                stats[2] += 1
+                conn = idle.pop()
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            stats[0] += 1
+        if scheme == 'https':
+            return HTTPSConnection(host, timeout=timeout), False
+        return HTTPConnection(host, timeout=timeout), False
+
+    def release(self, scheme, host, conn):
+        """keep conn for the next request to scheme://host
+        """
+        with self.lock:
+            idle = self.idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=TIMEOUT):
+        """(status, reason, headers, body) of one request, redirects are
+        not followed and gzip bodies are decoded
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'},
+                       **(headers or {}))
+        while True:
+            conn, reused = self.acquire(parts.scheme, parts.netloc, timeout)
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except STALE_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self.release(parts.scheme, parts.netloc, conn)
+            if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+                data = gzip.decompress(data)
+            return resp.status, resp.reason, resp.headers, data
+
+    def open(self, url, data=None, headers=None, timeout=TIMEOUT):
+        """(status, headers, body) of url following redirects, data is
+        posted; HTTPError on an error status, like urlopen
+        """
+        method = 'GET' if data is None else 'POST'
+        for _ in range(MAX_REDIRECTS + 1):
+            status, reason, resp_headers, body = self.request(
+                method, url, data, headers, timeout)
+            location = resp_headers.get('Location')
+            if status not in REDIRECTS or location is None:
+                break
+            url = urljoin(url, location)
+            if status not in (307, 308):
+                method, data = 'GET', None
+        if status >= 400 or status in REDIRECTS:
+            raise HTTPError(url, status, reason, resp_headers, BytesIO(body))
+        return status, resp_headers, body
+
+    def get(self, url, data=None, headers=None, timeout=TIMEOUT):
+        """body of url, see open
+        """
+        return self.open(url, data, headers, timeout)[2]
+
+    def close(self):
+        """close the idle connections
+        """
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
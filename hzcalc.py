@@ -3,11 +3,21 @@
 """
 
 import csv
+import hashlib
 import json
+import os
 import sqlite3
 import sys
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from itertools import islice, repeat
 
-from utils import datetime_iso, is_unihan, is_unihan_ext
+from hzngram import TOP_NGRAMS, NgramCounter
+from hzstats import (BucketAccumulator, FreqAccumulator, count_hanzi,
+                     is_packed, pack_stats, save_snapshot, snapshot_file,
+                     unpack_stats)
+from utils import Progress, datetime_iso, has_unihan_ext, pop_flag, pop_option
 
 
 SQL_CREATE_ARTICLES = '''
@@ -16,195 +26,971 @@ CREATE TABLE IF NOT EXISTS articles (
     PRIMARY KEY(src, idx)
 )
 '''
+SQL_CREATE_SRC_FREQ = '''
+CREATE TABLE IF NOT EXISTS src_freq (
+    src TEXT, hanzi TEXT, cnt INTEGER,
+    PRIMARY KEY(src, hanzi)
+)
+'''
+SQL_CREATE_SRC_TOTALS = '''
+CREATE TABLE IF NOT EXISTS src_totals (
+    src TEXT, art_cnt INTEGER, hanzi_sum INTEGER,
+    PRIMARY KEY(src)
+)
+'''
+SQL_CREATE_MONTH_FREQ = '''
+CREATE TABLE IF NOT EXISTS month_freq (
+    src TEXT, month TEXT, hanzi TEXT, cnt INTEGER,
+    PRIMARY KEY(src, month, hanzi)
+)
+'''
+SQL_CREATE_MONTH_TOTALS = '''
+CREATE TABLE IF NOT EXISTS month_totals (
+    src TEXT, month TEXT, art_cnt INTEGER, hanzi_sum INTEGER,
+    PRIMARY KEY(src, month)
+)
+'''
+SQL_CREATE_REPORT_CACHE = '''
+CREATE TABLE IF NOT EXISTS report_cache (
+    report_file TEXT, digest TEXT, saved_at TEXT,
+    PRIMARY KEY(report_file)
+)
+'''
+SQL_CREATE_SOURCE_STATES = '''
+CREATE TABLE IF NOT EXISTS source_states (
+    src TEXT, state TEXT,
+    PRIMARY KEY(src)
+)
+'''
+SQL_CREATE_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS articles_pub_date ON articles (src, pub_date)''',
+]
+SQL_DROP_INDEXES = [
+    '''DROP INDEX IF EXISTS articles_pub_date''',
+]
 SQL_INSERT_ARTICLES = '''
 INSERT OR IGNORE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?)
 '''
+SQL_CONTAIN_TABLE = '''
+SELECT 1 FROM sqlite_master WHERE type='table' AND name=?
+'''
+SQL_ANY_ARTICLE = '''
+SELECT 1 FROM articles LIMIT 1
+'''
+SQL_CONTAIN_ARTICLE = '''
+SELECT 1 FROM articles WHERE src=? AND idx=?
+'''
 SQL_SELECT_ARTICLES = '''
 SELECT * FROM articles
 '''
-SQL_SELECT_BY_FORUM_ID = '''
-SELECT art_id, title, article FROM articles WHERE forum_id=? AND article like "%男女%" LIMIT 500
+SQL_COUNT_ARTICLES = '''
+SELECT COUNT(*) FROM articles
+'''
+SQL_SELECT_TEXTS = '''
+SELECT idx, raw_txt FROM articles
+'''
+SQL_COUNT_QUERY = '''
+SELECT COUNT(*) FROM ({0})
+'''
+SQL_SELECT_SRC_STATS = '''
+SELECT src, stats FROM articles
+'''
+SQL_SELECT_MONTH_STATS = '''
+SELECT src, pub_date, stats FROM articles ORDER BY src, pub_date
+'''
+SQL_UPSERT_SRC_FREQ = '''
+INSERT INTO src_freq VALUES (?, ?, ?)
+    ON CONFLICT(src, hanzi) DO UPDATE SET cnt = cnt + excluded.cnt
+'''
+SQL_UPSERT_SRC_TOTALS = '''
+INSERT INTO src_totals VALUES (?, ?, ?)
+    ON CONFLICT(src) DO UPDATE SET art_cnt = art_cnt + excluded.art_cnt,
+                                   hanzi_sum = hanzi_sum + excluded.hanzi_sum
+'''
+SQL_UPSERT_MONTH_FREQ = '''
+INSERT INTO month_freq VALUES (?, ?, ?, ?)
+    ON CONFLICT(src, month, hanzi) DO UPDATE SET cnt = cnt + excluded.cnt
+'''
+SQL_UPSERT_MONTH_TOTALS = '''
+INSERT INTO month_totals VALUES (?, ?, ?, ?)
+    ON CONFLICT(src, month) DO UPDATE SET art_cnt = art_cnt + excluded.art_cnt,
+                                          hanzi_sum = hanzi_sum + excluded.hanzi_sum
+'''
+SQL_SELECT_SRC_FREQ = '''
+SELECT src, hanzi, cnt FROM src_freq
+'''
+SQL_SELECT_SRC_TOTALS = '''
+SELECT src, art_cnt, hanzi_sum FROM src_totals
+'''
+SQL_SELECT_FREQ_OF_SRC = '''
+SELECT hanzi, cnt FROM src_freq WHERE src=?
+'''
+SQL_SELECT_TOTALS_OF_SRC = '''
+SELECT art_cnt FROM src_totals WHERE src=?
+'''
+SQL_SELECT_SRC_MAX_ROWID = '''
+SELECT MAX(rowid) FROM articles WHERE src=?
+'''
+SQL_SELECT_SRC_CHECKSUM = '''
+SELECT COUNT(*), SUM(cnt * unicode(hanzi)) FROM src_freq WHERE src=?
+'''
+SQL_SELECT_REPORT_CACHE = '''
+SELECT digest FROM report_cache WHERE report_file=?
+'''
+SQL_UPSERT_REPORT_CACHE = '''
+INSERT OR REPLACE INTO report_cache (report_file, digest, saved_at) VALUES (?, ?, ?)
+'''
+SQL_SELECT_SOURCE_STATE_OF = '''
+SELECT state FROM source_states WHERE src=?
+'''
+SQL_UPSERT_SOURCE_STATE = '''
+INSERT OR REPLACE INTO source_states (src, state) VALUES (?, ?)
+'''
+SQL_SELECT_ALL_FREQ = '''
+SELECT hanzi, SUM(cnt) FROM src_freq GROUP BY hanzi
+'''
+SQL_SELECT_ALL_TOTALS = '''
+SELECT SUM(art_cnt) FROM src_totals
+'''
+SQL_SELECT_MONTH_TOTALS = '''
+SELECT src, month, art_cnt, hanzi_sum FROM month_totals
+'''
+SQL_SCAN_MONTH_TOTALS = '''
+SELECT src, substr(pub_date, 1, 7), COUNT(*), SUM(hanzi_sum) FROM articles GROUP BY 1, 2
+'''
+SQL_SELECT_RANGE_FREQ = '''
+SELECT hanzi, SUM(cnt) FROM month_freq WHERE src=? AND month BETWEEN ? AND ? GROUP BY hanzi
+'''
+SQL_SELECT_RANGE_TOTALS = '''
+SELECT SUM(art_cnt) FROM month_totals WHERE src=? AND month BETWEEN ? AND ?
+'''
+SQL_DELETE_AGGREGATE = [
+    '''DELETE FROM src_freq''',
+    '''DELETE FROM src_totals''',
+    '''DELETE FROM month_freq''',
+    '''DELETE FROM month_totals''',
+]
+SQL_SELECT_STATS_CHUNK = '''
+SELECT rowid, stats FROM articles WHERE rowid > ? ORDER BY rowid LIMIT ?
+'''
+SQL_UPDATE_STATS = '''
+UPDATE articles SET stats=? WHERE rowid=?
+'''
+SQL_SELECT_SOURCE_STATE = '''
+SELECT COUNT(*), MAX(src_rowid) FROM ({0})
 '''
+SQL_SELECT_ROWID_BOUNDS = '''
+SELECT MIN(src_rowid), MAX(src_rowid) FROM ({0})
+'''
+SQL_SELECT_ROWID_RANGE = '''
+SELECT * FROM ({0}) WHERE src_rowid BETWEEN ? AND ?
+'''
+
+
+Source = namedtuple('Source', ['src', 'db_file', 'sql_query', 'sql_section'])
+
+# registered sources: command key -> (src, source db, source query,
+# (art_id, section) query)
+SOURCES = {
+    'apple': Source(
+        'news.apple',
+        'source-appledaily.db',
+        '''SELECT rowid AS src_rowid, art_id, pub_date,
+           title || x'0a' || subtitle || x'0a0a' || article AS raw_text
+           FROM articles''',
+        'SELECT art_id, section FROM articles'),
+    'books': Source(
+        'books',
+        'source-books.db',
+        '''SELECT rowid AS src_rowid, book_no AS art_id, pub_date,
+           title || article AS raw_text
+           FROM articles''',
+        'SELECT book_no, publisher FROM articles'),
+    'cnyes': Source(
+        'mag.cnyes',
+        'source-magcnyes.db',
+        '''SELECT rowid AS src_rowid, art_id, pub_date,
+           full_title || x'0a0a' || article AS raw_text
+           FROM articles''',
+        'SELECT art_id, col_name FROM articles'),
+    'yahoo': Source(
+        'news.yahoo',
+        'source-newsyahoo.db',
+        '''SELECT rowid AS src_rowid, id AS art_id, pub_date,
+           title || x'0a0a' || article AS raw_text
+           FROM articles''',
+        'SELECT id, publisher FROM articles'),
+    'wiki': Source(
+        'wikipedia',
+        'source-wikipedia.db',
+        '''SELECT rowid AS src_rowid, title AS art_id, open_date AS pub_date,
+           title || x'0a0a' || article AS raw_text
+           FROM articles''',
+        'SELECT title, category FROM articles'),
+}
+
+
+FORUM_PREFIX = 'appledaily.forum.'
+
+
+def forum_source(fid):
+    """source of an appledaily forum author, counted into hzfreq-forum.db
+    """
+    return Source(
+        FORUM_PREFIX + str(fid),
+        'source-forum.db',
+        '''SELECT rowid AS src_rowid, art_id, pub_date,
+           title || x'0a' || subtitle || x'0a0a' || article AS raw_text
+           FROM articles WHERE forum_id="{0}"'''.format(fid),
+        'SELECT art_id, forum_name FROM articles WHERE forum_id="{0}"'.format(fid))
+
+
+# staged aggregate entries written out before this many accumulate
+MAX_PENDING_ENTRIES = 2000000
+# PRAGMA user_version of a db while a bulk load defers its aggregates
+LOADING_VERSION = 1
+# source rowids per range counted by a worker, and ranges in flight per
+# worker, bound the rows held by calc_articles_parallel
+RANGE_SIZE = 5000
+RANGES_PER_WORKER = 2
+
+
+def pub_month(pub_date):
+    """month bucket of pub_date, '2017-06-29' -> '2017-06'
+    """
+    return (pub_date or '')[:7]
+
+
+def month_bound(month, last=False):
+    """normalize '2017' or '2017-06' to a month bucket bound
+    """
+    if len(month) == 4:
+        return month + ('-12' if last else '-01')
+    return month
+
+
+def count_article(src, row):
+    """count hanzi of a source row, return (articles record, cps, counts)
+    """
+    raw_text = row['raw_text']
+    cps, counts = count_hanzi(raw_text)
+    stats = pack_stats(cps, counts)
+    hanzi_cnt = len(cps)
+    hanzi_sum = int(counts.sum())
+    rec = [src, row['art_id'], row['pub_date'], raw_text, stats,
+           hanzi_cnt, hanzi_sum]
+    return rec, cps, counts
+
+
+def count_range(src, src_db_name, sql_query, first, last):
+    """count source rows whose src_rowid in [first, last]
+
+    runs in worker process, return (articles records, FreqAccumulator)
+    """
+    src_db = sqlite3.connect(src_db_name)
+    src_db.row_factory = sqlite3.Row
+    recs = []
+    acc = FreqAccumulator()
+    for row in src_db.execute(SQL_SELECT_ROWID_RANGE.format(sql_query),
+                              [first, last]):
+        rec, cps, counts = count_article(src, row)
+        recs.append(rec)
+        acc.add(cps, counts)
+    src_db.close()
+    return recs, acc
+
+
+def source_state(src_db_name, sql_query):
+    """[row count, max src_rowid] of a source query
+    """
+    src_db = sqlite3.connect(src_db_name)
+    state = list(src_db.execute(SQL_SELECT_SOURCE_STATE.format(sql_query)).fetchone())
+    src_db.close()
+    return state
+
+
+def report_digest(conn, src=None):
+    """digest of the aggregate a report of src, or of every src, is made
+    from: article count, max rowid, hanzi sum and a src_freq checksum
+    """
+    parts = []
+    for src_, art_cnt, hanzi_sum in conn.execute(SQL_SELECT_SRC_TOTALS).fetchall():
+        if src is not None and src_ != src:
+            continue
+        max_rowid = conn.execute(SQL_SELECT_SRC_MAX_ROWID, [src_]).fetchone()[0]
+        uniq, checksum = conn.execute(SQL_SELECT_SRC_CHECKSUM, [src_]).fetchone()
+        parts.append([src_, art_cnt, max_rowid, hanzi_sum, uniq, checksum])
+    return hashlib.sha1(json.dumps(sorted(parts)).encode('utf-8')).hexdigest()
+
+
+def convert_report(report_file):
+    """write the snapshot of an existing report csv
+    """
+    cps = []
+    counts = []
+    with open(report_file, encoding='utf8', newline='') as fin:
+        reader = csv.reader(fin)
+        next(reader)
+        for row in reader:
+            cps.append(ord(row[1]))
+            counts.append(int(row[3]))
+    save_snapshot(snapshot_file(report_file), cps, counts)
+    print('{0} INFO {1} saved'.format(datetime_iso(), snapshot_file(report_file)))
+
+
+def save_report(all_hz_freq, report_file, total=None, snapshot=True):
+    """save report to csv file, and to a binary snapshot beside it
+
+    total is the sum the frequencies are relative to, pass it when
+    all_hz_freq is truncated to the top entries; snapshot=False skips
+    the snapshot, which holds single hanzi only
+    """
+    accum_count = 0
+    all_hz_sum = total or sum(all_hz_freq.values())
+    items = sorted(all_hz_freq.items(), key=lambda x: x[1], reverse=True)
+    with open(report_file, 'w', encoding='utf8', newline='') as fout:
+        writer = csv.writer(fout, delimiter=',', quotechar='"',
+                            quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(
+            ['字頻序號', '字', '擴展', '出現頻次', '出現頻率', '累積頻次', '累積頻率'])
+        for i, item in enumerate(items):
+            is_ext = 'ext' if has_unihan_ext(item[0]) else ''
+            accum_count += item[1]
+            writer.writerow([i + 1, item[0], is_ext,
+                             item[1], item[1] / all_hz_sum,
+                             accum_count, accum_count / all_hz_sum])
+    if snapshot:
+        save_snapshot(snapshot_file(report_file),
+                      [ord(char) for char, _ in items],
+                      [count for _, count in items], all_hz_sum)
+
+
+def print_result(header, text_cnt, uniq_cnt, char_sum):
+    """print result
+    """
+    print('')
+    print('### [{0}] ##############################'.format(header))
+    print('  total text cnt: {0:>12,}'.format(text_cnt))
+    print('  hanzi uniq cnt: {0:>12,}'.format(uniq_cnt))
+    print('  hanzi char sum: {0:>12,}'.format(char_sum))
+    print('')
+
+
+def split_rowid_ranges(src_db_name, sql_query, parts, max_size=RANGE_SIZE):
+    """split rowid span of sql_query into at least `parts` ranges of at
+    most max_size rowids
+    """
+    src_db = sqlite3.connect(src_db_name)
+    first, last = src_db.execute(
+        SQL_SELECT_ROWID_BOUNDS.format(sql_query)).fetchone()
+    src_db.close()
+    if first is None:
+        return []
+    step = max(1, min(-(-(last - first + 1) // parts), max_size))
+    return [(lo, min(lo + step - 1, last))
+            for lo in range(first, last + 1, step)]
 
 
 class HanziCalculator():
     """Hanzi Calculator
     """
 
-    def __init__(self, db_name='hzfreq.db'):
+    def __init__(self, db_name='hzfreq.db', bulk=False, batch_size=1000,
+                 verbose=False, force=False):
+        self.db_name = db_name
+        # force: save reports even when the report cache says unchanged
+        self.force = force
+        # bulk: batch inserts and defer secondary indexes until load ends
+        self.bulk = bulk
+        # verbose: print a line per article besides the progress report
+        self.verbose = verbose
+        self.batch_size = batch_size if bulk else 1
+        # pragmas replaced by begin_load, restored by end_load
+        self.synchronous = None
+        self.journal_mode = None
+        # aggregates staged for the current transaction, or for the whole
+        # bulk load while loading, by (src, month)
+        self.pending = BucketAccumulator()
+        self.loading = False
         # init db
         self.conn = sqlite3.connect(db_name)
         cur = self.conn.cursor()
+        has_aggregate = cur.execute(SQL_CONTAIN_TABLE,
+                                    ['month_totals']).fetchone() is not None
         cur.execute(SQL_CREATE_ARTICLES)
+        cur.execute(SQL_CREATE_SRC_FREQ)
+        cur.execute(SQL_CREATE_SRC_TOTALS)
+        cur.execute(SQL_CREATE_MONTH_FREQ)
+        cur.execute(SQL_CREATE_MONTH_TOTALS)
+        cur.execute(SQL_CREATE_REPORT_CACHE)
+        cur.execute(SQL_CREATE_SOURCE_STATES)
+        if not bulk:
+            for sql in SQL_CREATE_INDEXES:
+                cur.execute(sql)
         self.conn.commit()
+        if not has_aggregate and cur.execute(SQL_ANY_ARTICLE).fetchone():
+            print('{0} INFO {1} predates aggregate tables, rebuild them'.format(
+                datetime_iso(), db_name))
+            self.rebuild_aggregate()
+        elif cur.execute('PRAGMA user_version').fetchone()[0] == LOADING_VERSION:
+            print('{0} INFO {1} has an unfinished bulk load, rebuild aggregate tables'.format(
+                datetime_iso(), db_name))
+            self.rebuild_aggregate()
+            cur.execute('PRAGMA user_version=0')
+        cur.close()
+
+    def begin_load(self):
+        """prepare db for bulk load: WAL journal, no fsync, no indexes
+
+        aggregates are staged for the whole load and written once by
+        end_load; user_version marks the load until then, so a db left
+        by a load that died midway rebuilds its aggregates when opened
+        """
+        if not self.bulk:
+            return
+        self.loading = True
+        cur = self.conn.cursor()
+        cur.execute('PRAGMA user_version={0}'.format(LOADING_VERSION))
+        self.synchronous = cur.execute('PRAGMA synchronous').fetchone()[0]
+        self.journal_mode = cur.execute('PRAGMA journal_mode').fetchone()[0]
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=OFF')
+        for sql in SQL_DROP_INDEXES:
+            cur.execute(sql)
+        self.conn.commit()
+        cur.close()
+
+    def end_load(self):
+        """finish bulk load: build secondary indexes, restore pragmas
+
+        the journal mode is restored too, so other tools do not find the
+        db left in WAL mode with -wal/-shm files beside it
+        """
+        self.loading = False
+        self.commit()
+        if not self.bulk:
+            return
+        cur = self.conn.cursor()
+        cur.execute('PRAGMA user_version=0')
+        for sql in SQL_CREATE_INDEXES:
+            cur.execute(sql)
+        self.conn.commit()
+        cur.execute('PRAGMA synchronous={0}'.format(self.synchronous))
+        cur.execute('PRAGMA journal_mode={0}'.format(self.journal_mode))
+        cur.close()
+
+    def commit(self):
+        """commit the article rows, with the staged aggregates unless a
+        bulk load defers them to end_load
+        """
+        if not self.loading:
+            self.flush_aggregate()
+        self.conn.commit()
+
+    def flush_aggregate(self):
+        """write staged aggregates into the current transaction
+
+        buckets are written in key order, so month_freq rows arrive in
+        primary key order, and src_freq is summed per src first, one row
+        per hanzi rather than one per month bucket
+        """
+        cur = self.conn.cursor()
+        srcs = {}
+        for (src, month), art_cnt, cps, counts in sorted(
+                self.pending.items(), key=lambda item: item[0]):
+            hanzi_sum = int(counts.sum())
+            cur.executemany(SQL_UPSERT_MONTH_FREQ,
+                            zip(repeat(src), repeat(month),
+                                map(chr, cps.tolist()), counts.tolist()))
+            cur.execute(SQL_UPSERT_MONTH_TOTALS,
+                        [src, month, art_cnt, hanzi_sum])
+            if src not in srcs:
+                srcs[src] = [0, 0, FreqAccumulator()]
+            srcs[src][0] += art_cnt
+            srcs[src][1] += hanzi_sum
+            srcs[src][2].add(cps, counts)
+        for src, (art_cnt, hanzi_sum, acc) in srcs.items():
+            cur.executemany(SQL_UPSERT_SRC_FREQ,
+                            [(src, k, v) for k, v in acc.to_freq().items()])
+            cur.execute(SQL_UPSERT_SRC_TOTALS, [src, art_cnt, hanzi_sum])
+        self.pending = BucketAccumulator()
         cur.close()
 
-    def save_report(self, all_hz_freq, report_file):
-        """save report to csv file
-        """
-        accum_count = 0
-        all_hz_sum = sum(all_hz_freq.values())
-        with open(report_file, 'w', encoding='utf8', newline='') as fout:
-            writer = csv.writer(fout, delimiter=',', quotechar='"',
-                                quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(
-                ['字頻序號', '字', '擴展', '出現頻次', '出現頻率', '累積頻次', '累積頻率'])
-            for i, item in enumerate(sorted(all_hz_freq.items(),
-                                            key=lambda x: x[1], reverse=True)):
-                is_ext = 'ext' if is_unihan_ext(item[0]) else ''
-                accum_count += item[1]
-                writer.writerow([i + 1, item[0], is_ext,
-                                 item[1], item[1] / all_hz_sum,
-                                 accum_count, accum_count / all_hz_sum])
-
-    def print_result(self, header, text_cnt, uniq_cnt, char_sum):
-        """print result
-        """
-        print('')
-        print('### [{0}] ##############################'.format(header))
-        print('  total text cnt: {0:>12,}'.format(text_cnt))
-        print('  hanzi uniq cnt: {0:>12,}'.format(uniq_cnt))
-        print('  hanzi char sum: {0:>12,}'.format(char_sum))
-        print('')
-
-    def calc_all(self, db_file, report_file):
-        """calc all in freq db
+    def stage_aggregate(self, src, pub_date, stats):
+        """add an article's stats to the aggregates of this transaction
+        """
+        self.pending.add((src, pub_month(pub_date)), *unpack_stats(stats))
+        if len(self.pending) >= MAX_PENDING_ENTRIES:
+            self.flush_aggregate()
+
+    def new_articles(self, cur, recs):
+        """filter out records already in db or repeated in recs
+        """
+        seen = set()
+        new_recs = []
+        for rec in recs:
+            key = (rec[0], rec[1])
+            if key in seen:
+                continue
+            seen.add(key)
+            if cur.execute(SQL_CONTAIN_ARTICLE, key).fetchone() is None:
+                new_recs.append(rec)
+        return new_recs
+
+    def insert_articles(self, recs):
+        """insert article records, in batches of batch_size
+        """
+        cur = self.conn.cursor()
+        for i in range(0, len(recs), self.batch_size):
+            batch = self.new_articles(cur, recs[i:i + self.batch_size])
+            cur.executemany(SQL_INSERT_ARTICLES, batch)
+            for rec in batch:
+                self.stage_aggregate(rec[0], rec[2], rec[4])
+            if self.bulk:
+                self.commit()
+        cur.close()
+
+    def scan_aggregate(self):
+        """recompute per-src aggregates from articles
+        """
+        aggr = {}
+        for src, stats in self.conn.execute(SQL_SELECT_SRC_STATS):
+            if src not in aggr:
+                aggr[src] = [0, FreqAccumulator()]
+            aggr[src][0] += 1
+            aggr[src][1].add_stats(stats)
+        return aggr
+
+    def load_aggregate(self):
+        """load per-src aggregates from src_freq/src_totals
         """
+        aggr = {}
+        freqs = {}
+        for src, hanzi, cnt in self.conn.execute(SQL_SELECT_SRC_FREQ):
+            freqs.setdefault(src, {})[hanzi] = cnt
+        for src, art_cnt, _ in self.conn.execute(SQL_SELECT_SRC_TOTALS):
+            aggr[src] = [art_cnt, FreqAccumulator()]
+            aggr[src][1].add_freq(freqs.get(src, {}))
+        return aggr
+
+    def verify_aggregate(self):
+        """compare aggregate tables with a rescan of articles
+
+        return count of srcs and months drifted
+        """
+        drifted = self.verify_month_totals()
+        scanned = self.scan_aggregate()
+        stored = self.load_aggregate()
+        for src in sorted(set(scanned) | set(stored)):
+            s_cnt, s_acc = scanned.get(src, [0, FreqAccumulator()])
+            t_cnt, t_acc = stored.get(src, [0, FreqAccumulator()])
+            diff_chars = int((s_acc.counts != t_acc.counts).sum())
+            status = 'OK' if s_cnt == t_cnt and diff_chars == 0 else 'DRIFT'
+            if status == 'DRIFT':
+                drifted += 1
+            print('{0} INFO [{1}] {2} articles {3:,}/{4:,}, hanzi sum {5:,}/{6:,}, {7:,} chars differ'.format(
+                datetime_iso(), src, status, s_cnt, t_cnt,
+                s_acc.total(), t_acc.total(), diff_chars))
+        return drifted
+
+    def verify_month_totals(self):
+        """compare month_totals with articles grouped by month
+
+        return count of months drifted
+        """
+        scanned = {(row[0], row[1]): row[2:]
+                   for row in self.conn.execute(SQL_SCAN_MONTH_TOTALS)}
+        stored = {(row[0], row[1]): row[2:]
+                  for row in self.conn.execute(SQL_SELECT_MONTH_TOTALS)}
+        drifted = 0
+        for key in sorted(set(scanned) | set(stored)):
+            if scanned.get(key) != stored.get(key):
+                drifted += 1
+                print('{0} INFO [{1}] DRIFT month {2} articles/hanzi sum {3}/{4}'.format(
+                    datetime_iso(), key[0], key[1], scanned.get(key), stored.get(key)))
+        print('{0} INFO {1:,} months checked, {2:,} drifted'.format(
+            datetime_iso(), len(scanned), drifted))
+        return drifted
+
+    def rebuild_aggregate(self):
+        """recompute aggregate tables from articles
+        """
+        cur = self.conn.cursor()
+        for sql in SQL_DELETE_AGGREGATE:
+            cur.execute(sql)
+        art_cnt = 0
+        for src, pub_date, stats in cur.execute(SQL_SELECT_MONTH_STATS):
+            self.stage_aggregate(src, pub_date, stats)
+            art_cnt += 1
+        cur.close()
+        self.commit()
+        print('{0} INFO aggregate rebuilt, {1:,} articles'.format(
+            datetime_iso(), art_cnt))
+
+    def calc_range(self, src, first, last, report_file=None):
+        """calc hanzi freq of src in months [first, last] from month buckets
+        """
+        first = month_bound(first)
+        last = month_bound(last, last=True)
+        if report_file is None:
+            report_file = 'report-{0}-{1}-{2}.csv'.format(src, first, last)
+        args = [src, first, last]
+        art_cnt = self.conn.execute(SQL_SELECT_RANGE_TOTALS, args).fetchone()[0]
+        if not art_cnt:
+            print('{0} WARN no articles of [{1}] in {2} ~ {3} (run `rebuild` if db predates month buckets)'.format(
+                datetime_iso(), src, first, last))
+            return
+        all_hz_freq = dict(self.conn.execute(SQL_SELECT_RANGE_FREQ, args))
+        save_report(all_hz_freq, report_file)
+        print_result('{0} {1} ~ {2}'.format(src, first, last), art_cnt,
+                     len(all_hz_freq), sum(all_hz_freq.values()))
+
+    def report_cached(self, conn, report_file, digest):
+        """check report_file and its snapshot were saved from digest
+        """
+        conn.execute(SQL_CREATE_REPORT_CACHE)
+        row = conn.execute(SQL_SELECT_REPORT_CACHE,
+                           [os.path.abspath(report_file)]).fetchone()
+        hit = (not self.force and row is not None and row[0] == digest and
+               os.path.exists(report_file) and
+               os.path.exists(snapshot_file(report_file)))
+        print('{0} INFO report cache {1} {2} [{3}]{4}'.format(
+            datetime_iso(), 'hit' if hit else 'miss', report_file, digest[:12],
+            ', forced' if self.force else ''))
+        return hit
+
+    def cache_report(self, conn, report_file, digest):
+        """record report_file as saved from digest
+        """
+        conn.execute(SQL_UPSERT_REPORT_CACHE,
+                     [os.path.abspath(report_file), digest, datetime_iso()])
+        conn.commit()
+
+    def save_ngram_report(self, counter, report_file, art_cnt, top=TOP_NGRAMS):
+        """save the top n-grams of counter, frequencies are of all n-grams
+        """
+        ngram_freq, uniq = counter.top(top)
+        save_report(ngram_freq, report_file, total=counter.total,
+                    snapshot=False)
+        print_result(report_file, art_cnt, uniq, counter.total)
+
+    def calc_all(self, db_file, report_file, ngram=1, top=TOP_NGRAMS):
+        """calc all in freq db, from the aggregate tables if built
+
+        ngram > 1 counts n-grams of the stored article texts instead
+        """
+        if ngram > 1:
+            self.calc_all_ngrams(db_file, report_file, ngram, top)
+            return
         conn = sqlite3.connect(db_file)
+        try:
+            art_cnt = conn.execute(SQL_SELECT_ALL_TOTALS).fetchone()[0]
+        except sqlite3.OperationalError:
+            art_cnt = None
+        if art_cnt:
+            digest = report_digest(conn)
+            if self.report_cached(conn, report_file, digest):
+                conn.close()
+                return
+            all_hz_freq = dict(conn.execute(SQL_SELECT_ALL_FREQ))
+            save_report(all_hz_freq, report_file)
+            self.cache_report(conn, report_file, digest)
+            conn.close()
+            print_result(report_file, art_cnt, len(all_hz_freq),
+                         sum(all_hz_freq.values()))
+            return
+        print('{0} WARN no aggregate in {1}, scan articles (run `rebuild` to build it)'.format(
+            datetime_iso(), db_file))
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        all_hz_freq = {}
+        acc = FreqAccumulator()
         art_cnt = 0
-        for i, row in enumerate(cur.execute(SQL_SELECT_ARTICLES)):
-            print('{0} INFO {1:,} calc article[{2}]... hanzi cnt/sum: {3}/{4}'.format(
-                datetime_iso(), i, row['idx'], row['hanzi_cnt'], row['hanzi_sum']))
-            chr_freq = json.loads(row['stats'])
-            for char in chr_freq:
-                if char in all_hz_freq:
-                    all_hz_freq[char] += chr_freq[char]
-                else:
-                    all_hz_freq[char] = chr_freq[char]
+        progress = Progress(db_file, cur.execute(SQL_COUNT_ARTICLES).fetchone()[0],
+                            verbose=self.verbose)
+        for row in cur.execute(SQL_SELECT_ARTICLES):
+            acc.add_stats(row['stats'])
             art_cnt += 1
+            progress.update(1, row['hanzi_sum'],
+                            'calc article[%s]... hanzi cnt/sum: %s/%s',
+                            row['idx'], row['hanzi_cnt'], row['hanzi_sum'])
+        progress.done()
+
+        save_report(acc.to_freq(), report_file)
+        print_result(report_file, art_cnt, acc.uniq(), acc.total())
 
-        self.save_report(all_hz_freq, report_file)
-        self.print_result(report_file, art_cnt,
-                          len(all_hz_freq), sum(all_hz_freq.values()))
+    def calc_all_ngrams(self, db_file, report_file, ngram, top=TOP_NGRAMS):
+        """count n-grams of every article text in freq db
+        """
+        conn = sqlite3.connect(db_file)
+        cur = conn.cursor()
+        art_cnt = 0
+        progress = Progress(db_file, cur.execute(SQL_COUNT_ARTICLES).fetchone()[0],
+                            verbose=self.verbose)
+        with NgramCounter(ngram) as counter:
+            for idx, raw_txt in cur.execute(SQL_SELECT_TEXTS):
+                counter.add_text(raw_txt)
+                art_cnt += 1
+                progress.update(1, 0, 'count %s-grams of article[%s]', ngram, idx)
+            progress.done()
+            conn.close()
+            self.save_ngram_report(counter, report_file, art_cnt, top)
 
-    def calc_articles(self, src, src_db_name, sql_query):
+    def calc_articles(self, src, src_db_name, sql_query, workers=1,
+                      ngram=1, top=TOP_NGRAMS):
         """calc hanzi freq articles
+
+        sql_query must select `src_rowid`, `art_id`, `pub_date` and
+        `raw_text`; with workers > 1 the rowid span is split into ranges
+        counted in a process pool, and rows are written by this process only.
+        ngram > 1 also writes the top n-grams to report-<src>-<n>gram.csv
+
+        nothing is counted when the source is unchanged since its last
+        load and the report cache has report-<src>.csv from the aggregate
+        """
+        report_file = 'report-{0}.csv'.format(src)
+        state = source_state(src_db_name, sql_query)
+        if ngram == 1 and self.src_unchanged(src, state, report_file):
+            return
+        with NgramCounter(ngram) if ngram > 1 else nullcontext() as counter:
+            self.begin_load()
+            if workers > 1:
+                art_cnt, acc = self.calc_articles_parallel(
+                    [Source(src, src_db_name, sql_query, None)], workers, counter)[src]
+            else:
+                art_cnt, acc = self.calc_articles_serial(
+                    src, src_db_name, sql_query, counter)
+            self.end_load()
+            self.save_state(src, state)
+            self.save_src_report(self.conn, src, report_file,
+                                 report_digest(self.conn, src))
+            if counter is not None:
+                self.save_ngram_report(
+                    counter, 'report-{0}-{1}gram.csv'.format(src, ngram), art_cnt, top)
+
+    def src_unchanged(self, src, state, report_file):
+        """check src was last loaded from source state and report_file is
+        cached from its aggregate
+        """
+        row = self.conn.execute(SQL_SELECT_SOURCE_STATE_OF, [src]).fetchone()
+        if row is None or json.loads(row[0]) != state:
+            print('{0} INFO [{1}] source changed since last load'.format(
+                datetime_iso(), src))
+            return False
+        return self.report_cached(self.conn, report_file,
+                                  report_digest(self.conn, src))
+
+    def save_state(self, src, state):
+        """record the source state src was loaded from
+        """
+        self.conn.execute(SQL_UPSERT_SOURCE_STATE, [src, json.dumps(state)])
+        self.conn.commit()
+
+    def save_src_report(self, conn, src, report_file, digest):
+        """save the report of src from its aggregate in conn, and record
+        it in the report cache under digest, the digest of that aggregate
+        """
+        all_hz_freq = dict(conn.execute(SQL_SELECT_FREQ_OF_SRC, [src]))
+        art_cnt = conn.execute(SQL_SELECT_TOTALS_OF_SRC, [src]).fetchone()[0]
+        save_report(all_hz_freq, report_file)
+        self.cache_report(conn, report_file, digest)
+        print_result(src, art_cnt, len(all_hz_freq),
+                     sum(all_hz_freq.values()))
+
+    def calc_articles_serial(self, src, src_db_name, sql_query, counter=None):
+        """count source rows one by one in this process
         """
         art_cnt = 0
         src_db = sqlite3.connect(src_db_name)
         src_db.row_factory = sqlite3.Row
         src_cur = src_db.cursor()
-        all_hz_freq = {}
-        for i, row in enumerate(src_cur.execute(sql_query)):
+        acc = FreqAccumulator()
+        pending = []
+        total = src_cur.execute(SQL_COUNT_QUERY.format(sql_query)).fetchone()[0]
+        progress = Progress(src, total, verbose=self.verbose)
+        for row in src_cur.execute(sql_query):
             art_cnt += 1
-            idx = row['art_id']
-            pub_date = row['pub_date']
-            raw_text = row['raw_text']
-            chr_freq = {}
-            for char in raw_text:
-                if char in chr_freq:
-                    chr_freq[char] += 1
-                else:
-                    chr_freq[char] = 1
-            hz_freq = {k: v for k, v in chr_freq.items() if is_unihan(k)}
-            for k in hz_freq:
-                if k in all_hz_freq:
-                    all_hz_freq[k] += hz_freq[k]
-                else:
-                    all_hz_freq[k] = hz_freq[k]
-            stats = json.dumps(hz_freq, ensure_ascii=False,
-                               sort_keys=True).encode('utf-8')
-            hanzi_cnt = len(hz_freq)
-            hanzi_sum = sum(hz_freq.values())
-            rec = [src, idx, pub_date, raw_text, stats, hanzi_cnt, hanzi_sum]
-            cur = self.conn.cursor()
-            cur.execute(SQL_INSERT_ARTICLES, rec)
-            print('{0} INFO {1:05} calc article[{2}]... hanzi cnt/sum: {3}/{4}'.format(
-                datetime_iso(), i + 1, idx, hanzi_cnt, hanzi_sum))
+            rec, cps, counts = count_article(src, row)
+            acc.add(cps, counts)
+            if counter is not None:
+                counter.add_text(rec[3])
+            pending.append(rec)
+            if len(pending) >= self.batch_size:
+                self.insert_articles(pending)
+                pending = []
+            progress.update(1, rec[6],
+                            'calc article[%s]... hanzi cnt/sum: %s/%s',
+                            rec[1], rec[5], rec[6])
+        self.insert_articles(pending)
+        progress.done()
         src_cur.close()
-        self.conn.commit()
+        return art_cnt, acc
 
-        self.save_report(all_hz_freq, 'report-{0}.csv'.format(src))
-        self.print_result(src, art_cnt,
-                          len(all_hz_freq), sum(all_hz_freq.values()))
+    def calc_articles_parallel(self, sources, workers, counter=None):
+        """count rowid ranges of the rows of sources in a process pool,
+        return {src: (art_cnt, FreqAccumulator)}
 
-    def dump_forum(self, src_db_name, fid):
-        """dump forum to text file
+        workers only count; at most RANGES_PER_WORKER ranges per worker
+        are in flight, each is inserted by this process and merged as it
+        completes
         """
-        txt = ''
-        conn = sqlite3.connect(src_db_name)
-        cur = conn.cursor()
-        for row in cur.execute(SQL_SELECT_BY_FORUM_ID, [fid]):
-            # txt += '{0}\n\n{1}\n\n\n'.format(row[1], row[2])
-            txt += '{0}\n'.format(row[2])
-        filename = 'dump-forum-{0}.txt'.format(fid)
-        with open(filename, 'w', encoding='utf8') as fout:
-            fout.write(txt)
-        print('\nfile {0} saved\n'.format(filename))
+        results = {source.src: [0, FreqAccumulator()] for source in sources}
+        ranges = ((source, first, last) for source in sources
+                  for first, last in split_rowid_ranges(
+                      source.db_file, source.sql_query, workers * 4))
+        progress = Progress(','.join(results), verbose=self.verbose)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # {future: (src, first, last)}
+            in_flight = {}
+            while True:
+                for source, first, last in islice(
+                        ranges, workers * RANGES_PER_WORKER - len(in_flight)):
+                    future = executor.submit(count_range, source.src, source.db_file,
+                                             source.sql_query, first, last)
+                    in_flight[future] = (source.src, first, last)
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    src, first, last = in_flight.pop(future)
+                    recs, range_acc = future.result()
+                    if counter is not None:
+                        for rec in recs:
+                            counter.add_text(rec[3])
+                    self.insert_articles(recs)
+                    results[src][0] += len(recs)
+                    results[src][1].merge(range_acc)
+                    progress.update(len(recs), range_acc.total(),
+                                    'calc %s rowid[%s-%s]... %s articles',
+                                    src, first, last, len(recs))
+        progress.done()
+        return {src: tuple(result) for src, result in results.items()}
+
+    def calc_reports(self, db_files, report_file='report-all.csv'):
+        """write report-<src>.csv of every src and report_file
+
+        reports are saved from the aggregate tables through the report
+        cache, a db that predates them has them rebuilt first; the first
+        db also feeds report_file
+        """
+        for i, db_file in enumerate(db_files):
+            calc = self if db_file == self.db_name else HanziCalculator(
+                db_name=db_file, verbose=self.verbose, force=self.force)
+            for src, _, _ in calc.conn.execute(SQL_SELECT_SRC_TOTALS).fetchall():
+                src_report = 'report-{0}.csv'.format(src)
+                digest = report_digest(calc.conn, src)
+                if not self.report_cached(calc.conn, src_report, digest):
+                    self.save_src_report(calc.conn, src, src_report, digest)
+            if calc is not self:
+                calc.conn.close()
+            if i == 0:
+                self.calc_all(db_file, report_file)
+
+    def calc_sources(self, keys, workers=None, report_file='report-all.csv'):
+        """count registered sources in one process pool, then write the
+        report of every source and report_file of the whole db
+
+        workers only count, rows are written by this process, so the db
+        has a single writer
+        """
+        states = {}
+        sources = []
+        for key in keys:
+            source = SOURCES[key]
+            states[source.src] = source_state(source.db_file, source.sql_query)
+            if not self.src_unchanged(source.src, states[source.src],
+                                      'report-{0}.csv'.format(source.src)):
+                sources.append(source)
+        if sources:
+            self.begin_load()
+            self.calc_articles_parallel(sources, workers or os.cpu_count() or 1)
+            self.end_load()
+        for source in sources:
+            self.save_state(source.src, states[source.src])
+            self.save_src_report(self.conn, source.src,
+                                 'report-{0}.csv'.format(source.src),
+                                 report_digest(self.conn, source.src))
+        self.calc_all(self.db_name, report_file)
+
+    def migrate_stats(self, chunk_size=1000):
+        """rewrite legacy json `stats` rows in packed binary format
+        """
+        migrated = 0
+        last_rowid = -1
+        cur = self.conn.cursor()
+        while True:
+            rows = cur.execute(SQL_SELECT_STATS_CHUNK,
+                               [last_rowid, chunk_size]).fetchall()
+            if len(rows) == 0:
+                break
+            last_rowid = rows[-1][0]
+            updates = [(pack_stats(*unpack_stats(stats)), rowid)
+                       for rowid, stats in rows if not is_packed(stats)]
+            cur.executemany(SQL_UPDATE_STATS, updates)
+            self.conn.commit()
+            migrated += len(updates)
+            print('{0} INFO {1:,} stats migrated, rowid {2}'.format(
+                datetime_iso(), migrated, last_rowid))
+        cur.close()
+        return migrated
 
 
 if __name__ == '__main__':
+    WORKERS = int(pop_option(sys.argv, '--workers', 1))
+    BULK = pop_flag(sys.argv, '--bulk')
+    BATCH_SIZE = int(pop_option(sys.argv, '--batch-size', 1000))
+    VERBOSE = pop_flag(sys.argv, '--verbose')
+    FORCE = pop_flag(sys.argv, '--force')
+    NGRAM = int(pop_option(sys.argv, '--ngram', 1))
+    # --top 0 keeps every n-gram
+    TOP = int(pop_option(sys.argv, '--top', TOP_NGRAMS)) or None
     if sys.argv[1] == 'all':
-        CALC = HanziCalculator()
-        CALC.calc_all('hzfreq.db', 'report-all.csv')
+        CALC = HanziCalculator(verbose=VERBOSE, force=FORCE)
+        CALC.calc_all('hzfreq.db', 'report-all.csv' if NGRAM == 1
+                      else 'report-all-{0}gram.csv'.format(NGRAM), NGRAM, TOP)
     elif sys.argv[1] == 'forum':
-        CALC = HanziCalculator(db_name='hzfreq-forum.db')
-        FID = sys.argv[2]
-        CALC.calc_articles(
-            'appledaily.forum.{0}'.format(FID),
-            'source-forum.db',
-            '''SELECT art_id, pub_date,
-               title || x'0a' || subtitle || x'0a0a' || article AS raw_text
-               FROM articles WHERE forum_id="{0}"'''.format(FID)
-        )
-    elif sys.argv[1] == 'apple':
-        CALC = HanziCalculator()
-        CALC.calc_articles(
-            'news.apple',
-            'source-appledaily.db',
-            '''SELECT art_id, pub_date,
-               title || x'0a' || subtitle || x'0a0a' || article AS raw_text
-               FROM articles'''
-        )
-    elif sys.argv[1] == 'books':
-        CALC = HanziCalculator()
-        CALC.calc_articles(
-            'books',
-            'source-books.db',
-            '''SELECT book_no AS art_id, pub_date, title || article AS raw_text
-               FROM articles'''
-        )
-    elif sys.argv[1] == 'cnyes':
-        CALC = HanziCalculator()
-        CALC.calc_articles(
-            'mag.cnyes',
-            'source-magcnyes.db',
-            '''SELECT art_id, pub_date,
-               full_title || x'0a0a' || article AS raw_text
-               FROM articles'''
-        )
-    elif sys.argv[1] == 'yahoo':
-        CALC = HanziCalculator()
-        CALC.calc_articles(
-            'news.yahoo',
-            'source-newsyahoo.db',
-            '''SELECT id AS art_id, pub_date,
-               title || x'0a0a' || article AS raw_Text
-               FROM articles'''
-        )
-    elif sys.argv[1] == 'wiki':
-        CALC = HanziCalculator()
-        CALC.calc_articles(
-            'wikipedia',
-            'source-wikipedia.db',
-            '''SELECT title AS art_id, open_date AS pub_date,
-               title || x'0a0a' || article AS raw_text
-               FROM articles'''
-        )
-    elif sys.argv[1] == 'dump':
-        CALC = HanziCalculator(db_name='hzfreq-forum.db')
-        FID = sys.argv[2]
-        CALC.dump_forum('source-forum.db', FID)
+        CALC = HanziCalculator(db_name='hzfreq-forum.db',
+                               bulk=BULK, batch_size=BATCH_SIZE,
+                               verbose=VERBOSE, force=FORCE)
+        SOURCE = forum_source(sys.argv[2])
+        CALC.calc_articles(SOURCE.src, SOURCE.db_file, SOURCE.sql_query,
+                           workers=WORKERS, ngram=NGRAM, top=TOP)
+    elif sys.argv[1] in SOURCES:
+        CALC = HanziCalculator(bulk=BULK, batch_size=BATCH_SIZE,
+                               verbose=VERBOSE, force=FORCE)
+        SOURCE = SOURCES[sys.argv[1]]
+        CALC.calc_articles(SOURCE.src, SOURCE.db_file, SOURCE.sql_query,
+                           workers=WORKERS, ngram=NGRAM, top=TOP)
+    elif sys.argv[1] == 'all-sources':
+        CALC = HanziCalculator(bulk=True, batch_size=BATCH_SIZE,
+                               verbose=VERBOSE, force=FORCE)
+        CALC.calc_sources(sys.argv[2].split(',') if len(sys.argv) > 2
+                          else list(SOURCES), WORKERS if WORKERS > 1 else None)
+    elif sys.argv[1] == 'reports':
+        DB_FILES = sys.argv[2:] or [
+            db for db in ('hzfreq.db', 'hzfreq-forum.db') if os.path.exists(db)]
+        if not DB_FILES:
+            print('{0} ERROR no hzfreq.db or hzfreq-forum.db here, pass the freq dbs to report'.format(
+                datetime_iso()))
+            sys.exit(1)
+        for DB_FILE in DB_FILES:
+            if not os.path.exists(DB_FILE):
+                print('{0} ERROR {1} not found'.format(datetime_iso(), DB_FILE))
+                sys.exit(1)
+        CALC = HanziCalculator(db_name=DB_FILES[0], verbose=VERBOSE, force=FORCE)
+        CALC.calc_reports(DB_FILES)
+    elif sys.argv[1] == 'range':
+        CALC = HanziCalculator(db_name=pop_option(sys.argv, '--db', 'hzfreq.db'))
+        CALC.calc_range(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif sys.argv[1] in ('verify', 'rebuild'):
+        DB_NAME = sys.argv[2] if len(sys.argv) > 2 else 'hzfreq.db'
+        CALC = HanziCalculator(db_name=DB_NAME)
+        if sys.argv[1] == 'verify':
+            sys.exit(1 if CALC.verify_aggregate() else 0)
+        CALC.rebuild_aggregate()
+    elif sys.argv[1] == 'snapshot':
+        for REPORT_FILE in sys.argv[2:]:
+            convert_report(REPORT_FILE)
+    elif sys.argv[1] == 'migrate-stats':
+        DB_NAME = sys.argv[2] if len(sys.argv) > 2 else 'hzfreq.db'
+        CALC = HanziCalculator(db_name=DB_NAME)
+        CALC.migrate_stats()
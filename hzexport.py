@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Streaming corpus export
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import sys
+
+from hzcalc import SOURCES, forum_source
+from utils import Progress, pop_flag, pop_option
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ('txt', 'jsonl')
+COMPRESSIONS = (None, 'gz', 'zst')
+# rows per shard, 0 writes one file
+SHARD_SIZE = 10000
+
+
+def open_output(file_name, compress=None):
+    """open a text file for writing, gzip or zstd compressed if asked
+    """
+    if compress is None:
+        return open(file_name, 'w', encoding='utf8', newline='\n')
+    if compress == 'gz':
+        return gzip.open(file_name, 'wt', encoding='utf8', newline='\n',
+                         compresslevel=6)
+    if compress == 'zst':
+        if zstandard is None:
+            raise ValueError('zst compression needs the zstandard package')
+        return zstandard.open(file_name, 'wt', encoding='utf8', newline='\n')
+    raise ValueError('unknown compression: {0}'.format(compress))
+
+
+class ShardWriter():
+    """write lines to <prefix>-00000.<fmt>[.gz|.zst], ... with shard_size
+    rows each, or to <prefix>.<fmt> if shard_size is 0
+    """
+
+    def __init__(self, prefix, fmt='txt', compress=None, shard_size=SHARD_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError('unknown format: {0}'.format(fmt))
+        if compress not in COMPRESSIONS:
+            raise ValueError('unknown compression: {0}'.format(compress))
+        if compress == 'zst' and zstandard is None:
+            raise ValueError('zst compression needs the zstandard package')
+        if os.path.dirname(prefix):
+            os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        self.prefix = prefix
+        self.fmt = fmt
+        self.compress = compress
+        self.shard_size = shard_size
+        self.fout = None
+        self.rows = 0
+        self.files = []
+
+    def shard_name(self):
+        """file name of the next shard
+        """
+        name = self.prefix
+        if self.shard_size:
+            name += '-{0:05}'.format(len(self.files))
+        name += '.' + self.fmt
+        if self.compress:
+            name += '.' + self.compress
+        return name
+
+    def write(self, row):
+        """write one row, a sqlite3.Row
+        """
+        if self.fout is None or (self.shard_size and self.rows % self.shard_size == 0):
+            self.close()
+            self.files.append(self.shard_name())
+            self.fout = open_output(self.files[-1], self.compress)
+        if self.fmt == 'txt':
+            self.fout.write(row['raw_text'])
+            self.fout.write('\n')
+        else:
+            self.fout.write(json.dumps(dict(zip(row.keys(), row)), ensure_ascii=False))
+            self.fout.write('\n')
+        self.rows += 1
+
+    def close(self):
+        """close the current shard
+        """
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+
+
+def export_source(source, prefix, where=None, fmt='txt', compress=None,
+                  shard_size=SHARD_SIZE, verbose=False):
+    """stream the rows of a source query into shards, return the shard files
+
+    where is an extra sql condition on the columns of the source query
+    (src_rowid, art_id, pub_date, raw_text); txt writes raw_text of each
+    row ended by a newline, jsonl writes every column of a row per line
+    """
+    sql_query = source.sql_query
+    if where:
+        sql_query = 'SELECT * FROM ({0}) WHERE {1}'.format(sql_query, where)
+    conn = sqlite3.connect(source.db_file)
+    conn.row_factory = sqlite3.Row
+    writer = ShardWriter(prefix, fmt, compress, shard_size)
+    progress = Progress(source.src, verbose=verbose)
+    try:
+        for row in conn.execute(sql_query):
+            writer.write(row)
+            progress.update(1, 0, 'export article[%s]', row['art_id'])
+    finally:
+        writer.close()
+        conn.close()
+    progress.done()
+    return writer.files
+
+
+def resolve_source(key):
+    """registered source of a command key or forum:<fid>
+    """
+    if key.startswith('forum:'):
+        return forum_source(key[len('forum:'):])
+    return SOURCES[key]
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} <source> [options]'.format(sys.argv[0]))
+    print('')
+    print('    source                 {0} or forum:<fid>'.format('|'.join(SOURCES)))
+    print('    --where <sql>          filter on src_rowid, art_id, pub_date, raw_text')
+    print('    --format txt|jsonl     raw text (txt) or all columns per line (jsonl)')
+    print('    --compress gz|zst      compress each shard')
+    print('    --shard-size N         rows per shard, 0 for one file ({0})'.format(SHARD_SIZE))
+    print('    --out <prefix>         shard prefix (dump-<source>)')
+    print('    --db <file>            read this source db instead of the registered one')
+
+
+if __name__ == '__main__':
+    WHERE = pop_option(sys.argv, '--where')
+    FMT = pop_option(sys.argv, '--format', 'txt')
+    COMPRESS = pop_option(sys.argv, '--compress')
+    SHARD = int(pop_option(sys.argv, '--shard-size', SHARD_SIZE))
+    OUT = pop_option(sys.argv, '--out')
+    DB_FILE = pop_option(sys.argv, '--db')
+    VERBOSE = pop_flag(sys.argv, '--verbose')
+    if len(sys.argv) < 2 or not (sys.argv[1] in SOURCES or
+                                 sys.argv[1].startswith('forum:')):
+        print_usage()
+        sys.exit(0)
+    SOURCE = resolve_source(sys.argv[1])
+    if DB_FILE:
+        SOURCE = SOURCE._replace(db_file=DB_FILE)
+    OUT = OUT or 'dump-{0}'.format(SOURCE.src)
+    for FILE_NAME in export_source(SOURCE, OUT, WHERE, FMT, COMPRESS, SHARD, VERBOSE):
+        print('file {0} saved'.format(FILE_NAME))
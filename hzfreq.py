@@ -3,40 +3,91 @@
 """
 
 
-import json
 import sqlite3
+import sys
 import csv
-from utils import is_unihan_ext
+from hzstats import STATS_MAGIC, FreqAccumulator, unpack_stats
+from utils import Progress, is_unihan_ext, pop_flag
 
+# json stats summed inside sqlite; packed rows are left to python
+SQL_SUM_JSON_STATS = '''
+SELECT je.key, SUM(je.value)
+FROM articles, json_each(CAST(articles.stats AS TEXT)) AS je
+WHERE substr(articles.stats, 1, {0}) != ?
+GROUP BY je.key
+'''.format(len(STATS_MAGIC))
+SQL_SELECT_PACKED_STATS = '''
+SELECT src, idx, stats FROM articles WHERE substr(stats, 1, {0}) = ?
+'''.format(len(STATS_MAGIC))
+SQL_COUNT_PACKED_STATS = '''
+SELECT COUNT(*) FROM articles WHERE substr(stats, 1, {0}) = ?
+'''.format(len(STATS_MAGIC))
+SQL_SELECT_STATS = '''
+SELECT src, idx, stats FROM articles
+'''
+SQL_COUNT_ARTICLES = '''
+SELECT COUNT(*) FROM articles
+'''
+SQL_SUM_BY_SRC = '''
+SELECT src, COUNT(*), SUM(hanzi_sum) FROM articles GROUP BY src
+'''
 
-def report_summary():
+
+def sum_stats_python(conn, sql, count_sql, args=(), acc=None, verbose=False):
+    """decode and sum stats rows of sql in python
+    """
+    acc = acc or FreqAccumulator()
+    cur = conn.cursor()
+    progress = Progress('articles', cur.execute(count_sql, args).fetchone()[0],
+                        verbose=verbose)
+    for src, idx, stats in cur.execute(sql, args):
+        cps, counts = unpack_stats(stats)
+        acc.add(cps, counts)
+        progress.update(1, int(counts.sum()), 'sum %s[%s]', src, idx)
+    progress.done()
+    cur.close()
+    return acc
+
+
+def sum_stats_in_engine(conn, verbose=False):
+    """sum json stats with json_each inside sqlite, packed stats in python
+    """
+    acc = FreqAccumulator()
+    acc.add_freq(dict(conn.execute(SQL_SUM_JSON_STATS, [STATS_MAGIC])))
+    return sum_stats_python(conn, SQL_SELECT_PACKED_STATS,
+                            SQL_COUNT_PACKED_STATS, [STATS_MAGIC],
+                            acc=acc, verbose=verbose)
+
+
+def report_summary(db_name='hzfreq.db', report_file='all-report.csv',
+                   in_engine=True, verbose=False):
     """report_summary
     """
     all_hanzi_count = 0
     all_hanzi_freq_table = {}
-    conn = sqlite3.connect('corpus.db')
-    cur = conn.cursor()
-    for row in cur.execute('SELECT * FROM corpus'):
-        # src = row[0]
-        stats = json.loads(row[3])
-        for char in stats:
-            if char not in all_hanzi_freq_table:
-                all_hanzi_freq_table[char] = stats[char]
-            else:
-                all_hanzi_freq_table[char] += stats[char]
+    conn = sqlite3.connect(db_name)
+    acc = None
+    if in_engine:
+        try:
+            acc = sum_stats_in_engine(conn, verbose=verbose)
+        except sqlite3.OperationalError as err:
+            print('json1 aggregation unavailable ({0}), fall back to python'.format(err))
+    if acc is None:
+        acc = sum_stats_python(conn, SQL_SELECT_STATS, SQL_COUNT_ARTICLES,
+                               verbose=verbose)
+    all_hanzi_freq_table = acc.to_freq()
     all_hanzi_count = sum(all_hanzi_freq_table.values())
     print("char size:", all_hanzi_count)
     print("uniq size:", len(all_hanzi_freq_table))
-    cur.close()
 
     cur = conn.cursor()
-    for row in cur.execute('SELECT src, COUNT(*), SUM(num_hanzi) FROM corpus GROUP BY src'):
+    for row in cur.execute(SQL_SUM_BY_SRC):
         print('{0:>10} | {1:>7,} | {2:>12,}'.format(row[0], row[1], row[2]))
 
     # save all_hanzi_freq_table
     accum_count = 0
     all_report_table = []
-    with open('all-report.csv', 'w', encoding='utf8', newline='') as outfile:
+    with open(report_file, 'w', encoding='utf8', newline='') as outfile:
         writer = csv.writer(outfile, delimiter=',',
                             quotechar='"', quoting=csv.QUOTE_MINIMAL)
         writer.writerow(['字頻序號', '字', '擴展', '出現頻次', '出現頻率', '累積頻次', '累積頻率'])
@@ -48,8 +99,11 @@ def report_summary():
                     all_hanzi_count, accum_count, accum_count / all_hanzi_count]
             all_report_table.append(item)
             writer.writerow(item)
-        print('[Done] save report file <{0}>'.format('all-report.csv'))
+        print('[Done] save report file <{0}>'.format(report_file))
 
 
 if __name__ == '__main__':
-    report_summary()
+    VERBOSE = pop_flag(sys.argv, '--verbose')
+    IN_ENGINE = not pop_flag(sys.argv, '--python')
+    report_summary(db_name=sys.argv[1] if len(sys.argv) > 1 else 'hzfreq.db',
+                   in_engine=IN_ENGINE, verbose=VERBOSE)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Source by hanzi count matrix
+"""
+
+import json
+import sqlite3
+import sys
+
+import numpy as np
+
+from hzcalc import (FORUM_PREFIX, SQL_SELECT_SRC_FREQ, SQL_SELECT_SRC_TOTALS,
+                    HanziCalculator)
+from utils import pop_flag, pop_option
+
+
+def matrix_files(prefix):
+    """(counts .npy, index .json) file names of a matrix
+    """
+    return prefix + '.npy', prefix + '-index.json'
+
+
+class SourceMatrix():
+    """dense hanzi counts, one row per src and one column per hanzi
+
+    counts are kept in a .npy file and opened as a read-only memmap, the
+    src and hanzi axes are kept in an index json beside it
+    """
+
+    def __init__(self, counts, srcs, chars, art_cnts):
+        self.counts = counts
+        self.srcs = list(srcs)
+        self.chars = chars
+        self.art_cnts = np.asarray(art_cnts, dtype=np.int64)
+        self.rows = {src: i for i, src in enumerate(self.srcs)}
+
+    @classmethod
+    def build(cls, db_files, prefix='hzmatrix'):
+        """build from the src_freq aggregates of hzfreq dbs and save
+        """
+        freqs = []
+        totals = {}
+        for db_file in db_files:
+            # opening through HanziCalculator rebuilds missing aggregates
+            HanziCalculator(db_name=db_file).conn.close()
+            conn = sqlite3.connect(db_file)
+            freqs += conn.execute(SQL_SELECT_SRC_FREQ).fetchall()
+            for src, art_cnt, _ in conn.execute(SQL_SELECT_SRC_TOTALS):
+                totals[src] = totals.get(src, 0) + art_cnt
+            conn.close()
+        srcs = sorted(totals)
+        rows = {src: i for i, src in enumerate(srcs)}
+        row_ids = np.array([rows[src] for src, _, _ in freqs], dtype=np.int64)
+        cps, col_ids = np.unique(
+            np.array([ord(hanzi) for _, hanzi, _ in freqs], dtype=np.int64),
+            return_inverse=True)
+        cnts = np.array([cnt for _, _, cnt in freqs], dtype=np.int64)
+
+        counts_file, index_file = matrix_files(prefix)
+        counts = np.lib.format.open_memmap(
+            counts_file, mode='w+', dtype=np.int64, shape=(len(srcs), len(cps)))
+        counts[:] = 0
+        np.add.at(counts, (row_ids, col_ids.ravel()), cnts)
+        counts.flush()
+        del counts
+        with open(index_file, 'w', encoding='utf8') as fout:
+            json.dump({'srcs': srcs,
+                       'art_cnts': [totals[src] for src in srcs],
+                       'chars': ''.join(map(chr, cps.tolist()))},
+                      fout, ensure_ascii=False)
+        return cls.load(prefix)
+
+    @classmethod
+    def load(cls, prefix='hzmatrix'):
+        """open a saved matrix, counts are memory mapped
+        """
+        counts_file, index_file = matrix_files(prefix)
+        with open(index_file, encoding='utf8') as fin:
+            index = json.load(fin)
+        return cls(np.load(counts_file, mmap_mode='r'),
+                   index['srcs'], index['chars'], index['art_cnts'])
+
+    def select(self, prefix):
+        """row ids of the srcs starting with prefix
+        """
+        return np.array([i for i, src in enumerate(self.srcs)
+                         if src.startswith(prefix)], dtype=np.int64)
+
+    def forum_rows(self):
+        """row ids of the appledaily forum authors
+        """
+        return self.select(FORUM_PREFIX)
+
+    def normalize(self, rows=None):
+        """per-src relative frequencies, each row sums to 1
+        """
+        counts = self.counts if rows is None else self.counts[rows]
+        sums = counts.sum(axis=1, keepdims=True)
+        return counts / np.maximum(sums, 1)
+
+    def cosine_distances(self, rows=None):
+        """pairwise cosine distances between srcs
+        """
+        counts = np.asarray(
+            self.counts if rows is None else self.counts[rows], dtype=np.float64)
+        norms = np.linalg.norm(counts, axis=1, keepdims=True)
+        unit = counts / np.maximum(norms, 1e-12)
+        return np.clip(1.0 - unit @ unit.T, 0.0, 2.0)
+
+    def chi2_distances(self, rows=None):
+        """pairwise chi-square distances between normalized srcs
+
+        d(p, q) = sum (p - q)^2 / (p + q) over hanzi used by either
+        """
+        freqs = self.normalize(rows)
+        dists = np.zeros((len(freqs), len(freqs)))
+        for i, freq in enumerate(freqs):
+            diff = freqs - freq
+            total = freqs + freq
+            np.divide(diff * diff, total, out=diff, where=total > 0)
+            diff[total == 0] = 0.0
+            dists[i] = diff.sum(axis=1)
+        return dists
+
+    def distinctive(self, src, top=20, rows=None):
+        """hanzi most over-used by src against the rest of rows
+
+        score is the signed chi-square term (observed - expected)^2 /
+        expected, expected from the src sum and the rest column sums;
+        return [(char, count, score)]
+        """
+        row = self.rows[src]
+        rest = np.arange(len(self.srcs)) if rows is None else np.asarray(rows)
+        rest = rest[rest != row]
+        observed = np.asarray(self.counts[row], dtype=np.float64)
+        others = np.asarray(self.counts[rest], dtype=np.float64).sum(axis=0)
+        col_sums = observed + others
+        grand = col_sums.sum()
+        if grand == 0:
+            return []
+        expected = observed.sum() * col_sums / grand
+        scores = np.zeros_like(observed)
+        np.divide((observed - expected) ** 2, expected, out=scores,
+                  where=expected > 0)
+        scores[observed < expected] = 0.0
+        order = np.argsort(-scores, kind='stable')[:top]
+        return [(self.chars[i], int(observed[i]), float(scores[i]))
+                for i in order if scores[i] > 0]
+
+
+def print_distances(matrix, rows, dists):
+    """print a distance table of rows
+    """
+    names = [matrix.srcs[i] for i in rows]
+    width = max(len(name) for name in names)
+    for name, dist in zip(names, dists):
+        print('{0:<{1}} {2}'.format(
+            name, width, ' '.join('{0:.4f}'.format(d) for d in dist)))
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} command [--matrix prefix]'.format(sys.argv[0]))
+    print('')
+    print('    build [db ...]                   build matrix from hzfreq.db (and other dbs)')
+    print('    distance [src-prefix] [--chi2]   pairwise distances, cosine by default')
+    print('    distinctive <src> [n]            top n hanzi of src against the others')
+
+
+if __name__ == '__main__':
+    PREFIX = pop_option(sys.argv, '--matrix', 'hzmatrix')
+    CHI2 = pop_flag(sys.argv, '--chi2')
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(0)
+    elif sys.argv[1] == 'build':
+        MATRIX = SourceMatrix.build(sys.argv[2:] or ['hzfreq.db'], PREFIX)
+        print('{0} srcs x {1} hanzi'.format(*MATRIX.counts.shape))
+    elif sys.argv[1] == 'distance':
+        MATRIX = SourceMatrix.load(PREFIX)
+        ROWS = MATRIX.select(sys.argv[2] if len(sys.argv) > 2 else '')
+        if CHI2:
+            print_distances(MATRIX, ROWS, MATRIX.chi2_distances(ROWS))
+        else:
+            print_distances(MATRIX, ROWS, MATRIX.cosine_distances(ROWS))
+    elif sys.argv[1] == 'distinctive':
+        MATRIX = SourceMatrix.load(PREFIX)
+        TOP = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        # forum authors are compared with each other, sources with all srcs
+        ROWS = None
+        if sys.argv[2].startswith(FORUM_PREFIX):
+            ROWS = MATRIX.forum_rows()
+        for CHAR, COUNT, SCORE in MATRIX.distinctive(sys.argv[2], TOP, ROWS):
+            print('{0}\t{1}\t{2:.1f}'.format(CHAR, COUNT, SCORE))
+    else:
+        print_usage()
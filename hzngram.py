@@ -0,0 +1,158 @@
+"""Hanzi n-gram counting in bounded memory
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from hzstats import to_codepoints, unihan_mask
+
+# every hanzi code point fits in 18 bits, so up to 3 of them pack in an int64
+NGRAM_BITS = 18
+NGRAM_MASK = (1 << NGRAM_BITS) - 1
+NGRAM_MAX = 3
+
+# rows of a spilled run read per block while merging
+RUN_BLOCK = 65536
+
+# n-grams kept in a report unless asked otherwise, the long tail of
+# distinct n-grams runs into millions
+TOP_NGRAMS = 10000
+
+
+def ngram_keys(cps, n):
+    """int64 keys of the n-grams of adjacent hanzi in a code point array
+    """
+    cps = cps.astype(np.int64)
+    size = len(cps) - n + 1
+    if size <= 0:
+        return np.zeros(0, dtype=np.int64)
+    mask = unihan_mask(cps)
+    valid = mask[:size].copy()
+    keys = cps[:size].copy()
+    for k in range(1, n):
+        valid &= mask[k:k + size]
+        keys = (keys << NGRAM_BITS) | cps[k:k + size]
+    return keys[valid]
+
+
+def ngram_text(key, n):
+    """decode an n-gram key back to its hanzi
+    """
+    return ''.join(chr((key >> (NGRAM_BITS * (n - 1 - k))) & NGRAM_MASK)
+                   for k in range(n))
+
+
+def merge_runs(run_files):
+    """k-way merge of sorted runs, yield (keys, counts) blocks in key order
+
+    each round reads a block of every run and takes the keys up to the
+    smallest last key among the blocks, which are complete in every run
+    """
+    # [run memmap, read position] of the runs not yet exhausted
+    runs = [[np.load(run_file, mmap_mode='r'), 0] for run_file in run_files]
+    while runs:
+        blocks = [run[head:head + RUN_BLOCK] for run, head in runs]
+        bound = min(block[-1, 0] for block in blocks)
+        parts = []
+        for run, block in zip(runs, blocks):
+            cut = np.searchsorted(block[:, 0], bound, side='right')
+            parts.append(block[:cut])
+            run[1] += cut
+        runs = [run for run in runs if run[1] < len(run[0])]
+        rows = np.concatenate(parts)
+        keys, inverse = np.unique(rows[:, 0], return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=rows[:, 1],
+                             minlength=len(keys)).astype(np.int64)
+        yield keys, counts
+
+
+class NgramCounter():
+    """hanzi n-gram counts in bounded memory
+
+    keys of each text are staged in memory; once max_entries keys are
+    staged they are reduced and spilled to tmp_dir as a sorted run of
+    (key, count) rows, and the runs are k-way merged when read; used as a
+    context manager, the runs are removed on exit
+    """
+
+    def __init__(self, n=2, max_entries=10000000, tmp_dir=None):
+        if not 2 <= n <= NGRAM_MAX:
+            raise ValueError('n-gram size must be 2 to {0}, got {1}'.format(
+                NGRAM_MAX, n))
+        self.n = n
+        self.max_entries = max_entries
+        self.tmp_dir = tempfile.mkdtemp(prefix='hzngram-', dir=tmp_dir)
+        self.chunks = []
+        self.size = 0
+        self.runs = []
+        self.total = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_text(self, text):
+        """count the n-grams of a text
+        """
+        keys = ngram_keys(to_codepoints(text), self.n)
+        if len(keys) == 0:
+            return
+        self.chunks.append(keys)
+        self.size += len(keys)
+        self.total += len(keys)
+        if self.size >= self.max_entries:
+            self.spill()
+
+    def spill(self):
+        """reduce the staged keys and write them out as a sorted run
+        """
+        if self.size == 0:
+            return
+        keys, counts = np.unique(np.concatenate(self.chunks), return_counts=True)
+        run_file = os.path.join(self.tmp_dir, 'run-{0:05}.npy'.format(len(self.runs)))
+        np.save(run_file, np.stack([keys, counts.astype(np.int64)], axis=1))
+        self.runs.append(run_file)
+        self.chunks = []
+        self.size = 0
+
+    def blocks(self):
+        """yield (keys, counts) blocks of every n-gram in key order
+        """
+        self.spill()
+        return merge_runs(self.runs)
+
+    def top(self, top=TOP_NGRAMS):
+        """({n-gram: count} of the top n-grams, count of distinct n-grams)
+
+        top=None keeps every n-gram, all of them are then held in memory
+        """
+        uniq = 0
+        top_keys = [np.zeros(0, dtype=np.int64)]
+        top_counts = [np.zeros(0, dtype=np.int64)]
+        for keys, counts in self.blocks():
+            uniq += len(keys)
+            top_keys.append(keys)
+            top_counts.append(counts)
+            if top is not None:
+                # keep only the running top entries of the merged blocks
+                keys = np.concatenate(top_keys)
+                counts = np.concatenate(top_counts)
+                if len(counts) > top:
+                    part = np.argpartition(-counts, top - 1)[:top]
+                    keys, counts = keys[part], counts[part]
+                top_keys, top_counts = [keys], [counts]
+        keys = np.concatenate(top_keys).tolist()
+        counts = np.concatenate(top_counts).tolist()
+        return {ngram_text(key, self.n): count
+                for key, count in zip(keys, counts)}, uniq
+
+    def close(self):
+        """remove the spilled runs
+        """
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.runs = []
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Hanzi frequency query service over report files
+"""
+
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils import pop_option
+
+REPORT_PATTERN = 'report-*.csv'
+# report-<src>-<n>gram.csv and report-<src>-<first>-<last>.csv also match
+# REPORT_PATTERN but are not source reports
+NOT_SOURCE_REPORT = re.compile(r'-(\d+gram|\d{4}(-\d\d)?-\d{4}(-\d\d)?)$')
+# seconds between checks of the report files for changes
+CHECK_INTERVAL = 1.0
+
+
+def report_name(report_file):
+    """'news.apple' of report-news.apple.csv
+    """
+    name = os.path.basename(report_file)
+    return name[len('report-'):-len('.csv')]
+
+
+def is_source_report(report_file):
+    """check report_file is the report of a whole source, not an n-gram
+    or date range report
+    """
+    return NOT_SOURCE_REPORT.search(report_name(report_file)) is None
+
+
+class Report():
+    """one report in rank order with cumulative counts
+    """
+
+    def __init__(self, report_file):
+        self.report_file = report_file
+        self.mtime = os.stat(report_file).st_mtime
+        self.chars = []
+        self.counts = []
+        self.cums = []
+        with open(report_file, encoding='utf8', newline='') as fin:
+            reader = csv.reader(fin)
+            next(reader)
+            accum = 0
+            for row in reader:
+                accum += int(row[3])
+                self.chars.append(row[1])
+                self.counts.append(int(row[3]))
+                self.cums.append(accum)
+        self.total = accum
+        self.ranks = {char: i for i, char in enumerate(self.chars)}
+
+    def lookup(self, char):
+        """{char, rank, count, freq}, rank 0 and count 0 if absent
+        """
+        i = self.ranks.get(char)
+        if i is None:
+            return {'char': char, 'rank': 0, 'count': 0, 'freq': 0.0}
+        return {'char': char, 'rank': i + 1, 'count': self.counts[i],
+                'freq': self.counts[i] / self.total}
+
+    def coverage(self, share):
+        """how many top chars cover share of all occurrences
+        """
+        if not self.cums:
+            return 0
+        return min(bisect_left(self.cums, share * self.total) + 1,
+                   len(self.cums))
+
+
+class ReportIndex():
+    """every report of a directory, reloaded when the files change
+    """
+
+    def __init__(self, report_dir='.', check_interval=CHECK_INTERVAL):
+        self.report_dir = report_dir
+        self.check_interval = check_interval
+        self.checked_at = 0.0
+        self.reports = {}
+        self.refresh()
+
+    def refresh(self, force=False):
+        """load new or changed reports and drop removed ones
+        """
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        reports = {}
+        for report_file in filter(is_source_report, glob.glob(
+                os.path.join(self.report_dir, REPORT_PATTERN))):
+            name = report_name(report_file)
+            report = self.reports.get(name)
+            try:
+                if report is None or os.stat(report_file).st_mtime != report.mtime:
+                    report = Report(report_file)
+            except (OSError, ValueError, IndexError, StopIteration):
+                # being rewritten, keep the loaded one until the next check
+                if report is None:
+                    continue
+            reports[name] = report
+        self.reports = reports
+
+    def report(self, src='all'):
+        """report of src, KeyError if none
+        """
+        self.refresh()
+        return self.reports[src]
+
+    def rank(self, char, src='all'):
+        """rank of char in src, 0 if absent
+        """
+        return self.report(src).lookup(char)['rank']
+
+    def freq(self, char, src='all'):
+        """(count, frequency) of char in src
+        """
+        result = self.report(src).lookup(char)
+        return result['count'], result['freq']
+
+    def coverage(self, share, src='all'):
+        """how many top chars cover share of src
+        """
+        return self.report(src).coverage(share)
+
+    def top_chars(self, cnt, src='all'):
+        """the top cnt chars of src
+        """
+        return ''.join(self.report(src).chars[:cnt])
+
+    def batch(self, chars, src='all'):
+        """lookups of many chars in src
+        """
+        report = self.report(src)
+        return [report.lookup(char) for char in chars]
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """GET /rank|/freq|/batch?char=...&src=..., /coverage?share=...&src=...,
+    /reports; answers json
+    """
+
+    index = None
+
+    def do_GET(self):
+        """answer one query
+        """
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        src = query.get('src', 'all')
+        try:
+            if url.path in ('/rank', '/freq'):
+                result = self.index.batch(query['char'][:1], src)[0]
+            elif url.path == '/batch':
+                result = self.index.batch(query['char'], src)
+            elif url.path == '/coverage':
+                share = float(query['share'])
+                cnt = self.index.coverage(share, src)
+                result = {'share': share, 'count': cnt}
+                if 'chars' in query:
+                    result['chars'] = self.index.top_chars(cnt, src)
+            elif url.path == '/reports':
+                self.index.refresh()
+                result = {name: {'uniq': len(report.chars), 'total': report.total}
+                          for name, report in sorted(self.index.reports.items())}
+            else:
+                self.send_error(404)
+                return
+        except (KeyError, ValueError) as err:
+            self.send_error(400, 'bad query: {0}'.format(err))
+            return
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(report_dir='.', host='127.0.0.1', port=8765):
+    """serve queries over http until interrupted
+    """
+    QueryHandler.index = ReportIndex(report_dir)
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print('serving {0} reports of {1} on http://{2}:{3}/'.format(
+        len(QueryHandler.index.reports), report_dir, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} command [--dir report-dir] [--src src]'.format(sys.argv[0]))
+    print('')
+    print('    serve [--host h] [--port p]    serve queries over http')
+    print('    rank <chars>                   rank, count and frequency of each char')
+    print('    coverage <share>               top chars covering share, e.g. 0.99')
+
+
+if __name__ == '__main__':
+    REPORT_DIR = pop_option(sys.argv, '--dir', '.')
+    SRC = pop_option(sys.argv, '--src', 'all')
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(0)
+    elif sys.argv[1] == 'serve':
+        HOST = pop_option(sys.argv, '--host', '127.0.0.1')
+        PORT = int(pop_option(sys.argv, '--port', 8765))
+        serve(REPORT_DIR, HOST, PORT)
+    elif sys.argv[1] == 'rank':
+        for RESULT in ReportIndex(REPORT_DIR).batch(sys.argv[2], SRC):
+            print('{char} {rank:>6} {count:>12,} {freq:.6f}'.format(**RESULT))
+    elif sys.argv[1] == 'coverage':
+        CNT = ReportIndex(REPORT_DIR).coverage(float(sys.argv[2]), SRC)
+        print('{0:,} chars cover {1} of [{2}]'.format(CNT, sys.argv[2], SRC))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Approximate hanzi frequency sketches
+"""
+
+import atexit
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+from hzstats import count_hanzi
+
+CMS_WIDTH = 1 << 14
+CMS_DEPTH = 4
+TOPK_CAPACITY = 2000
+# hash rows are ((a * cp + b) mod p) mod width, seeded so sketches merge
+HASH_PRIME = (1 << 31) - 1
+HASH_SEED = 20170601
+SAVE_INTERVAL = 30.0
+
+
+def hash_params(depth, seed=HASH_SEED):
+    """(a, b) uint64 columns of the count-min hash rows
+    """
+    rnd = np.random.RandomState(seed)
+    hash_a = rnd.randint(1, HASH_PRIME, size=(depth, 1)).astype(np.uint64)
+    hash_b = rnd.randint(0, HASH_PRIME, size=(depth, 1)).astype(np.uint64)
+    return hash_a, hash_b
+
+
+class FreqSketch():
+    """count-min sketch of hanzi counts with a space-saving top-k
+
+    the count-min table gives an over-estimate of any hanzi, the top-k
+    keeps the heaviest hanzi with their over-estimate error; both are
+    fixed size and merge by addition, so every crawler process keeps its
+    own sketch file and readers merge them
+    """
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, capacity=TOPK_CAPACITY,
+                 file_name=None, save_interval=SAVE_INTERVAL):
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.hash_a, self.hash_b = hash_params(depth)
+        self.capacity = capacity
+        # space-saving entries, sorted by code point
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.errors = np.zeros(0, dtype=np.int64)
+        self.total = 0
+        self.art_cnt = 0
+        self.file_name = file_name
+        self.save_interval = save_interval
+        self.saved_at = time.time()
+
+    def hash_cols(self, cps):
+        """count-min columns of code points, one row per hash
+        """
+        cps = np.asarray(cps, dtype=np.uint64)
+        return ((self.hash_a * cps + self.hash_b) % HASH_PRIME
+                % np.uint64(self.table.shape[1])).astype(np.int64)
+
+    def add(self, cps, counts):
+        """add counts of unique code points
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        cols = self.hash_cols(cps)
+        for row in range(len(self.table)):
+            # colliding code points of one text must all be added
+            np.add.at(self.table[row], cols[row], counts)
+        self.merge_top(np.asarray(cps, dtype=np.int64), counts,
+                       np.zeros(len(counts), dtype=np.int64), 0)
+        self.total += int(counts.sum())
+
+    def add_text(self, *texts):
+        """add the hanzi of an article, saving the sketch now and then
+        """
+        self.add(*count_hanzi('\n'.join(text for text in texts if text)))
+        self.art_cnt += 1
+        if self.file_name and time.time() - self.saved_at >= self.save_interval:
+            self.save()
+
+    def floor(self):
+        """count of an entry missing from a full top-k, 0 if not full
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return int(self.counts.min())
+
+    def merge_top(self, keys, counts, errors, floor):
+        """merge space-saving entries whose missing entries count floor
+        """
+        self_floor = self.floor()
+        all_keys = np.union1d(self.keys, keys)
+        all_counts = np.full(len(all_keys), self_floor + floor, dtype=np.int64)
+        all_errors = all_counts.copy()
+        pos = np.searchsorted(all_keys, self.keys)
+        all_counts[pos] += self.counts - self_floor
+        all_errors[pos] += self.errors - self_floor
+        pos = np.searchsorted(all_keys, keys)
+        all_counts[pos] += counts - floor
+        all_errors[pos] += errors - floor
+        if len(all_keys) > self.capacity:
+            keep = np.sort(np.argpartition(-all_counts, self.capacity - 1)
+                           [:self.capacity])
+            all_keys, all_counts, all_errors = \
+                all_keys[keep], all_counts[keep], all_errors[keep]
+        self.keys, self.counts, self.errors = all_keys, all_counts, all_errors
+
+    def merge(self, other):
+        """merge a sketch of the same size
+        """
+        if (self.table.shape != other.table.shape or
+                self.capacity != other.capacity or
+                not np.array_equal(self.hash_a, other.hash_a)):
+            raise ValueError('sketches of different shape cannot merge')
+        self.table += other.table
+        self.merge_top(other.keys, other.counts, other.errors, other.floor())
+        self.total += other.total
+        self.art_cnt += other.art_cnt
+
+    def estimate(self, chars):
+        """count-min over-estimates of chars
+        """
+        cols = self.hash_cols([ord(char) for char in chars])
+        return self.table[np.arange(len(self.table))[:, None], cols].min(axis=0)
+
+    def top(self, top=1000):
+        """[(char, count, error)] of the heaviest hanzi, count - error is a
+        lower bound of the true count
+        """
+        order = np.lexsort((self.keys, -self.counts))[:top]
+        return list(zip(map(chr, self.keys[order].tolist()),
+                        self.counts[order].tolist(), self.errors[order].tolist()))
+
+    def coverage(self, top=1000):
+        """(lower, upper) share of all hanzi covered by the top hanzi
+        """
+        if self.total == 0:
+            return 0.0, 0.0
+        ranked = self.top(top)
+        upper = sum(count for _, count, _ in ranked)
+        lower = sum(count - error for _, count, error in ranked)
+        return lower / self.total, min(upper / self.total, 1.0)
+
+    def save(self, file_name=None):
+        """write the sketch, replacing file_name atomically
+        """
+        file_name = file_name or self.file_name
+        # unique per process, two processes saving one file never share it
+        tmp_name = '{0}.{1}.tmp'.format(file_name, os.getpid())
+        with open(tmp_name, 'wb') as fout:
+            np.savez_compressed(fout, table=self.table, hash_a=self.hash_a,
+                                keys=self.keys, counts=self.counts, errors=self.errors,
+                                meta=np.array([self.capacity, self.total, self.art_cnt]))
+        os.replace(tmp_name, file_name)
+        self.saved_at = time.time()
+
+    @classmethod
+    def load(cls, file_name):
+        """read a saved sketch
+        """
+        with np.load(file_name) as data:
+            depth, width = data['table'].shape
+            capacity, total, art_cnt = data['meta'].tolist()
+            sketch = cls(width, depth, capacity)
+            if not np.array_equal(sketch.hash_a, data['hash_a']):
+                raise ValueError('{0} has unknown hash seeds'.format(file_name))
+            sketch.table = data['table']
+            sketch.keys = data['keys']
+            sketch.counts = data['counts']
+            sketch.errors = data['errors']
+        sketch.total = total
+        sketch.art_cnt = art_cnt
+        return sketch
+
+
+def open_sketch(name):
+    """sketch of this crawler process, saved to sketch-<name>-<pid>.npz
+    periodically and at exit; readers merge the files of every process
+
+    a file left by an earlier process of the same pid is loaded so its
+    counts are kept
+    """
+    file_name = 'sketch-{0}-{1}.npz'.format(name, os.getpid())
+    sketch = FreqSketch.load(file_name) if os.path.exists(file_name) else FreqSketch()
+    sketch.file_name = file_name
+    atexit.register(sketch.save)
+    return sketch
+
+
+def merge_files(file_names):
+    """merge saved sketches into one
+    """
+    sketch = FreqSketch()
+    for file_name in file_names:
+        sketch.merge(FreqSketch.load(file_name))
+    return sketch
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} command'.format(sys.argv[0]))
+    print('')
+    print('    top [n] [sketch ...]         top n hanzi of merged sketches (sketch-*.npz)')
+    print('    coverage [sketch ...]        coverage of the top 100 to 5000 hanzi')
+    print('    merge <out> <sketch ...>     merge sketches into one file, name it')
+    print('                                 outside sketch-*.npz or it is counted again')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print_usage()
+        sys.exit(0)
+    elif sys.argv[1] == 'top':
+        TOP = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        SKETCH = merge_files(sys.argv[3:] or sorted(glob.glob('sketch-*.npz')))
+        ACCUM = 0
+        for RANK, (CHAR, COUNT, ERROR) in enumerate(SKETCH.top(TOP)):
+            ACCUM += COUNT
+            print('{0:>5} {1} {2:>12,} ±{3:<10,} {4:.4f}'.format(
+                RANK + 1, CHAR, COUNT, ERROR, ACCUM / max(SKETCH.total, 1)))
+    elif sys.argv[1] == 'coverage':
+        SKETCH = merge_files(sys.argv[2:] or sorted(glob.glob('sketch-*.npz')))
+        print('{0:,} articles, {1:,} hanzi'.format(SKETCH.art_cnt, SKETCH.total))
+        for TOP in (100, 500, 1000, 2000, 5000):
+            if TOP > SKETCH.capacity:
+                break
+            print('  top {0:>5}: {1:.4f} - {2:.4f}'.format(TOP, *SKETCH.coverage(TOP)))
+    elif sys.argv[1] == 'merge':
+        merge_files(sys.argv[3:]).save(sys.argv[2])
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Sparse per-article hanzi matrix
+"""
+
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+from hzcalc import (FORUM_PREFIX, SOURCES, HanziCalculator, forum_source,
+                    print_result, save_report)
+from hzstats import UNIHAN_MAX, FreqAccumulator, unpack_stats
+from utils import Progress, pop_option
+
+SQL_SELECT_META = '''
+SELECT src, idx, pub_date, hanzi_cnt FROM articles ORDER BY rowid
+'''
+SQL_SELECT_STATS = '''
+SELECT src, idx, stats FROM articles ORDER BY rowid
+'''
+SQL_COUNT_ARTICLES = '''
+SELECT COUNT(*) FROM articles
+'''
+
+# csr arrays of a matrix directory, opened as memmaps
+CSR_FILES = ('indptr', 'indices', 'data')
+META_FILE = 'meta.npz'
+
+
+def source_of(src):
+    """registered source of a src, None if unknown
+    """
+    if src.startswith(FORUM_PREFIX):
+        return forum_source(src[len(FORUM_PREFIX):])
+    for source in SOURCES.values():
+        if source.src == src:
+            return source
+    return None
+
+
+def load_sections(srcs, source_dir='.'):
+    """{(src, idx): section} from the source dbs found in source_dir
+    """
+    sections = {}
+    for src in srcs:
+        source = source_of(src)
+        if source is None:
+            continue
+        db_file = os.path.join(source_dir, source.db_file)
+        if not os.path.exists(db_file):
+            continue
+        conn = sqlite3.connect(db_file)
+        for idx, section in conn.execute(source.sql_section):
+            sections[(src, '' if idx is None else str(idx))] = section or ''
+        conn.close()
+    return sections
+
+
+class ArticleMatrix():
+    """articles x hanzi counts in csr layout
+
+    row i holds code points indices[indptr[i]:indptr[i + 1]] and their
+    counts in data; columns are code points, so a column sum lines up
+    with FreqAccumulator. meta columns src, idx, pub_date and section are
+    numpy string arrays, one entry per row
+    """
+
+    def __init__(self, indptr, indices, data, meta):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.src = meta['src']
+        self.idx = meta['idx']
+        self.pub_date = meta['pub_date']
+        self.section = meta['section']
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @classmethod
+    def export(cls, db_file='hzfreq.db', out_dir='hzsparse', source_dir='.',
+               verbose=False):
+        """export the stats of every article in db_file to out_dir
+        """
+        # opening through HanziCalculator upgrades an old schema first
+        HanziCalculator(db_name=db_file).conn.close()
+        os.makedirs(out_dir, exist_ok=True)
+        conn = sqlite3.connect(db_file)
+        srcs, idxs, pub_dates, hanzi_cnts = [], [], [], []
+        for src, idx, pub_date, hanzi_cnt in conn.execute(SQL_SELECT_META):
+            srcs.append(src)
+            idxs.append('' if idx is None else str(idx))
+            pub_dates.append(pub_date or '')
+            hanzi_cnts.append(hanzi_cnt)
+        sections = load_sections(set(srcs), source_dir)
+        np.savez(os.path.join(out_dir, META_FILE),
+                 src=np.array(srcs, dtype=str),
+                 idx=np.array(idxs, dtype=str),
+                 pub_date=np.array(pub_dates, dtype=str),
+                 section=np.array([sections.get(key, '')
+                                   for key in zip(srcs, idxs)], dtype=str))
+
+        # rows are sized from hanzi_cnt, then stats are copied in place
+        indptr = np.zeros(len(srcs) + 1, dtype=np.int64)
+        np.cumsum(hanzi_cnts, out=indptr[1:])
+        nnz = int(indptr[-1])
+        np.save(os.path.join(out_dir, 'indptr.npy'), indptr)
+        indices = np.lib.format.open_memmap(
+            os.path.join(out_dir, 'indices.npy'), mode='w+', dtype='<u4',
+            shape=(nnz,))
+        data = np.lib.format.open_memmap(
+            os.path.join(out_dir, 'data.npy'), mode='w+', dtype='<u4',
+            shape=(nnz,))
+        progress = Progress(db_file, conn.execute(SQL_COUNT_ARTICLES).fetchone()[0],
+                            verbose=verbose)
+        for i, (src, idx, stats) in enumerate(conn.execute(SQL_SELECT_STATS)):
+            cps, counts = unpack_stats(stats)
+            lo, hi = indptr[i], indptr[i + 1]
+            if len(cps) != hi - lo:
+                raise ValueError('{0}[{1}] has {2} hanzi, hanzi_cnt says {3}'.format(
+                    src, idx, len(cps), hi - lo))
+            indices[lo:hi] = cps
+            data[lo:hi] = counts
+            progress.update(1, int(counts.sum()), 'export %s[%s]', src, idx)
+        progress.done()
+        conn.close()
+        indices.flush()
+        data.flush()
+        del indices, data
+        return cls.load(out_dir)
+
+    @classmethod
+    def load(cls, out_dir='hzsparse'):
+        """open an exported matrix, csr arrays are memory mapped
+        """
+        arrays = [np.load(os.path.join(out_dir, name + '.npy'), mmap_mode='r')
+                  for name in CSR_FILES]
+        with np.load(os.path.join(out_dir, META_FILE)) as meta:
+            return cls(*arrays, dict(meta))
+
+    def mask(self, src=None, section=None, first=None, last=None):
+        """boolean row mask, None matches all
+
+        src and section take a value or a list of values, first and last
+        are inclusive pub_date prefixes such as '2010' or '2012-06'
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if src is not None:
+            mask &= np.isin(self.src, [src] if isinstance(src, str) else src)
+        if section is not None:
+            mask &= np.isin(self.section,
+                            [section] if isinstance(section, str) else section)
+        if first is not None:
+            mask &= self.pub_date >= first
+        if last is not None:
+            mask &= self.pub_date.astype('<U{0}'.format(len(last))) <= last
+        return mask
+
+    def subset(self, mask):
+        """column sum of the rows in mask, return (article count, FreqAccumulator)
+        """
+        entries = np.repeat(mask, np.diff(self.indptr))
+        acc = FreqAccumulator()
+        acc.counts += np.bincount(self.indices[entries],
+                                  weights=self.data[entries],
+                                  minlength=UNIHAN_MAX + 1).astype(np.int64)
+        return int(np.count_nonzero(mask)), acc
+
+
+if __name__ == '__main__':
+    MATRIX_DIR = pop_option(sys.argv, '--matrix', 'hzsparse')
+    SRC = pop_option(sys.argv, '--src')
+    SECTION = pop_option(sys.argv, '--section')
+    FIRST = pop_option(sys.argv, '--from')
+    LAST = pop_option(sys.argv, '--to')
+    if len(sys.argv) < 2:
+        print('usage: {0} command [--matrix dir]'.format(sys.argv[0]))
+        print('')
+        print('    export [db] [source dir]     export article stats of db (hzfreq.db)')
+        print('    report <csv> [--src s] [--section s] [--from date] [--to date]')
+        print('                                 subset report, src and section take a,b,c')
+        sys.exit(0)
+    elif sys.argv[1] == 'export':
+        MATRIX = ArticleMatrix.export(
+            sys.argv[2] if len(sys.argv) > 2 else 'hzfreq.db', MATRIX_DIR,
+            sys.argv[3] if len(sys.argv) > 3 else '.')
+        print('{0:,} articles, {1:,} entries'.format(len(MATRIX), len(MATRIX.data)))
+    elif sys.argv[1] == 'report':
+        MATRIX = ArticleMatrix.load(MATRIX_DIR)
+        MASK = MATRIX.mask(SRC and SRC.split(','), SECTION and SECTION.split(','),
+                           FIRST, LAST)
+        ART_CNT, ACC = MATRIX.subset(MASK)
+        save_report(ACC.to_freq(), sys.argv[2])
+        print_result(sys.argv[2], ART_CNT, ACC.uniq(), ACC.total())
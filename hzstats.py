@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Hanzi statistics engine
+"""
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from utils import UNIHAN_EXT_RANGES, UNIHAN_RANGES
+
+UNIHAN_MAX = max(last for _, last in UNIHAN_RANGES)
+
+# packed stats: magic, n uint32 code points (sorted), n uint32 counts
+STATS_MAGIC = b'HZS\x01'
+
+# report snapshot: a header then one fixed-width record per hanzi in rank
+# order; total is the sum the frequencies are relative to
+SNAPSHOT_MAGIC = b'HZR\x01'
+SNAPSHOT_HEADER = np.dtype([('magic', 'S4'), ('rows', '<u4'), ('total', '<u8'),
+                            ('reserved', '<u8', 2)])
+SNAPSHOT_RECORD = np.dtype({'names': ['cp', 'ext', 'count', 'cum'],
+                            'formats': ['<u4', 'u1', '<u8', '<u8'],
+                            'offsets': [0, 4, 8, 16], 'itemsize': 24})
+
+ReportSnapshot = namedtuple('ReportSnapshot', ['rows', 'total', 'records'])
+
+
+def _build_unihan_table(ranges=UNIHAN_RANGES):
+    """lookup table of code point -> is in ranges
+    """
+    table = np.zeros(UNIHAN_MAX + 1, dtype=bool)
+    for first, last in ranges:
+        table[first:last + 1] = True
+    return table
+
+
+UNIHAN_TABLE = _build_unihan_table()
+UNIHAN_EXT_TABLE = _build_unihan_table(UNIHAN_EXT_RANGES)
+
+
+def to_codepoints(text):
+    """convert text to uint32 code point array
+    """
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+
+
+def unihan_mask(cps):
+    """boolean mask of the code points inside the CJK ideograph blocks
+    """
+    mask = cps <= UNIHAN_MAX
+    mask[mask] = UNIHAN_TABLE[cps[mask]]
+    return mask
+
+
+def count_hanzi(text):
+    """count hanzi of text, return (code points, counts) sorted by code point
+    """
+    cps = to_codepoints(text)
+    return np.unique(cps[unihan_mask(cps)], return_counts=True)
+
+
+def hanzi_freq(text):
+    """count hanzi of text, return {char: count}
+    """
+    cps, counts = count_hanzi(text)
+    return dict(zip(map(chr, cps.tolist()), counts.tolist()))
+
+
+def pack_stats(cps, counts):
+    """pack sorted code points and counts into a stats blob
+    """
+    return (STATS_MAGIC + np.asarray(cps, dtype='<u4').tobytes() +
+            np.asarray(counts, dtype='<u4').tobytes())
+
+
+def is_packed(blob):
+    """check a stats blob is packed or legacy json
+    """
+    return isinstance(blob, bytes) and blob[:len(STATS_MAGIC)] == STATS_MAGIC
+
+
+def unpack_stats(blob):
+    """unpack a stats blob into (code points, counts)
+
+    packed blobs are viewed zero-copy, legacy json blobs are parsed
+    """
+    if is_packed(blob):
+        arr = np.frombuffer(blob, dtype='<u4', offset=len(STATS_MAGIC))
+        half = len(arr) // 2
+        return arr[:half], arr[half:]
+    if isinstance(blob, bytes):
+        blob = blob.decode('utf-8')
+    hz_freq = json.loads(blob)
+    cps = np.array([ord(k) for k in hz_freq], dtype='<u4')
+    counts = np.array(list(hz_freq.values()), dtype='<u4')
+    order = np.argsort(cps)
+    return cps[order], counts[order]
+
+
+def stats_to_freq(blob):
+    """decode a stats blob into {char: count}
+    """
+    cps, counts = unpack_stats(blob)
+    return dict(zip(map(chr, cps.tolist()), counts.tolist()))
+
+
+class FreqAccumulator():
+    """dense hanzi frequency table indexed by code point
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(UNIHAN_MAX + 1, dtype=np.int64)
+
+    def add(self, cps, counts):
+        """add counts of unique code points
+        """
+        self.counts[cps] += counts
+
+    def add_stats(self, blob):
+        """add a packed or legacy json stats blob
+        """
+        self.add(*unpack_stats(blob))
+
+    def add_freq(self, hz_freq):
+        """add {char: count}
+        """
+        cps = np.array([ord(k) for k in hz_freq], dtype=np.int64)
+        counts = np.array(list(hz_freq.values()), dtype=np.int64)
+        self.add(cps, counts)
+
+    def merge(self, other):
+        """merge another accumulator
+        """
+        self.counts += other.counts
+
+    def uniq(self):
+        """count of distinct hanzi
+        """
+        return int(np.count_nonzero(self.counts))
+
+    def total(self):
+        """sum of all hanzi
+        """
+        return int(self.counts.sum())
+
+    def to_freq(self):
+        """convert to {char: count}
+        """
+        cps = np.flatnonzero(self.counts)
+        return dict(zip(map(chr, cps.tolist()), self.counts[cps].tolist()))
+
+
+class BucketAccumulator():
+    """sparse hanzi frequency tables keyed by bucket
+
+    article arrays are appended as is and reduced in one vectorized
+    group-by when read, so memory follows the staged entries rather than
+    the number of buckets
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.art_cnts = []
+        self.chunks = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, cps, counts):
+        """add counts of unique code points of one article to bucket key
+        """
+        if key not in self.buckets:
+            self.buckets[key] = len(self.buckets)
+            self.art_cnts.append(0)
+        bid = self.buckets[key]
+        self.art_cnts[bid] += 1
+        self.chunks.append((bid, cps, counts))
+        self.size += len(cps)
+
+    def items(self):
+        """reduce staged arrays, yield (key, art_cnt, cps, counts) per bucket
+        """
+        keys = list(self.buckets)
+        if self.size == 0:
+            for key in keys:
+                yield key, self.art_cnts[self.buckets[key]], \
+                    np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            return
+        bids = np.concatenate([np.full(len(cps), bid, dtype=np.int64)
+                               for bid, cps, _ in self.chunks])
+        cps = np.concatenate([cps for _, cps, _ in self.chunks])
+        counts = np.concatenate([counts for _, _, counts in self.chunks])
+        uniq, inverse = np.unique((bids << 32) | cps.astype(np.int64),
+                                  return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=counts,
+                           minlength=len(uniq)).astype(np.int64)
+        uniq_bids = uniq >> 32
+        bounds = np.searchsorted(uniq_bids, np.arange(len(keys) + 1))
+        for bid, key in enumerate(keys):
+            lo, hi = bounds[bid], bounds[bid + 1]
+            yield key, self.art_cnts[bid], uniq[lo:hi] & 0xffffffff, sums[lo:hi]
+
+
+def snapshot_file(report_file):
+    """snapshot file name beside a report csv
+    """
+    return os.path.splitext(report_file)[0] + '.hzr'
+
+
+def save_snapshot(file_name, cps, counts, total=None):
+    """write hanzi in rank order with their counts as a report snapshot
+    """
+    records = np.zeros(len(cps), dtype=SNAPSHOT_RECORD)
+    records['cp'] = cps
+    records['ext'] = UNIHAN_EXT_TABLE[records['cp']]
+    records['count'] = counts
+    np.cumsum(records['count'], out=records['cum'])
+    header = np.zeros(1, dtype=SNAPSHOT_HEADER)
+    header['magic'] = SNAPSHOT_MAGIC
+    header['rows'] = len(records)
+    header['total'] = total or (records['cum'][-1] if len(records) else 0)
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'wb') as fout:
+        fout.write(header.tobytes())
+        fout.write(records.tobytes())
+    os.replace(tmp_name, file_name)
+
+
+def load_snapshot(file_name):
+    """memory-map a report snapshot, return ReportSnapshot(rows, total,
+    records); records is a read-only record array, nothing is parsed
+    """
+    header = np.memmap(file_name, dtype=SNAPSHOT_HEADER, mode='r', shape=(1,))[0]
+    if header['magic'] != SNAPSHOT_MAGIC:
+        raise ValueError('{0} is not a report snapshot'.format(file_name))
+    rows = int(header['rows'])
+    if rows == 0:
+        records = np.zeros(0, dtype=SNAPSHOT_RECORD)
+    else:
+        records = np.memmap(file_name, dtype=SNAPSHOT_RECORD, mode='r',
+                            offset=SNAPSHOT_HEADER.itemsize, shape=(rows,))
+    return ReportSnapshot(rows, int(header['total']), records)
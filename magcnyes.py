@@ -5,14 +5,15 @@ import json
 import logging
 import sqlite3
 import sys
-from random import randint
-from time import sleep
 from urllib.error import HTTPError
-from urllib.request import Request, urljoin, urlopen
+from urllib.request import urljoin
 
 from bs4 import BeautifulSoup
 
-from utils import PARSER, date_iso, month_range
+from fetcher import FetchEngine, SiteLimit
+from hzsketch import open_sketch
+from utils import PARSER, date_iso, month_range, pop_flag
+from webcache import ResponseCache
 
 SQL_CREATE_TABLE_ARTICLES = '''
 CREATE TABLE IF NOT EXISTS articles (
@@ -40,18 +41,38 @@ INSERT OR IGNORE INTO rankings
 '''
 
 URL_NEWARTICLE = 'http://mag.cnyes.com/WebService/WebAjaxSvr.asmx/NewArticle'
+SITE_LIMIT = SiteLimit(rate=0.8, burst=3, min_rate=0.02, max_rate=4.0,
+                       concurrency=4, slow=2.0)
+
+
+def parse_page(html):
+    """(content, next page href) of an article page, content is None if
+    broken and href None on the last page
+    """
+    soup = BeautifulSoup(html, PARSER)
+    div_contents = soup.find_all('div', {'class': 'content'})
+    if div_contents is None or len(div_contents) == 0:
+        soup.decompose()
+        return None, None
+    cont = div_contents[0].text
+    bnext_btns = soup.find_all('a', {'class': 'bnext'})
+    url_page = bnext_btns[0].get('href') if len(bnext_btns) != 0 else None
+    soup.decompose()
+    return cont, url_page
 
 
 class MagCnyesCrawler():
     """Crawler of MagCnyes
     """
 
-    def __init__(self):
-        self.urlopen_count = 0
+    def __init__(self, from_cache=False):
+        self.sketch = open_sketch('magcnyes')
         self.columns = {1: u'時尚', 2: u'生活', 7: u'醫美', 8: u'旅遊',
                         9: u'藝文', 10: u'設計', 3: u'商業', 5: u'理財', 6: u'科技'}
         self.init_db()
         self.init_logger()
+        self.engine = FetchEngine(SITE_LIMIT, logger=self.logger, cache=ResponseCache(
+            'cache-magcnyes.db', offline=from_cache))
         self.logger.info('---- [MagCnyesCrawler] ---------------------------')
 
     def init_db(self):
@@ -87,32 +108,6 @@ class MagCnyesCrawler():
         self.logger.addHandler(wfh)
         self.logger.addHandler(dsh)
 
-    def sleep(self, sec=None):
-        """sleep
-        """
-        self.urlopen_count += 1
-        if sec is not None and self.urlopen_count % 10 != 0:
-            sleep(sec)
-            return
-        if self.urlopen_count % 100 == 0:
-            seconds = randint(30, 90)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(0, seconds, 2):
-                print(':', end='', flush=True)
-                sleep(2)
-            print(']')
-        elif self.urlopen_count % 10 == 0:
-            seconds = randint(5, 9)
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(seconds):
-                print('.', end='', flush=True)
-                sleep(1)
-            print(']')
-        else:
-            sleep(randint(1, 3))
-
     def contain_article(self, art_id):
         """check if contains article
         """
@@ -123,11 +118,13 @@ class MagCnyesCrawler():
         return result
 
     def insert_article(self, article_values):
-        """insert article
+        """insert article, new articles are fed to the frequency sketch
         """
         cur = self.conn.cursor()
         cur.execute(SQL_INSERT_ARTICLE, article_values)
         self.conn.commit()
+        if cur.rowcount == 1:
+            self.sketch.add_text(*article_values[6:])
         cur.close()
 
     def insert_ranking(self, ranking_values):
@@ -138,55 +135,73 @@ class MagCnyesCrawler():
         self.conn.commit()
         cur.close()
 
-    def crawl_article(self, art_id, col_id, title, full_title, mag_name, url_first):
-        """crawl_article
+    def article_job(self, art_id, col_id, title, full_title, mag_name, url_first):
+        """(url, context) job of the first page of an article, None if
+        skipped
         """
         self.logger.info('fetching article[%s] %s...', art_id, title)
 
         if mag_name in ('TAIPEI', 'Discover Taipei'):
             self.logger.info(
                 '      -> article[%s] in foreign language magazine (%s)', art_id, mag_name)
-            return
+            return None
 
         if self.contain_article(art_id):
             self.logger.info('      -> article[%s] contained and skip', art_id)
-            return
+            return None
 
-        cont = ''
-        page_cnt = 0
         url_base = urljoin(URL_NEWARTICLE, url_first)
-        url_page = url_first
-        while url_page is not None:
-            self.sleep(sec=0)
-            page_cnt += 1
-            url = urljoin(url_base, url_page)
-            try:
-                soup = BeautifulSoup(urlopen(url), PARSER)
-                div_contents = soup.find_all('div', {'class': 'content'})
-                if div_contents is None or len(div_contents) == 0:
-                    self.logger.warning(
-                        '      -> article[%s] content broken', art_id)
-                    return
-                cont += div_contents[0].text
-                bnext_btns = soup.find_all('a', {'class': 'bnext'})
-                if len(bnext_btns) == 0:
-                    url_page = None
-                else:
-                    url_page = bnext_btns[0].get('href')
-                soup.decompose()
-            except HTTPError as err:
-                self.logger.error('      -> article[%s] return code %d',
-                                  art_id, err.code)
-                return
+        context = {'art_id': art_id, 'col_id': col_id, 'title': title,
+                   'full_title': full_title, 'mag_name': mag_name,
+                   'url_first': url_first, 'url_base': url_base,
+                   'cont': '', 'page_cnt': 0}
+        return urljoin(url_base, url_first), context
+
+    def save_fetched_page(self, context, page):
+        """add a parsed page to its article, return the job of the next
+        page or insert the article after the last one
+        """
+        art_id = context['art_id']
+        cont, url_page = page
+        if cont is None:
+            self.logger.warning('      -> article[%s] content broken', art_id)
+            return []
+        context['cont'] += cont
+        context['page_cnt'] += 1
+        if url_page is not None:
+            return [(urljoin(context['url_base'], url_page), context)]
 
         # pub_date = '{0}-{1}-{2}'.format(url_first[9:13],
         #                                 url_first[13:15], url_first[15:17])
-        pub_date = date_iso(url_first[9:17])
+        pub_date = date_iso(context['url_first'][9:17])
+        col_id = context['col_id']
         article_values = [art_id, col_id, self.columns[col_id],
-                          mag_name, pub_date, title, full_title, cont]
+                          context['mag_name'], pub_date, context['title'],
+                          context['full_title'], context['cont']]
         self.insert_article(article_values)
-        self.logger.info(
-            '      -> article[%s] %s %d paged saved', art_id, title, page_cnt)
+        self.logger.info('      -> article[%s] %s %d paged saved',
+                         art_id, context['title'], context['page_cnt'])
+        return []
+
+    def fetch_failed(self, context, err):
+        """log a failed page fetch, the article is dropped
+        """
+        self.logger.error('      -> article[%s] fetch fail: %s',
+                          context['art_id'], err)
+
+    def crawl_article(self, art_id, col_id, title, full_title, mag_name, url_first):
+        """crawl_article
+        """
+        jobs = [self.article_job(art_id, col_id, title, full_title, mag_name, url_first)]
+        while jobs and jobs[0] is not None:
+            url, context = jobs[0]
+            try:
+                html = self.engine.fetch(url)
+            except HTTPError as err:
+                self.logger.error('      -> article[%s] return code %d',
+                                  art_id, err.code)
+                return
+            jobs = self.save_fetched_page(context, parse_page(html))
 
     def crawl_month(self, year, month, col_id, page_size):
         """crawl_month
@@ -196,25 +211,27 @@ class MagCnyesCrawler():
         start_date, end_date = month_range(year, month)
         req_body_json = '{{"Start":"{2}","End":"{3}","ColumnID":{0},"PageSize":{1},"PageIndex":1}}'
         data = req_body_json.format(col_id, page_size, start_date, end_date)
-        req = Request(url=URL_NEWARTICLE, data=data.encode(encoding='utf_8'))
-        req.add_header('Content-Type', 'application/json')
-        with urlopen(req) as resp:
-            data = json.loads(resp.read().decode('utf-8'))['d']
-            if data['List'] is None:
-                self.logger.info('      -> No List')
-                return
-            self.logger.info('      -> %d articles', len(data['List']))
-            for idx, art in enumerate(data['List']):
-                art_id = art['ArticleID']
-                full_title = art['FullTitle']
-                mag_name = art['MagName']
-                title = art['Title']
-                url = art['Url']
-                self.insert_ranking(
-                    [year, month, col_id, idx + 1, self.columns[col_id],
-                     art_id, title, full_title, mag_name, url])
-                self.crawl_article(art_id, col_id, title,
-                                   full_title, mag_name, url)
+        body = self.engine.fetch(URL_NEWARTICLE, data.encode(encoding='utf_8'),
+                                 {'Content-Type': 'application/json'})
+        data = json.loads(body.decode('utf-8'))['d']
+        if data['List'] is None:
+            self.logger.info('      -> No List')
+            return
+        self.logger.info('      -> %d articles', len(data['List']))
+        jobs = []
+        for idx, art in enumerate(data['List']):
+            art_id = art['ArticleID']
+            full_title = art['FullTitle']
+            mag_name = art['MagName']
+            title = art['Title']
+            url = art['Url']
+            self.insert_ranking(
+                [year, month, col_id, idx + 1, self.columns[col_id],
+                 art_id, title, full_title, mag_name, url])
+            jobs.append(self.article_job(art_id, col_id, title,
+                                         full_title, mag_name, url))
+        self.engine.run([job for job in jobs if job is not None],
+                        self.save_fetched_page, self.fetch_failed, parse_page)
 
     def fetch_all(self):
         """fetch_all
@@ -236,20 +253,23 @@ def print_usage():
     print('usage: {0} command'.format(sys.argv[0]))
     print('')
     print('    fetch   fetch ')
+    print('')
+    print('    --from-cache   parse cached responses only, no network')
 
 
 if __name__ == '__main__':
+    FROM_CACHE = pop_flag(sys.argv, '--from-cache')
     if len(sys.argv) < 2:
         print_usage()
         sys.exit(0)
     elif sys.argv[1] == 'all':
-        CRAWLER = MagCnyesCrawler()
+        CRAWLER = MagCnyesCrawler(FROM_CACHE)
         CRAWLER.fetch_all()
     elif sys.argv[1] == 'fetch':
-        MAG = MagCnyesCrawler()
+        MAG = MagCnyesCrawler(FROM_CACHE)
         MAG.fetch_all()
         # MAG.fetch_month(2017, 4, 7)
     elif sys.argv[1] == 'test':
-        CRAWLER = MagCnyesCrawler()
+        CRAWLER = MagCnyesCrawler(FROM_CACHE)
         # CRAWLER.crawl_article()
         CRAWLER.crawl_month(2016, 5, 3, 20)
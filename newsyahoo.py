@@ -7,14 +7,15 @@ import logging
 import re
 import sqlite3
 import sys
-from random import randint
-from time import sleep
 from urllib.error import HTTPError
-from urllib.request import Request, urljoin, urlopen
+from urllib.request import urljoin
 
 from bs4 import BeautifulSoup
 
-from utils import PARSER
+from fetcher import FetchEngine, SiteLimit
+from hzsketch import open_sketch
+from utils import PARSER, pop_flag
+from webcache import ResponseCache
 
 SQL_CREATE_TABLE_ARTICLES = '''
 CREATE TABLE IF NOT EXISTS articles (
@@ -45,16 +46,49 @@ URL_NEWS_YAHOO = 'https://tw.news.yahoo.com'
 URL_YAHOO_TODAY = 'https://tw.news.yahoo.com/topic/yahoo-today'
 URL_INDEXDATASERVICE_PATH = '/_td-news/api/resource/IndexDataService.getEditorialList;loadMore=true;count={0};start={1};mrs=%7B%22size%22%3A%7B%22w%22%3A220%2C%22h%22%3A128%7D%7D;uuid=f1d5a047-b405-4a6b-992b-f5298db387f5?'
 URL_INDEXDATASERVICE = URL_NEWS_YAHOO + URL_INDEXDATASERVICE_PATH
+SITE_LIMIT = SiteLimit(rate=0.4, burst=2, min_rate=0.02, max_rate=2.0,
+                       concurrency=4, slow=2.0)
+
+
+def parse_today_picks(html):
+    """hrefs of the full articles linked by a today picks page
+    """
+    soup = BeautifulSoup(html, PARSER)
+    hrefs = []
+    for elem in soup(text=re.compile(r'詳全文')):
+        if elem.parent.name == 'a':
+            hrefs.append(elem.parent['href'])
+    soup.decompose()
+    return hrefs
+
+
+def parse_article(html):
+    """(uuid, author, provider, pub_date, title, article) of an article
+    page, KeyError or AttributeError if it is not one
+    """
+    soup = BeautifulSoup(html, PARSER)
+    title = soup.find('header').text
+    art = soup.find('article').text
+    uuid = soup.find('article')['data-uuid']
+    pub_date = soup.find('time')['datetime'][:10]
+    author_tag = soup.find('div', {'class': 'author'})
+    provdr_tag = soup.find('span', {'class': 'provider-link'})
+    author = author_tag.text if author_tag != None else ''
+    provider = provdr_tag.text if provdr_tag != None else ''
+    soup.decompose()
+    return uuid, author, provider, pub_date, title, art
 
 
 class NewsYahooCrawler():
     """Crawler of news yahoo
     """
 
-    def __init__(self):
-        self.urlopen_count = 0
+    def __init__(self, from_cache=False):
+        self.sketch = open_sketch('newsyahoo')
         self.init_db()
         self.init_logger()
+        self.engine = FetchEngine(SITE_LIMIT, logger=self.logger, cache=ResponseCache(
+            'cache-newsyahoo.db', offline=from_cache))
         self.logger.info('---- [NewsYahooCrawler] ---------------------------')
 
     def init_db(self):
@@ -90,21 +124,6 @@ class NewsYahooCrawler():
         self.logger.addHandler(wfh)
         self.logger.addHandler(dsh)
 
-    def sleep(self):
-        """sleep
-        """
-        self.urlopen_count += 1
-        if self.urlopen_count % 3 == 0:
-            sleep(randint(2, 4))
-        if self.urlopen_count % 20 == 0:
-            seconds = 30
-            print('(count: {0}, sleep {1} seconds) ['.format(
-                self.urlopen_count, seconds), end='')
-            for _ in range(0, seconds, 2):
-                print(':', end='', flush=True)
-                sleep(2)
-            print(']')
-
     def contain_article(self, link):
         """contain_article
         """
@@ -123,99 +142,102 @@ class NewsYahooCrawler():
         cur.close()
 
     def insert_article(self, article_values):
-        """insert article
+        """insert article, new articles are fed to the frequency sketch
         """
         cur = self.conn.cursor()
         cur.execute(SQL_INSERT_ARTICLE, article_values)
         self.conn.commit()
+        if cur.rowcount == 1:
+            self.sketch.add_text(*article_values[5:])
         cur.close()
 
     def fetch_daily_summary_urls(self):
         """fetch_daily_summary_urls
         """
-        req = Request(url=URL_INDEXDATASERVICE)
         count = 30  # most 30
         start = 0
         daily_summary_urls = []
         while True:
-            req = Request(url=URL_INDEXDATASERVICE.format(count, start))
-            with urlopen(req) as furl:
-                if furl.getcode() != 200:
-                    self.logger.error('fetch error when start=%d', start)
-                    break
-                data = json.loads(furl.read().decode('utf-8'))
-                if data is None or len(data) == 0:
-                    self.logger.error('fetch nothing when start=%d', start)
-                    break
-
-                self.logger.info('fetch %d today picks from start=%d',
-                                 len(data), start)
-                for item in data:
-                    summary = [item['id'], item['title'], item['url']]
-                    daily_summary_urls.append(summary)
-                start += len(data)
+            try:
+                body = self.engine.fetch(URL_INDEXDATASERVICE.format(count, start))
+            except HTTPError:
+                self.logger.error('fetch error when start=%d', start)
+                break
+            data = json.loads(body.decode('utf-8'))
+            if data is None or len(data) == 0:
+                self.logger.error('fetch nothing when start=%d', start)
+                break
+
+            self.logger.info('fetch %d today picks from start=%d',
+                             len(data), start)
+            for item in data:
+                summary = [item['id'], item['title'], item['url']]
+                daily_summary_urls.append(summary)
+            start += len(data)
         return daily_summary_urls
 
+    def save_fetched_today_picks(self, summary, hrefs):
+        """save the article links of a parsed today picks page
+        """
+        hrefs_json = json.dumps(hrefs)
+        self.insert_today_picks(summary + [hrefs_json])
+
     def fetch_today_picks(self, daily_summary_urls):
         """fetch_today_picks
         """
+        jobs = []
         for summary in daily_summary_urls:
             self.logger.info('fetching today_picks [%s](%s)...',
                              summary[1], summary[0])
-            self.sleep()
-            url = urljoin(URL_NEWS_YAHOO, summary[2])
-            soup = BeautifulSoup(urlopen(url), PARSER)
-            hrefs = []
-            for elem in soup(text=re.compile(r'詳全文')):
-                if elem.parent.name == 'a':
-                    hrefs.append(elem.parent['href'])
-            soup.decompose()
-            hrefs_json = json.dumps(hrefs)
-            summary.append(hrefs_json)
-            self.insert_today_picks(summary)
+            jobs.append((urljoin(URL_NEWS_YAHOO, summary[2]), summary))
+        self.engine.run(jobs, self.save_fetched_today_picks, parse=parse_today_picks)
 
-    def fetch_article(self, url):
-        """fetch_article
+    def article_job(self, url):
+        """(url, url) job of an article, None if contained
         """
         self.logger.info('fetching article(%s)...', url)
         if self.contain_article(url):
             self.logger.info('      -> already saved link: %s', url)
+            return None
+        return url, url
+
+    def save_fetched_article(self, url, parsed):
+        """insert a parsed article page
+        """
+        article_values = [*parsed[:4], url, *parsed[4:]]
+        self.insert_article(article_values)
+        self.logger.info(
+            '      -> [%s] by "%s|%s" at %s', article_values[5],
+            article_values[2], article_values[1], article_values[3])
+
+    def fetch_failed(self, url, err):
+        """log a failed article fetch, or a page parse_article rejects
+        """
+        self.logger.error(
+            '      -> article(%s) fetch fail: %s: %s', url, type(err).__name__, err)
+
+    def fetch_article(self, url):
+        """fetch_article
+        """
+        if self.article_job(url) is None:
             return
-        self.sleep()
         try:
-            soup = BeautifulSoup(urlopen(url), PARSER)
-            title = soup.find('header').text
-            art = soup.find('article').text
-            uuid = soup.find('article')['data-uuid']
-            pub_date = soup.find('time')['datetime'][:10]
-            author_tag = soup.find('div', {'class': 'author'})
-            provdr_tag = soup.find('span', {'class': 'provider-link'})
-            author = author_tag.text if author_tag != None else ''
-            provider = provdr_tag.text if provdr_tag != None else ''
-            soup.decompose()
-            article_values = [uuid, author, provider,
-                              pub_date, url, title, art]
-            self.insert_article(article_values)
-            self.logger.info(
-                '      -> [%s] by "%s|%s" at %s', title, provider, author, pub_date)
-        except HTTPError as err:
-            self.logger.error(
-                '      -> article(%s) fetch fail: %s', url, err)
-        except KeyError as err:
-            self.logger.error(
-                '      -> article(%s) fetch fail: KeyError: %s', url, err)
-        except AttributeError as err:
-            self.logger.error(
-                '      -> article(%s) fetch fail: AttributeError: %s', url, err)
+            parsed = parse_article(self.engine.fetch(url))
+        except (HTTPError, KeyError, AttributeError) as err:
+            self.fetch_failed(url, err)
+            return
+        self.save_fetched_article(url, parsed)
 
     def fetch_articles(self):
         """fetch_articles
         """
         cur = self.conn.cursor()
-        for row in cur.execute(SQL_SELECT_TODAY_PICKS):
-            pick_links = json.loads(row[1])
-            for url in pick_links:
-                self.fetch_article(url)
+        urls = [url for row in cur.execute(SQL_SELECT_TODAY_PICKS)
+                for url in json.loads(row[1])]
+        cur.close()
+        jobs = (self.article_job(url) for url in urls)
+        self.engine.run((job for job in jobs if job is not None),
+                        self.save_fetched_article, self.fetch_failed, parse_article)
 
     def fetch_all(self):
         """fetch_all
@@ -231,16 +253,19 @@ def print_usage():
     print('usage: {0} command'.format(sys.argv[0]))
     print('')
     print('    fetch   fetch ')
+    print('')
+    print('    --from-cache   parse cached responses only, no network')
 
 
 if __name__ == '__main__':
+    FROM_CACHE = pop_flag(sys.argv, '--from-cache')
     if len(sys.argv) < 2:
         print_usage()
         sys.exit(0)
     elif sys.argv[1] == 'all':
-        CRAWLER = NewsYahooCrawler()
+        CRAWLER = NewsYahooCrawler(FROM_CACHE)
         CRAWLER.fetch_all()
     elif sys.argv[1] == 'test':
-        CRAWLER = NewsYahooCrawler()
+        CRAWLER = NewsYahooCrawler(FROM_CACHE)
         # CRAWLER.crawl_article()
         # CRAWLER.crawl_month(2016, 5, 3, 20)
@@ -2,12 +2,51 @@
 """utilities
 """
 import re
+import time
+from bisect import bisect_right
+from collections import Counter
+from datetime import timedelta
 from urllib import parse
 from calendar import monthrange
 from datetime import datetime
 
 PARSER = 'lxml'  # 'html.parser'
 
+UNIHAN_BASIC_RANGES = (
+    (0x4e00, 0x9fff),    # CJK Unified Ideographs
+)
+UNIHAN_EXT_RANGES = (
+    (0x3400, 0x4dbf),    # CJK Extension A
+    (0xf900, 0xfaff),    # CJK Compatibility Ideographs
+    (0x20000, 0x2a6df),  # CJK Extension B
+    (0x2a700, 0x2ebef),  # CJK Extension C,D,E,F
+    (0x2f800, 0x2fa1f),  # CJK Compatibility Ideographs Supplement
+    (0x30000, 0x3134f),  # CJK Extension G
+)
+UNIHAN_RANGES = UNIHAN_BASIC_RANGES + UNIHAN_EXT_RANGES
+
+
+def _char_class(ranges, negate=False):
+    """regex character class of code point ranges
+    """
+    return '[{0}{1}]'.format('^' if negate else '', ''.join(
+        '{0}-{1}'.format(chr(first), chr(last)) for first, last in ranges))
+
+
+RE_NON_HANZI = re.compile(_char_class(UNIHAN_RANGES, negate=True) + '+')
+RE_UNIHAN_EXT = re.compile(_char_class(UNIHAN_EXT_RANGES))
+
+
+def _range_bounds(ranges):
+    """sorted first and last + 1 of non-overlapping ranges, a code point is
+    inside one when an odd number of bounds are <= it
+    """
+    return tuple(sorted(bound for first, last in ranges for bound in (first, last + 1)))
+
+
+UNIHAN_BOUNDS = _range_bounds(UNIHAN_RANGES)
+UNIHAN_EXT_BOUNDS = _range_bounds(UNIHAN_EXT_RANGES)
+
 
 def datetime_iso():
     """datetime_iso
@@ -15,24 +54,86 @@ def datetime_iso():
     return datetime.now().replace(microsecond=0).isoformat(' ')
 
 
+class Progress():
+    """rate-limited progress reporter
+
+    print rows/s, hanzi/s and ETA at most once per `interval` seconds;
+    per-row detail lines are printed only when verbose
+    """
+
+    def __init__(self, src, total=None, interval=2.0, verbose=False):
+        self.src = src
+        self.total = total
+        self.interval = interval
+        self.verbose = verbose
+        self.rows = 0
+        self.hanzi = 0
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self, rows=1, hanzi=0, detail=None, *args):
+        """count processed rows/hanzi, `detail % args` printed if verbose
+        """
+        self.rows += rows
+        self.hanzi += hanzi
+        if self.verbose and detail is not None:
+            print('{0} INFO {1:,} {2}'.format(
+                datetime_iso(), self.rows, detail % args))
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+
+    def report(self, now=None):
+        """print current progress and throughput
+        """
+        elapsed = max((now or time.monotonic()) - self.start, 1e-9)
+        rows_rate = self.rows / elapsed
+        if self.total:
+            done = '{0:,}/{1:,} rows'.format(self.rows, self.total)
+            eta = timedelta(seconds=int(
+                max(self.total - self.rows, 0) / rows_rate)) if rows_rate else '-'
+        else:
+            done = '{0:,} rows'.format(self.rows)
+            eta = '-'
+        print('{0} INFO [{1}] {2}, {3:,.0f} rows/s, {4:,.0f} hanzi/s, ETA {5}'.format(
+            datetime_iso(), self.src, done, rows_rate, self.hanzi / elapsed, eta))
+
+    def done(self):
+        """print final progress
+        """
+        self.report()
+
+
 def is_unihan(char):
     """check a char is hanzi or not
     """
-    return ('\u4e00' <= char <= '\u9fff' or
-            is_unihan_ext(char))
+    return len(char) == 1 and bisect_right(UNIHAN_BOUNDS, ord(char)) % 2 == 1
 
 
 def is_unihan_ext(char):
+    """check a char is in an extension or compatibility block of
+    UNIHAN_EXT_RANGES
+    """
+    return len(char) == 1 and bisect_right(UNIHAN_EXT_BOUNDS, ord(char)) % 2 == 1
+
+
+def has_unihan_ext(text):
+    """check text has any char of the extension or compatibility blocks
+    """
+    return RE_UNIHAN_EXT.search(text) is not None
+
+
+def hanzi_only(text):
+    """strip all non-hanzi chars of text in one pass
     """
-    CJK Unified Ideographs Extension A: '\U00003400' <= char <= '\U00004dbf'
-    CJK Unified Ideographs Extension B: '\U00020000' <= char <= '\U0002a6df'
-    CJK Unified Ideographs Extension C: '\U0002a700' <= char <= '\U0002b73f'
-    CJK Unified Ideographs Extension D: '\U0002b740' <= char <= '\U0002b81f'
-    CJK Unified Ideographs Extension E: '\U0002b820' <= char <= '\U0002ceaf'
+    return RE_NON_HANZI.sub('', text)
+
+
+def hanzi_count(text):
+    """count hanzi of text in one pass, return {char: count}
     """
-    return ('\u3400' <= char <= '\u4dbf' or          # CJK Extension A
-            '\U00020000' <= char <= '\U0002a6df' or  # CJK Extension B
-            '\U0002a700' <= char <= '\U0002ceaf')    # CJK Extension C,D,E
+    return Counter(hanzi_only(text))
 
 
 def month_range(year, month):
@@ -69,3 +170,23 @@ def iri_to_uri(iri):
     #         part.encode('utf-8'))
     #     for parti, part in enumerate(parts)
     # )
+
+
+def pop_option(args, name, default=None):
+    """pop `name value` pair from command line args, return value or default
+    """
+    if name not in args:
+        return default
+    pos = args.index(name)
+    value = args[pos + 1]
+    del args[pos:pos + 2]
+    return value
+
+
+def pop_flag(args, name):
+    """pop flag `name` from command line args, return True if it was given
+    """
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""On-disk cache of raw HTTP responses
+"""
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import zlib
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from httppool import TIMEOUT
+
+SQL_CREATE_TABLE_RESPONSES = '''
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT, fetched_at TEXT, headers TEXT, etag TEXT, last_modified TEXT, digest TEXT,
+    PRIMARY KEY(url)
+)
+'''
+SQL_CREATE_TABLE_BODIES = '''
+CREATE TABLE IF NOT EXISTS bodies (
+    digest TEXT, size INTEGER, body BLOB,
+    PRIMARY KEY(digest)
+)
+'''
+SQL_SELECT_RESPONSE = '''
+SELECT r.etag, r.last_modified, b.body FROM responses r
+    JOIN bodies b ON b.digest=r.digest WHERE r.url=?
+'''
+SQL_INSERT_BODY = '''
+INSERT OR IGNORE INTO bodies (digest, size, body) VALUES (?, ?, ?)
+'''
+SQL_INSERT_RESPONSE = '''
+INSERT OR REPLACE INTO responses
+    (url, fetched_at, headers, etag, last_modified, digest) VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_TOUCH_RESPONSE = '''
+UPDATE responses SET fetched_at=? WHERE url=?
+'''
+SQL_SELECT_STATS = '''
+SELECT (SELECT COUNT(*) FROM responses), COUNT(*), TOTAL(size), TOTAL(LENGTH(body)) FROM bodies
+'''
+SQL_DELETE_ORPHAN_BODIES = '''
+DELETE FROM bodies WHERE digest NOT IN (SELECT digest FROM responses)
+'''
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """cache key form of url: lowercase scheme and host, no default port,
+    sorted query and no fragment
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += ':{0}'.format(parts.port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def cache_key(url, data=None):
+    """normalized url, and the digest of data if posted
+    """
+    key = normalize_url(url)
+    if data is not None:
+        key += ' POST ' + hashlib.sha1(data).hexdigest()
+    return key
+
+
+class ResponseCache():
+    """raw responses in sqlite, one row per url pointing at a zlib body
+    stored once per content digest
+
+    online, a cached url is revalidated with If-None-Match and
+    If-Modified-Since and a 304 answers with the cached body; offline,
+    only cached bodies are served and a miss is an HTTPError 504
+    """
+
+    def __init__(self, db_file, offline=False):
+        self.db_file = db_file
+        self.offline = offline
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(SQL_CREATE_TABLE_RESPONSES)
+        self.conn.execute(SQL_CREATE_TABLE_BODIES)
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.stored = 0
+
+    def lookup(self, key):
+        """(etag, last_modified, body) of key, None if not cached
+        """
+        with self.lock:
+            row = self.conn.execute(SQL_SELECT_RESPONSE, [key]).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], zlib.decompress(row[2])
+
+    def store(self, key, headers, body):
+        """store a response body and its headers
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        blob = zlib.compress(body, 6)
+        with self.lock:
+            self.conn.execute(SQL_INSERT_BODY, [digest, len(body), blob])
+            self.conn.execute(SQL_INSERT_RESPONSE, [
+                key, datetime.now().isoformat(' ', 'seconds'),
+                json.dumps(list(headers.items()), ensure_ascii=False),
+                headers.get('ETag'), headers.get('Last-Modified'), digest])
+            self.conn.commit()
+
+    def touch(self, key):
+        """mark a cached response as revalidated now
+        """
+        with self.lock:
+            self.conn.execute(SQL_TOUCH_RESPONSE,
+                              [datetime.now().isoformat(' ', 'seconds'), key])
+            self.conn.commit()
+
+    def get(self, pool, url, data=None, headers=None, timeout=TIMEOUT):
+        """body of url from the cache, revalidated on pool when online
+        """
+        key = cache_key(url, data)
+        cached = self.lookup(key)
+        if self.offline:
+            if cached is None:
+                raise HTTPError(url, 504, 'not in cache', None, None)
+            self.hits += 1
+            return cached[2]
+        headers = dict(headers or {})
+        if cached is not None:
+            if cached[0]:
+                headers['If-None-Match'] = cached[0]
+            if cached[1]:
+                headers['If-Modified-Since'] = cached[1]
+        status, resp_headers, body = pool.open(url, data, headers, timeout)
+        if status == 304 and cached is not None:
+            self.revalidated += 1
+            self.touch(key)
+            return cached[2]
+        self.store(key, resp_headers, body)
+        self.stored += 1
+        return body
+
+    def stats(self):
+        """(responses, bodies, raw bytes, stored bytes)
+        """
+        with self.lock:
+            return self.conn.execute(SQL_SELECT_STATS).fetchone()
+
+    def prune(self):
+        """delete bodies no response points at, return their count
+        """
+        with self.lock:
+            cur = self.conn.execute(SQL_DELETE_ORPHAN_BODIES)
+            self.conn.commit()
+        return cur.rowcount
+
+
+def print_usage():
+    """Print Usage
+    """
+    print('usage: {0} command <cache db>'.format(sys.argv[0]))
+    print('')
+    print('    stats    responses, bodies and sizes')
+    print('    prune    delete bodies replaced by newer responses')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print_usage()
+        sys.exit(0)
+    elif sys.argv[1] == 'stats':
+        RESPONSES, BODIES, RAW, STORED = ResponseCache(sys.argv[2]).stats()
+        print('{0:,} responses, {1:,} bodies, {2:,.0f} bytes in {3:,.0f} bytes'.format(
+            RESPONSES, BODIES, RAW, STORED))
+    elif sys.argv[1] == 'prune':
+        print('{0:,} bodies deleted'.format(ResponseCache(sys.argv[2]).prune()))
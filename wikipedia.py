@@ -6,12 +6,13 @@ import logging
 import sqlite3
 import sys
 from datetime import datetime
-from time import sleep
-from urllib.request import urlopen
 
 from bs4 import BeautifulSoup
 
-from utils import PARSER
+from fetcher import FetchEngine, SiteLimit
+from hzsketch import open_sketch
+from utils import PARSER, pop_flag
+from webcache import ResponseCache
 
 SQL_CREATE_TABLE_ARTICLES = '''
 CREATE TABLE IF NOT EXISTS articles (
@@ -30,16 +31,60 @@ INSERT OR IGNORE INTO articles (title, open_date, quality, category, url, articl
 URL_WIKI_FA_LIST = 'https://zh.wikipedia.org/zh-tw/Wikipedia:%E5%85%B8%E8%8C%83%E6%9D%A1%E7%9B%AE'
 URL_WIKI_GA_LIST = 'https://zh.wikipedia.org/zh-tw/Wikipedia:%E4%BC%98%E8%89%AF%E6%9D%A1%E7%9B%AE'
 URL_WIKI_ARTICLE = 'https://zh.wikipedia.org/zh-tw/{0}'
+# article pages are large, allow them more time before slowing down
+SITE_LIMIT = SiteLimit(rate=1.0, burst=4, min_rate=0.05, max_rate=8.0,
+                       concurrency=4, slow=3.0)
+
+
+def parse_article(html):
+    """text of an article page without navigation, references and
+    boxes, None if it has no content
+    """
+    soup = BeautifulSoup(html, PARSER)
+
+    # remove siteSub
+    soup.find(id='siteSub').extract()
+    # remove TOC
+    if soup.find(id='toc') is not None:
+        soup.find(id='toc').extract()
+    # remove div class=refbegin (reference)
+    for elem in soup.find_all('div', {'class': 'refbegin'}):
+        elem.extract()
+    # remove div class=reflist (reference)
+    for elem in soup.find_all('div', {'class': 'reflist'}):
+        elem.extract()
+    # remove all edit tag
+    for elem in soup.find_all('span', {'class': 'mw-editsection'}):
+        elem.extract()
+    # remove table infoBox
+    for elem in soup.find_all('table', {'class': 'infobox'}):
+        elem.extract()
+    # remove table navbox
+    for elem in soup.find_all('table', {'class': 'navbox'}):
+        elem.extract()
+    # remove table succession-box
+    for elem in soup.find_all('table', {'class': 'succession-box'}):
+        elem.extract()
+    # remove class=noprint
+    for elem in soup.find_all(attrs={'class': 'noprint'}):
+        elem.extract()
+
+    cont = soup.find(id='mw-content-text')
+    text = cont.text if cont is not None else None
+    soup.decompose()
+    return text
 
 
 class WikipediaCrawler():
     """Crawler of Wikipedia
     """
 
-    def __init__(self):
-        self.urlopen_count = 0
+    def __init__(self, from_cache=False):
+        self.sketch = open_sketch('wikipedia')
         self.init_db()
         self.init_logger()
+        self.engine = FetchEngine(SITE_LIMIT, logger=self.logger, cache=ResponseCache(
+            'cache-wikipedia.db', offline=from_cache))
         self.logger.info('---- [WikipediaCrawler] ---------------------------')
 
     def init_db(self):
@@ -74,12 +119,6 @@ class WikipediaCrawler():
         self.logger.addHandler(wfh)
         self.logger.addHandler(dsh)
 
-    def sleep(self):
-        """sleep
-        """
-        self.urlopen_count += 1
-        sleep(1)
-
     def contain_article(self, title):
         """check if contains article
         """
@@ -90,65 +129,54 @@ class WikipediaCrawler():
         return result
 
     def insert_article(self, article_values):
-        """insert article
+        """insert article, new articles are fed to the frequency sketch
         """
         cur = self.conn.cursor()
         cur.execute(SQL_INSERT_ARTICLE, article_values)
         self.conn.commit()
+        if cur.rowcount == 1:
+            self.sketch.add_text(article_values[0], article_values[5])
         cur.close()
 
-    def fetch_article(self, idx, title, href, cate, quality):
-        """fetch_article
+    def article_job(self, idx, title, href, cate, quality):
+        """(url, context) job of an article, None if contained
         """
         self.logger.info('%03d fetching article [%s](%s)...', idx, title, href)
         if self.contain_article(title):
             self.logger.info(
                 '          -> article [%s] contained and skip', title)
-            return
-        self.sleep()
-        url = URL_WIKI_ARTICLE.format(href[6:])
-        soup = BeautifulSoup(urlopen(url), PARSER)
-
-        # remove siteSub
-        soup.find(id='siteSub').extract()
-        # remove TOC
-        if soup.find(id='toc') is not None:
-            soup.find(id='toc').extract()
-        # remove div class=refbegin (reference)
-        for elem in soup.find_all('div', {'class': 'refbegin'}):
-            elem.extract()
-        # remove div class=reflist (reference)
-        for elem in soup.find_all('div', {'class': 'reflist'}):
-            elem.extract()
-        # remove all edit tag
-        for elem in soup.find_all('span', {'class': 'mw-editsection'}):
-            elem.extract()
-        # remove table infoBox
-        for elem in soup.find_all('table', {'class': 'infobox'}):
-            elem.extract()
-        # remove table navbox
-        for elem in soup.find_all('table', {'class': 'navbox'}):
-            elem.extract()
-        # remove table succession-box
-        for elem in soup.find_all('table', {'class': 'succession-box'}):
-            elem.extract()
-        # remove class=noprint
-        for elem in soup.find_all(attrs={'class': 'noprint'}):
-            elem.extract()
-
-        cont = soup.find(id='mw-content-text')
-        if cont is None:
+            return None
+        return URL_WIKI_ARTICLE.format(href[6:]), (title, href, cate, quality)
+
+    def save_fetched_article(self, context, text):
+        """insert the text of a parsed article page
+        """
+        title, href, cate, quality = context
+        if text is None:
             self.logger.error(
                 '          -> article [%s] has no content', title)
             return
-
-        soup.decompose()
         the_date = datetime.now().strftime('%Y-%m-%d')
-        art_val = [title, the_date, quality, cate, href, cont.text.strip()]
+        art_val = [title, the_date, quality, cate, href, text.strip()]
         self.insert_article(art_val)
         self.logger.info(
-            '          -> article [%s] with %d char saved', title, len(cont.text))
-        return
+            '          -> article [%s] with %d char saved', title, len(text))
+
+    def fetch_article(self, idx, title, href, cate, quality):
+        """fetch_article
+        """
+        job = self.article_job(idx, title, href, cate, quality)
+        if job is None:
+            return
+        self.save_fetched_article(job[1], parse_article(self.engine.fetch(job[0])))
+
+    def fetch_articles(self, articles, quality):
+        """fetch [title, href, cate] articles concurrently
+        """
+        jobs = (self.article_job(idx + 1, art[0], art[1], art[2], quality)
+                for idx, art in enumerate(articles))
+        self.engine.run((job for job in jobs if job is not None),
+                        self.save_fetched_article, parse=parse_article)
 
     def find_cate(self, node):
         h2 = node.find_previous_sibling('h2')
@@ -159,7 +187,7 @@ class WikipediaCrawler():
     def fetch_all_featured(self):
         """fetch_all featured
         """
-        soup = BeautifulSoup(urlopen(URL_WIKI_FA_LIST), PARSER)
+        soup = BeautifulSoup(self.engine.fetch(URL_WIKI_FA_LIST), PARSER)
 
         # starting tag node of featured article links
         node = soup.find(id='mw-content-text').find_all('table')[3].find_all('td')[0]
@@ -174,14 +202,12 @@ class WikipediaCrawler():
         soup.decompose()
 
         # save to db
-        for idx, art in enumerate(articles):
-            self.fetch_article(idx + 1, art[0], art[1], art[2], "featured")
-            # print('{3} {2}/{0}({1})'.format(*art, idx+1))
+        self.fetch_articles(articles, "featured")
 
     def fetch_all_good(self):
         """fetch_all good
         """
-        soup = BeautifulSoup(urlopen(URL_WIKI_GA_LIST), PARSER)
+        soup = BeautifulSoup(self.engine.fetch(URL_WIKI_GA_LIST), PARSER)
 
         # starting tag node of featured article links
         node = soup.find(id='content').find(
@@ -233,9 +259,7 @@ class WikipediaCrawler():
         soup.decompose()
 
         # save to db
-        for idx, art in enumerate(articles):
-            self.fetch_article(idx+1, art[0], art[1], art[2], "good")
-            # print('{3} {2}/{0}({1})'.format(*art, idx + 1))
+        self.fetch_articles(articles, "good")
 
 
 def print_usage():
@@ -244,14 +268,17 @@ def print_usage():
     print('usage: {0} command'.format(sys.argv[0]))
     print('')
     print('    all     fetch all')
+    print('')
+    print('    --from-cache   parse cached responses only, no network')
 
 
 if __name__ == '__main__':
+    FROM_CACHE = pop_flag(sys.argv, '--from-cache')
     if len(sys.argv) < 2:
         print_usage()
         sys.exit(0)
     elif sys.argv[1] == 'all':
-        WIKI = WikipediaCrawler()
+        WIKI = WikipediaCrawler(FROM_CACHE)
         WIKI.fetch_all_featured()
         WIKI.fetch_all_good()
         # print(WIKI.fetch_article('天津市耀華中學', '/wiki/%E5%A4%A9%E6%B4%A5%E5%B8%82%E8%80%80%E5%8D%8E%E4%B8%AD%E5%AD%A6'))